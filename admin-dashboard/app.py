@@ -1,11 +1,23 @@
 import os
+import re
+import json
+import random
+import base64
+import heapq
+import hashlib
 import sqlite3
 import secrets
+import shlex
 import subprocess
-from datetime import datetime, timedelta
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, g, has_request_context, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import requests
 from twilio.rest import Client
 
@@ -18,8 +30,9 @@ ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'axiomadmin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'Dannyle44!')
 NOTIFICATION_PHONE = os.environ.get('NOTIFICATION_PHONE', '+18017104034')
 
-# Branch URLs
-BRANCHES = {
+# Branches registered on first start; afterwards the branches table is the
+# source of truth and BRANCHES is this process's copy of it (see refresh_branches)
+DEFAULT_BRANCHES = {
     'tuc': {
         'name': 'Tucson',
         'url': os.environ.get('TUC_URL', 'http://twilio-app-tuc:5000'),
@@ -36,13 +49,102 @@ BRANCHES = {
         'public_url': os.environ.get('REX_PUBLIC_URL', 'https://rex.axiom-emergencies.com')
     }
 }
+BRANCHES = dict(DEFAULT_BRANCHES)
 
 # Twilio configuration for notifications
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER')
+# Notifications queued within this many seconds of the first are sent as one digest SMS
+NOTIFICATION_COALESCE_WINDOW = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW', '30'))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '5'))
 
 DATABASE_PATH = os.environ.get('DATABASE_PATH', '/app/data/admin.db')
+# Users shown per page on the user management page
+USERS_PAGE_SIZE = int(os.environ.get('USERS_PAGE_SIZE', '50'))
+# Branch cards shown per page on the main dashboard
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', '24'))
+# Seconds between background syncs of the local call recordings index
+RECORDINGS_SYNC_INTERVAL = int(os.environ.get('RECORDINGS_SYNC_INTERVAL', '300'))
+# On-disk LRU cache of recording audio served by the media proxy
+RECORDINGS_CACHE_DIR = os.environ.get('RECORDINGS_CACHE_DIR',
+                                      os.path.join(os.path.dirname(DATABASE_PATH), 'recordings_cache'))
+RECORDINGS_CACHE_MAX_BYTES = int(os.environ.get('RECORDINGS_CACHE_MAX_MB', '1024')) * 1024 * 1024
+# Recording archive jobs: content-addressed local store and download parallelism
+RECORDINGS_ARCHIVE_DIR = os.environ.get('RECORDINGS_ARCHIVE_DIR',
+                                        os.path.join(os.path.dirname(DATABASE_PATH), 'recordings_archive'))
+RECORDINGS_ARCHIVE_WORKERS = int(os.environ.get('RECORDINGS_ARCHIVE_WORKERS', '4'))
+# Twilio REST base URL (point at a local fake for testing)
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', 'https://api.twilio.com').rstrip('/')
+# Seconds a connection waits on a locked database before raising
+DATABASE_BUSY_TIMEOUT = float(os.environ.get('DATABASE_BUSY_TIMEOUT', '5'))
+
+# Server threads per worker (gunicorn --threads); long-lived requests are limited to a share of them
+WEB_THREADS = int(os.environ.get('WEB_THREADS', '32'))
+
+# Longest a branch's ?since_version= settings request is held open
+SETTINGS_LONG_POLL_TIMEOUT = int(os.environ.get('SETTINGS_LONG_POLL_TIMEOUT', '25'))
+# Each held long-poll occupies a server thread; past this many the request is
+# answered at once and the branch told to come back in SETTINGS_LONG_POLL_RETRY seconds
+SETTINGS_LONG_POLL_MAX = int(os.environ.get('SETTINGS_LONG_POLL_MAX', str(max(1, WEB_THREADS // 4))))
+SETTINGS_LONG_POLL_RETRY = int(os.environ.get('SETTINGS_LONG_POLL_RETRY', '30'))
+# Background reload pushes to branches after a settings save
+SETTINGS_PUSH_WORKERS = int(os.environ.get('SETTINGS_PUSH_WORKERS', '8'))
+SETTINGS_PUSH_TIMEOUT = int(os.environ.get('SETTINGS_PUSH_TIMEOUT', '5'))
+SETTINGS_PUSH_ATTEMPTS = int(os.environ.get('SETTINGS_PUSH_ATTEMPTS', '3'))
+
+# Calls to branch instances: pooled connections, retries and a per-branch circuit breaker
+PEER_POOL_SIZE = int(os.environ.get('PEER_POOL_SIZE', '16'))
+PEER_RETRY_ATTEMPTS = int(os.environ.get('PEER_RETRY_ATTEMPTS', '2'))
+PEER_RETRY_BACKOFF = float(os.environ.get('PEER_RETRY_BACKOFF', '0.5'))
+PEER_CIRCUIT_THRESHOLD = int(os.environ.get('PEER_CIRCUIT_THRESHOLD', '3'))
+PEER_CIRCUIT_RESET = int(os.environ.get('PEER_CIRCUIT_RESET', '30'))
+
+# Emergency triggers are forwarded to branches and tracked in the background
+TRIGGER_WORKERS = int(os.environ.get('TRIGGER_WORKERS', '8'))
+TRIGGER_FORWARD_ATTEMPTS = int(os.environ.get('TRIGGER_FORWARD_ATTEMPTS', '3'))
+TRIGGER_TRACK_INTERVAL = int(os.environ.get('TRIGGER_TRACK_INTERVAL', '2'))
+TRIGGER_TRACK_TIMEOUT = int(os.environ.get('TRIGGER_TRACK_TIMEOUT', '900'))
+
+# Branch container restarts: queued jobs, RESTART_WORKERS branches at a time. Each
+# waits for the branch to go idle, runs CONTAINER_RESTART_COMMAND ({branch} is the
+# branch key; point it at a stand-in script to test without Docker) and then
+# polls /api/status until the branch is healthy again.
+RESTART_WORKERS = int(os.environ.get('RESTART_WORKERS', '1'))
+CONTAINER_RESTART_COMMAND = os.environ.get('CONTAINER_RESTART_COMMAND', 'docker restart twilio_responder_{branch}')
+RESTART_COMMAND_TIMEOUT = int(os.environ.get('RESTART_COMMAND_TIMEOUT', '60'))
+RESTART_DRAIN_TIMEOUT = int(os.environ.get('RESTART_DRAIN_TIMEOUT', '600'))
+RESTART_HEALTH_TIMEOUT = int(os.environ.get('RESTART_HEALTH_TIMEOUT', '120'))
+RESTART_POLL_INTERVAL = float(os.environ.get('RESTART_POLL_INTERVAL', '2'))
+
+# Federated event queries: branch event streams opened concurrently and merged
+EVENT_QUERY_WORKERS = int(os.environ.get('EVENT_QUERY_WORKERS', '16'))
+EVENT_QUERY_TIMEOUT = int(os.environ.get('EVENT_QUERY_TIMEOUT', '60'))
+# Branch streams are only nearly sorted (concurrent log writers); each is re-sorted
+# within a window of this many events before the merge
+EVENT_REORDER_WINDOW = 256
+
+# Events shipped by branches: kept this many days; largest accepted batch after decompression
+EVENT_RETENTION_DAYS = int(os.environ.get('EVENT_RETENTION_DAYS', '90'))
+EVENT_BATCH_MAX_BYTES = int(os.environ.get('EVENT_BATCH_MAX_MB', '16')) * 1024 * 1024
+# Set by init_db: whether this SQLite build has FTS5 for event search
+EVENTS_FTS = False
+
+# Branch health polling: every branch is checked concurrently in the background
+# and pages render from the cached result instead of waiting on each branch.
+STATUS_POLL_INTERVAL = int(os.environ.get('STATUS_POLL_INTERVAL', '15'))
+STATUS_POLL_TIMEOUT = int(os.environ.get('STATUS_POLL_TIMEOUT', '5'))
+STATUS_STREAM_HEARTBEAT = int(os.environ.get('STATUS_STREAM_HEARTBEAT', '15'))
+# Every open SSE stream holds one of the WEB_THREADS server threads. At most STREAM_MAX_CONNECTIONS streams are held open at once and
+# each ends after STREAM_MAX_SECONDS (EventSource reconnects); past the cap a tab
+# gets one snapshot and is told to reconnect in STREAM_BUSY_RETRY seconds.
+STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', str(max(1, WEB_THREADS // 4))))
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', '300'))
+STREAM_BUSY_RETRY = int(os.environ.get('STREAM_BUSY_RETRY', '30'))
+# Branches are checked in shards of this size spread across the poll interval,
+# with at most STATUS_POLL_WORKERS checks in flight
+STATUS_POLL_SHARD_SIZE = int(os.environ.get('STATUS_POLL_SHARD_SIZE', '50'))
+STATUS_POLL_WORKERS = int(os.environ.get('STATUS_POLL_WORKERS', '32'))
 
 # Settings categories
 BASIC_SETTINGS = [
@@ -53,7 +155,9 @@ BASIC_SETTINGS = [
     'enable_emails',
     'enable_texts',
     'enable_call_recording',
-    'call_recording_page_size'
+    'call_recording_page_size',
+    'intake_queue_size',
+    'intake_priority_rules'
 ]
 
 ADVANCED_SETTINGS = [
@@ -71,13 +175,70 @@ ADMIN_ONLY_SETTINGS = [
     'enable_google_maps_link'
 ]
 
+# Allowed branch keys (used in URLs, settings rows and environment variable names)
+BRANCH_KEY_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+
+# Scope name in branch_settings for values every branch inherits
+GLOBAL_SETTINGS_SCOPE = '__global__'
+
+# Settings that identify a branch and cannot be set globally
+BRANCH_ONLY_SETTINGS = [
+    'TWILIO_ACCOUNT_SID',
+    'TWILIO_AUTH_TOKEN',
+    'TWILIO_PHONE_NUMBER',
+    'TWILIO_AUTOMATED_NUMBER',
+    'TWILIO_TRANSFER_NUMBER',
+    'TRANSFER_TARGET_PHONE_NUMBER',
+    'RECIPIENT_PHONES',
+    'RECIPIENT_EMAILS'
+]
+
 
 # Database functions
+_db_local = threading.local()
+
+
+def _connect_db():
+    """Open a tuned connection to the admin database"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=DATABASE_BUSY_TIMEOUT, cached_statements=256)
+    conn.execute(f'PRAGMA busy_timeout = {int(DATABASE_BUSY_TIMEOUT * 1000)}')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+def get_db():
+    """Reusable connection for the current thread
+
+    Each thread (gunicorn worker thread, poller, background job) keeps one open
+    connection so repeated queries reuse the connection and its prepared
+    statements. Callers commit their writes; open transactions are rolled back
+    at the end of each request. Connections are not shared across a fork.
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or getattr(_db_local, 'pid', None) != os.getpid():
+        conn = _connect_db()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    return conn
+
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Roll back anything a request left uncommitted on its pooled connection"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    global EVENTS_FTS
+    conn = _connect_db()
     c = conn.cursor()
     
+    # WAL lets dashboard reads proceed while another worker writes
+    c.execute('PRAGMA journal_mode = WAL')
+    
     # Users table
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -138,10 +299,207 @@ def init_db():
         UNIQUE(branch, setting_key)
     )''')
     
+    # Version counters for in-process caches; bumping a row invalidates the
+    # matching cache in every gunicorn worker
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )''')
+    c.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('permissions', 0)")
+    
+    # Admin SMS notifications waiting to be sent (drained by the notification sender)
+    c.execute('''CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        claim_token TEXT,
+        claimed_at TIMESTAMP,
+        sent_at TIMESTAMP,
+        error TEXT
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notification_outbox_status ON notification_outbox(status, next_attempt_at)')
+    
+    # Emergency triggers from the dashboard, forwarded and tracked in the background
+    c.execute('''CREATE TABLE IF NOT EXISTS trigger_jobs (
+        id TEXT PRIMARY KEY,
+        branch TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        emergency_id TEXT,
+        message TEXT,
+        error TEXT,
+        progress TEXT,
+        created_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trigger_jobs_status ON trigger_jobs(status, created_at)')
+    
+    # Branch container restarts; a batch is a rolling restart run in position order
+    c.execute('''CREATE TABLE IF NOT EXISTS restart_jobs (
+        id TEXT PRIMARY KEY,
+        batch_id TEXT NOT NULL,
+        position INTEGER DEFAULT 0,
+        branch TEXT NOT NULL,
+        skip_drain INTEGER DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        message TEXT,
+        error TEXT,
+        created_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_restart_jobs_batch ON restart_jobs(batch_id, position)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_restart_jobs_status ON restart_jobs(status)')
+    
+    # Log events shipped by branches, one row per event id
+    c.execute('''CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        branch TEXT NOT NULL,
+        event TEXT NOT NULL,
+        status TEXT,
+        emergency_id TEXT,
+        occurred_at TEXT NOT NULL,
+        details TEXT,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_time ON events(occurred_at DESC, id DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_branch_time ON events(branch, occurred_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_event_time ON events(event, occurred_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_emergency ON events(emergency_id)')
+    # Full-text index over event details, kept in step by triggers (LIKE search without FTS5)
+    try:
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS events_fts
+                     USING fts5(details, content='events', content_rowid='rowid')''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+                         INSERT INTO events_fts (rowid, details) VALUES (new.rowid, new.details);
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+                         INSERT INTO events_fts (events_fts, rowid, details) VALUES ('delete', old.rowid, old.details);
+                     END''')
+        EVENTS_FTS = True
+    except sqlite3.OperationalError:
+        print("SQLite has no FTS5; event search falls back to LIKE")
+        EVENTS_FTS = False
+    
+    # Latest settings reload pushed to each branch and whether the branch acknowledged it
+    c.execute('''CREATE TABLE IF NOT EXISTS settings_push_acks (
+        branch TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        pushed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        acked_at TIMESTAMP,
+        error TEXT
+    )''')
+    
+    # Local index of each branch's Twilio call recordings
+    c.execute('''CREATE TABLE IF NOT EXISTS recordings (
+        sid TEXT PRIMARY KEY,
+        branch TEXT NOT NULL,
+        call_sid TEXT,
+        duration INTEGER,
+        date_created TEXT,
+        status TEXT,
+        uri TEXT,
+        from_number TEXT,
+        to_number TEXT,
+        from_formatted TEXT,
+        to_formatted TEXT,
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("UPDATE recordings SET date_created = '' WHERE date_created IS NULL")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recordings_branch_date ON recordings(branch, date_created DESC, sid DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recordings_branch_from ON recordings(branch, from_number)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recordings_branch_to ON recordings(branch, to_number)')
+    
+    # Incremental recordings sync progress per branch
+    c.execute('''CREATE TABLE IF NOT EXISTS recording_sync_state (
+        branch TEXT PRIMARY KEY,
+        account_sid TEXT,
+        watermark TEXT,
+        last_sync_at TIMESTAMP,
+        last_error TEXT,
+        sync_started_at TIMESTAMP,
+        resume_before TEXT,
+        resume_newest TEXT
+    )''')
+    for column in ('resume_before', 'resume_newest'):
+        try:
+            c.execute(f'ALTER TABLE recording_sync_state ADD COLUMN {column} TEXT')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+    
+    # Recording archive jobs, their per-recording checkpoints and the archived store
+    c.execute('''CREATE TABLE IF NOT EXISTS archive_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        branch TEXT NOT NULL,
+        date_from TEXT,
+        date_to TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        created_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        listed INTEGER DEFAULT 0,
+        list_next_uri TEXT,
+        total INTEGER DEFAULT 0,
+        downloaded INTEGER DEFAULT 0,
+        skipped INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        bytes INTEGER DEFAULT 0,
+        error TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS archive_items (
+        job_id INTEGER NOT NULL,
+        sid TEXT NOT NULL,
+        call_sid TEXT,
+        uri TEXT,
+        date_created TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        sha256 TEXT,
+        size INTEGER,
+        error TEXT,
+        PRIMARY KEY (job_id, sid)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_archive_items_status ON archive_items(job_id, status)')
+    c.execute('''CREATE TABLE IF NOT EXISTS archived_recordings (
+        sid TEXT PRIMARY KEY,
+        branch TEXT NOT NULL,
+        call_sid TEXT,
+        date_created TEXT,
+        sha256 TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Indexes for the per-user and per-branch lookups done on every request
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user_permissions_user_id ON user_permissions(user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_branch_settings_branch ON branch_settings(branch)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)')
+    
+    # Branch registry, seeded with the default branches on first start
+    c.execute('''CREATE TABLE IF NOT EXISTS branches (
+        key TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        url TEXT NOT NULL,
+        public_url TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by TEXT
+    )''')
+    if c.execute('SELECT COUNT(*) FROM branches').fetchone()[0] == 0:
+        c.executemany('INSERT INTO branches (key, name, url, public_url) VALUES (?, ?, ?, ?)',
+                      [(key, info['name'], info['url'], info['public_url']) for key, info in DEFAULT_BRANCHES.items()])
+    c.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('branches', 0)")
+    
     # Initialize branch statuses
-    for branch in BRANCHES.keys():
-        c.execute('''INSERT OR IGNORE INTO branch_status (branch, is_enabled, last_check) 
-                     VALUES (?, 1, CURRENT_TIMESTAMP)''', (branch,))
+    c.execute('''INSERT OR IGNORE INTO branch_status (branch, is_enabled, last_check)
+                 SELECT key, 1, CURRENT_TIMESTAMP FROM branches''')
     
     # Create default admin user if not exists
     admin_hash = generate_password_hash(ADMIN_PASSWORD, method='pbkdf2:sha256', salt_length=16)
@@ -159,21 +517,80 @@ def hash_password(password):
 
 def verify_user(username, password):
     """Verify user credentials"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('SELECT id, password_hash, is_admin FROM users WHERE username = ?', (username,))
     result = c.fetchone()
-    conn.close()
     
     if result and check_password_hash(result[1], password):
         return {'id': result[0], 'username': username, 'is_admin': bool(result[2])}
     return None
 
 
+_branches_version = None
+
+
+def refresh_branches():
+    """Reload BRANCHES from the branches table if another request or worker changed it"""
+    global BRANCHES, _branches_version
+    version = get_cache_version('branches')
+    if version != _branches_version:
+        rows = get_db().execute('SELECT key, name, url, public_url FROM branches ORDER BY name, key').fetchall()
+        # Rebind rather than mutate so loops over the old dict are unaffected
+        BRANCHES = {row[0]: {'name': row[1], 'url': row[2], 'public_url': row[3] or ''} for row in rows}
+        _branches_version = version
+    return BRANCHES
+
+
+@app.before_request
+def load_branches():
+    refresh_branches()
+
+
+_permission_cache = {}
+_permission_cache_lock = threading.Lock()
+
+
+def get_cache_version(name, fresh=False):
+    """Current version of a shared cache (read once per request unless fresh)"""
+    memo_key = f'cache_version_{name}'
+    if not fresh and has_request_context() and memo_key in g:
+        return g.get(memo_key)
+    row = get_db().execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    version = row[0] if row else 0
+    if has_request_context():
+        setattr(g, memo_key, version)
+    return version
+
+
+def bump_cache_version(conn, name):
+    """Invalidate a shared cache; call inside the transaction making the change"""
+    conn.execute('''INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1''', (name,))
+    if has_request_context():
+        g.pop(f'cache_version_{name}', None)
+
+
 def get_user_permissions(user_id):
-    """Get permissions for a user"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """Get permissions for a user (cached until a user is created, edited or deleted)"""
+    version = get_cache_version('permissions')
+    with _permission_cache_lock:
+        cached = _permission_cache.get(user_id)
+    if cached and cached[0] == version:
+        return {branch: dict(perms) for branch, perms in cached[1].items()}
+    
+    permissions = load_user_permissions(user_id)
+    with _permission_cache_lock:
+        if any(v != version for v, _ in _permission_cache.values()):
+            _permission_cache.clear()
+        _permission_cache[user_id] = (version, permissions)
+    return {branch: dict(perms) for branch, perms in permissions.items()}
+
+
+def load_user_permissions(user_id):
+    """Read permissions for a user from the database"""
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT branch, can_view, can_trigger, can_disable, 
@@ -190,7 +607,6 @@ def get_user_permissions(user_id):
             'can_restart': bool(row[6]) if len(row) > 6 else False
         }
     
-    conn.close()
     return permissions
 
 
@@ -213,19 +629,18 @@ def can_edit_setting(setting_key, user_is_admin, user_permissions):
 
 def is_branch_enabled(branch):
     """Check if a branch is enabled"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('SELECT is_enabled FROM branch_status WHERE branch = ?', (branch,))
     result = c.fetchone()
-    conn.close()
     
     return result[0] if result else True
 
 
 def set_branch_status(branch, enabled, username):
     """Enable or disable a branch"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     if enabled:
@@ -238,40 +653,117 @@ def set_branch_status(branch, enabled, username):
                      WHERE branch = ?''', (username, branch))
     
     conn.commit()
-    conn.close()
+    
+    # Push the change to open status streams in this process
+    with _branch_status_changed:
+        _branch_status_changed.notify_all()
 
 
 def get_branch_settings(branch):
     """Get all settings for a branch"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT setting_key, setting_value FROM branch_settings WHERE branch = ?''', (branch,))
     settings = {row[0]: row[1] for row in c.fetchall()}
-    conn.close()
     
     return settings
 
 
+def update_branch_settings(branch, settings, username):
+    """Write several settings for a branch (or GLOBAL_SETTINGS_SCOPE) in one transaction
+
+    A value of None removes the key so it is inherited again. All keys land
+    together under a single version bump. Returns the new version of the scope.
+    """
+    conn = get_db()
+    try:
+        conn.executemany('''INSERT OR REPLACE INTO branch_settings (branch, setting_key, setting_value, updated_at, updated_by)
+                            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)''',
+                         [(branch, key, value, username) for key, value in settings.items() if value is not None])
+        conn.executemany('DELETE FROM branch_settings WHERE branch = ? AND setting_key = ?',
+                         [(branch, key) for key, value in settings.items() if value is None])
+        bump_cache_version(conn, f'settings:{branch}')
+        version = conn.execute('SELECT version FROM cache_versions WHERE name = ?',
+                               (f'settings:{branch}',)).fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    # Wake long-polling branches served by this process
+    with _settings_changed:
+        _settings_changed.notify_all()
+    return version
+
+
 def update_branch_setting(branch, key, value, username):
     """Update a single setting for a branch"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    
-    c.execute('''INSERT OR REPLACE INTO branch_settings (branch, setting_key, setting_value, updated_at, updated_by)
-                 VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)''', (branch, key, value, username))
-    
-    conn.commit()
-    conn.close()
+    return update_branch_settings(branch, {key: value}, username)
+
+
+# Merged (database + environment default) settings per branch, keyed by version
+_merged_settings_cache = {}
+_merged_settings_lock = threading.Lock()
+_settings_changed = threading.Condition()
+_long_poll_slots = threading.BoundedSemaphore(SETTINGS_LONG_POLL_MAX)
+
+
+def get_settings_version(branch):
+    """Monotonic settings version of a branch: its own version plus the global one
+
+    Either kind of update raises it, so branches watching one number see both.
+    """
+    row = get_db().execute('SELECT SUM(version) FROM cache_versions WHERE name IN (?, ?)',
+                           (f'settings:{branch}', f'settings:{GLOBAL_SETTINGS_SCOPE}')).fetchone()
+    return row[0] or 0
+
+
+def get_settings_versions():
+    """Settings version of every branch from a single query"""
+    rows = get_db().execute("SELECT name, version FROM cache_versions WHERE name LIKE 'settings:%'").fetchall()
+    versions = {name[len('settings:'):]: version for name, version in rows}
+    global_version = versions.get(GLOBAL_SETTINGS_SCOPE, 0)
+    return {branch: versions.get(branch, 0) + global_version for branch in BRANCHES}
+
+
+def get_cached_branch_settings(branch):
+    """(version, merged settings) for a branch, rebuilt only when the version changes"""
+    version = get_settings_version(branch)
+    with _merged_settings_lock:
+        cached = _merged_settings_cache.get(branch)
+    if cached and cached[0] == version:
+        return cached
+    cached = (version, get_branch_settings_with_defaults(branch))
+    with _merged_settings_lock:
+        _merged_settings_cache[branch] = cached
+    return cached
+
+
+def precompute_branch_settings():
+    """Rebuild the merged settings of every branch (after a global change or at startup)"""
+    versions = get_settings_versions()
+    global_settings = get_global_settings()
+    merged = {branch: (versions[branch], get_branch_settings_with_defaults(branch, global_settings))
+              for branch in BRANCHES}
+    with _merged_settings_lock:
+        _merged_settings_cache.update(merged)
+    return versions
+
+
+def get_global_settings():
+    """Settings every branch inherits unless it overrides them"""
+    settings = get_branch_settings(GLOBAL_SETTINGS_SCOPE)
+    for key in BRANCH_ONLY_SETTINGS:
+        settings.pop(key, None)
+    return settings
 
 
-def get_branch_settings_with_defaults(branch):
-    """Get settings for a branch with environment variable defaults"""
-    settings = get_branch_settings(branch)
-    
+def get_inherited_settings(branch, global_settings=None):
+    """What a branch gets for keys it does not set itself (environment, then global)"""
     # Define default keys from environment variables
     branch_upper = branch.upper()
-    default_keys = {
+    settings = {
         'TWILIO_ACCOUNT_SID': os.environ.get(f'{branch_upper}_TWILIO_ACCOUNT_SID', ''),
         'TWILIO_AUTH_TOKEN': os.environ.get(f'{branch_upper}_TWILIO_AUTH_TOKEN', ''),
         'TWILIO_PHONE_NUMBER': os.environ.get(f'{branch_upper}_TWILIO_PHONE_NUMBER', ''),
@@ -282,46 +774,874 @@ def get_branch_settings_with_defaults(branch):
         'RECIPIENT_EMAILS': os.environ.get(f'{branch_upper}_RECIPIENT_EMAILS', ''),
         'DEBUG_WEBHOOK_URL': os.environ.get(f'{branch_upper}_DEBUG_WEBHOOK_URL', ''),
     }
-    
-    # Merge with database settings (database overrides environment)
-    for key, default_value in default_keys.items():
-        if key not in settings:
-            settings[key] = default_value
-    
+    settings.update(get_global_settings() if global_settings is None else global_settings)
     return settings
 
 
+def get_branch_settings_with_defaults(branch, global_settings=None):
+    """Get settings for a branch: environment defaults, then global settings, then branch overrides"""
+    settings = get_inherited_settings(branch, global_settings)
+    settings.update(get_branch_settings(branch))
+    return settings
+
+
+# --- Inter-service HTTP ---
+# One keep-alive session for every call to branch instances
+_peer_http = requests.Session()
+_peer_http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=PEER_POOL_SIZE))
+_peer_http.mount('https://', requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=PEER_POOL_SIZE))
+# Per-peer circuit breaker: consecutive failures and when the open circuit may be retried
+_peer_circuits = {}
+_peer_circuits_lock = threading.Lock()
+
+
+def peer_retry_delay(attempt):
+    """Backoff before retry number `attempt` (1-based): exponential with full jitter"""
+    return random.uniform(0, PEER_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def peer_available(peer):
+    """False while a peer's circuit is open (it failed repeatedly and is not yet due a retry)"""
+    with _peer_circuits_lock:
+        circuit = _peer_circuits.get(peer)
+        return not circuit or circuit['open_until'] <= time.monotonic()
+
+
+def _acquire_peer(peer):
+    """Whether a call to the peer may go out; once an open circuit is due, one caller gets a trial"""
+    with _peer_circuits_lock:
+        circuit = _peer_circuits.get(peer)
+        if not circuit or circuit['failures'] < PEER_CIRCUIT_THRESHOLD:
+            return True
+        now = time.monotonic()
+        if circuit['open_until'] > now:
+            return False
+        # Hold the circuit open for everyone else while the trial is in flight
+        circuit['open_until'] = now + PEER_CIRCUIT_RESET
+        return True
+
+
+def _record_peer_result(peer, ok):
+    with _peer_circuits_lock:
+        circuit = _peer_circuits.setdefault(peer, {'failures': 0, 'open_until': 0})
+        if ok:
+            circuit['failures'] = 0
+            circuit['open_until'] = 0
+            return
+        circuit['failures'] += 1
+        if circuit['failures'] >= PEER_CIRCUIT_THRESHOLD:
+            if circuit['failures'] == PEER_CIRCUIT_THRESHOLD:
+                print(f"Circuit open for {peer} after {circuit['failures']} failures")
+            circuit['open_until'] = time.monotonic() + PEER_CIRCUIT_RESET
+
+
+def peer_request(peer, method, url, attempts=None, **kwargs):
+    """HTTP request to another service over the pooled session
+
+    Connection errors, timeouts and 502/503/504 replies are retried up to
+    `attempts` times (default PEER_RETRY_ATTEMPTS) with jittered backoff. After
+    PEER_CIRCUIT_THRESHOLD consecutive failures the peer's circuit opens and
+    calls fail fast with ConnectionError for PEER_CIRCUIT_RESET seconds; the
+    first call after that is a trial that closes or re-opens it.
+    """
+    attempts = attempts or PEER_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(peer_retry_delay(attempt))
+        if not _acquire_peer(peer):
+            raise requests.exceptions.ConnectionError(f"{peer} is unavailable (circuit open)")
+        try:
+            response = _peer_http.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            _record_peer_result(peer, False)
+            if attempt == attempts - 1:
+                raise
+            continue
+        if response.status_code in (502, 503, 504):
+            _record_peer_result(peer, False)
+            if attempt < attempts - 1:
+                continue
+        else:
+            _record_peer_result(peer, True)
+        return response
+
+
+def get_peer_circuits():
+    """Circuit state of every peer that has been called"""
+    now = time.monotonic()
+    with _peer_circuits_lock:
+        return {peer: {'failures': circuit['failures'],
+                       'open': circuit['open_until'] > now,
+                       'retry_in': max(round(circuit['open_until'] - now, 1), 0)}
+                for peer, circuit in _peer_circuits.items()}
+
+
+# --- Notification Outbox ---
+_notification_wakeup = threading.Event()
+_notification_sender_thread = None
+# Longest an SMS body may be; Twilio splits anything longer into segments and caps at 1600
+NOTIFICATION_MAX_LENGTH = 1500
+# A batch claimed longer ago than this is assumed lost and is sent again
+NOTIFICATION_CLAIM_LEASE = timedelta(minutes=5)
+
+
 def send_sms_notification(message):
-    """Send SMS notification to admin"""
+    """Queue an SMS notification to admin
+
+    The message is written to notification_outbox and sent by the background
+    sender, so callers never wait on Twilio. Messages queued within
+    NOTIFICATION_COALESCE_WINDOW seconds of each other go out as one digest.
+    """
+    conn = get_db()
+    conn.execute('INSERT INTO notification_outbox (message) VALUES (?)', (message,))
+    conn.commit()
+    _notification_wakeup.set()
+    return True
+
+
+def _deliver_sms(body):
+    """Send one SMS to NOTIFICATION_PHONE (raises on failure)"""
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    client.messages.create(
+        body=body,
+        from_=TWILIO_PHONE_NUMBER,
+        to=NOTIFICATION_PHONE
+    )
+
+
+def build_notification_digest(messages):
+    """One SMS body for a batch of queued notifications"""
+    if len(messages) == 1:
+        return messages[0][:NOTIFICATION_MAX_LENGTH]
+    body = f"{len(messages)} admin notifications:"
+    for i, message in enumerate(messages):
+        line = f"\n- {message}"
+        if len(body) + len(line) > NOTIFICATION_MAX_LENGTH - 20:
+            return body + f"\n(+{len(messages) - i} more)"
+        body += line
+    return body
+
+
+def send_due_notifications():
+    """Send every due notification as one digest
+
+    Returns the seconds until the next batch is due, or None if the outbox
+    is empty.
+    """
+    conn = get_db()
+    # Batches claimed by a sender that died are retried
+    conn.execute('''UPDATE notification_outbox SET status = 'pending', claim_token = NULL
+                    WHERE status = 'sending' AND claimed_at < ?''',
+                 ((datetime.utcnow() - NOTIFICATION_CLAIM_LEASE).strftime('%Y-%m-%d %H:%M:%S'),))
+    conn.commit()
+
+    # A batch is due once its oldest message has waited out the coalescing window
+    ready_at = conn.execute('''SELECT MIN(MAX(CAST(strftime('%s', created_at) AS INTEGER) + ?,
+                                              CAST(strftime('%s', next_attempt_at) AS INTEGER)))
+                               FROM notification_outbox WHERE status = 'pending' ''',
+                            (NOTIFICATION_COALESCE_WINDOW,)).fetchone()[0]
+    if ready_at is None:
+        return None
+    if ready_at > time.time():
+        return ready_at - time.time()
+
+    token = secrets.token_hex(8)
+    conn.execute('''UPDATE notification_outbox
+                    SET status = 'sending', claim_token = ?, claimed_at = CURRENT_TIMESTAMP
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP''', (token,))
+    conn.commit()
+    rows = conn.execute('''SELECT message, attempts FROM notification_outbox
+                           WHERE claim_token = ? ORDER BY id''', (token,)).fetchall()
+    if not rows:
+        return 0
+
+    body = build_notification_digest([row[0] for row in rows])
     if not all([TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER]):
-        print(f"SMS notification not configured. Would send: {message}")
-        return False
-    
+        print(f"SMS notification not configured. Would send: {body}")
+        conn.execute('''UPDATE notification_outbox SET status = 'skipped', sent_at = CURRENT_TIMESTAMP
+                        WHERE claim_token = ?''', (token,))
+        conn.commit()
+        return 0
+
     try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        client.messages.create(
-            body=message,
-            from_=TWILIO_PHONE_NUMBER,
-            to=NOTIFICATION_PHONE
-        )
-        return True
+        _deliver_sms(body)
+        conn.execute('''UPDATE notification_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, error = NULL
+                        WHERE claim_token = ?''', (token,))
     except Exception as e:
         print(f"Error sending SMS: {e}")
-        return False
+        # Back off 30s, 60s, 120s ... up to an hour, then give up after NOTIFICATION_MAX_ATTEMPTS
+        attempts = max(row[1] for row in rows) + 1
+        retry_at = datetime.utcnow() + timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+        conn.execute('''UPDATE notification_outbox
+                        SET attempts = attempts + 1, error = ?, claim_token = NULL, next_attempt_at = ?,
+                            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                        WHERE claim_token = ?''',
+                     (str(e), retry_at.strftime('%Y-%m-%d %H:%M:%S'), NOTIFICATION_MAX_ATTEMPTS, token))
+    conn.commit()
+    return 0
+
+
+def _notification_sender_loop():
+    """Background loop draining the notification outbox"""
+    while True:
+        try:
+            delay = send_due_notifications()
+        except Exception as e:
+            print(f"Error in notification sender: {e}")
+            delay = NOTIFICATION_COALESCE_WINDOW
+        # Messages queued by other workers are noticed within a minute
+        if delay is None or delay > 60:
+            delay = 60
+        if delay > 0:
+            _notification_wakeup.wait(delay)
+            _notification_wakeup.clear()
+
+
+def start_notification_sender():
+    """Start the background notification sender once per process"""
+    global _notification_sender_thread
+    if _notification_sender_thread and _notification_sender_thread.is_alive():
+        return
+    _notification_sender_thread = threading.Thread(target=_notification_sender_loop,
+                                                   name="notification-sender", daemon=True)
+    _notification_sender_thread.start()
+
+
+# --- Emergency Trigger Jobs ---
+_trigger_executor = ThreadPoolExecutor(max_workers=TRIGGER_WORKERS, thread_name_prefix='trigger')
+_trigger_tracker_wakeup = threading.Event()
+_trigger_tracker_thread = None
+# Job states after which nothing more will change
+TRIGGER_FINAL_STATES = ('completed', 'failed', 'rejected')
+
+
+def create_trigger_job(branch, payload, username):
+    """Record a trigger request; the job id doubles as the branch idempotency key"""
+    job_id = secrets.token_hex(8)
+    conn = get_db()
+    conn.execute('''INSERT INTO trigger_jobs (id, branch, payload, status, created_by)
+                    VALUES (?, ?, ?, 'pending', ?)''', (job_id, branch, json.dumps(payload), username))
+    conn.commit()
+    return job_id
+
+
+def get_trigger_job(job_id):
+    """Trigger job as shown to the UI (None if unknown)"""
+    row = get_db().execute('''SELECT id, branch, status, emergency_id, message, error, progress,
+                                     attempts, created_by, created_at, updated_at
+                              FROM trigger_jobs WHERE id = ?''', (job_id,)).fetchone()
+    if not row:
+        return None
+    return {
+        'job_id': row[0],
+        'branch': row[1],
+        'status': row[2],
+        'final': row[2] in TRIGGER_FINAL_STATES,
+        'emergency_id': row[3],
+        'message': row[4],
+        'error': row[5],
+        'progress': json.loads(row[6]) if row[6] else None,
+        'attempts': row[7],
+        'created_by': row[8],
+        'created_at': row[9],
+        'updated_at': row[10]
+    }
+
+
+def _update_trigger_job(job_id, **fields):
+    conn = get_db()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn.execute(f'UPDATE trigger_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                 list(fields.values()) + [job_id])
+    conn.commit()
+
+
+def _forward_trigger(job_id, branch, payload):
+    """POST the emergency to the branch webhook, retrying transient failures
+
+    Timeouts, 409, 429 and 5xx replies are retried with the job's
+    Idempotency-Key, so the branch starts the emergency at most once. Returns the branch's JSON reply, or None after
+    recording the job as failed or rejected.
+    """
+    branch_name = BRANCHES[branch]['name']
+    error = None
+    for attempt in range(TRIGGER_FORWARD_ATTEMPTS):
+        if attempt:
+            time.sleep(peer_retry_delay(attempt) + 1)
+        _update_trigger_job(job_id, status='forwarding', attempts=attempt + 1)
+        try:
+            response = peer_request(branch, 'POST', f"{BRANCHES[branch]['url']}/webhook", attempts=1, json=payload,
+                                    headers={'Idempotency-Key': f'trigger-{job_id}'}, timeout=10)
+        except requests.exceptions.Timeout:
+            error = 'Request to branch timed out'
+            continue
+        except requests.exceptions.ConnectionError:
+            error = 'Could not connect to branch instance'
+            continue
+        if response.status_code in (200, 202):
+            return response.json()
+        error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+        error = error_data.get('message', f'Branch returned error: {response.status_code}')
+        # 409: an earlier attempt with this key is still running on the branch;
+        # 429: throttled. Both may still go through, so retry like a 5xx.
+        if response.status_code < 500 and response.status_code not in (409, 429):
+            # The branch refused it (invalid request); retrying will not help
+            _update_trigger_job(job_id, status='rejected', error=error,
+                                message=f'{branch_name} did not accept the emergency')
+            return None
+    _update_trigger_job(job_id, status='failed', error=error,
+                        message=f'Emergency could not be delivered to {branch_name}')
+    return None
+
+
+def _poll_trigger_job(job_id, branch, emergency_id):
+    """Update a job from the branch's view of its emergency"""
+    branch_name = BRANCHES[branch]['name']
+    try:
+        response = peer_request(branch, 'GET', f"{BRANCHES[branch]['url']}/api/emergencies/{emergency_id}",
+                                attempts=1, timeout=5)
+        if response.status_code != 200:
+            return
+        result = response.json()
+    except Exception as e:
+        print(f"Error tracking emergency {emergency_id} on {branch}: {e}")
+        return
+
+    dispatch = result.get('dispatch') or {}
+    if result.get('status') == 'queued' and not result.get('concluded'):
+        _update_trigger_job(job_id, status='queued', progress=json.dumps(result),
+                            message=f"{branch_name} is busy; emergency queued at position {result.get('queue_position')}")
+    elif dispatch.get('state') == 'completed':
+        _update_trigger_job(job_id, status='completed', progress=json.dumps(result),
+                            message=f'Technician notified on {branch_name}')
+    elif dispatch.get('state') == 'failed' or (result.get('concluded') and not dispatch):
+        _update_trigger_job(job_id, status='failed', progress=json.dumps(result),
+                            error=dispatch.get('error') or 'Emergency ended before dispatch',
+                            message=f'Technician notification failed on {branch_name}')
+    else:
+        _update_trigger_job(job_id, status='dispatching', progress=json.dumps(result),
+                            message=f'Emergency accepted on {branch_name}; technician notification in progress')
+
+
+def _trigger_tracker_loop():
+    """Background loop following accepted emergencies until their dispatch finishes"""
+    while True:
+        try:
+            rows = get_db().execute('''SELECT id, branch, emergency_id FROM trigger_jobs
+                                       WHERE status IN ('queued', 'dispatching') AND emergency_id IS NOT NULL
+                                       AND created_at > ?''',
+                                    ((datetime.utcnow() - timedelta(seconds=TRIGGER_TRACK_TIMEOUT)).strftime('%Y-%m-%d %H:%M:%S'),)).fetchall()
+            # Every tracked emergency is polled concurrently over the pooled session
+            list(_trigger_executor.map(lambda row: _poll_trigger_job(*row), rows))
+        except Exception as e:
+            print(f"Error in trigger tracker: {e}")
+        _trigger_tracker_wakeup.wait(TRIGGER_TRACK_INTERVAL)
+        _trigger_tracker_wakeup.clear()
+
+
+def start_trigger_tracker():
+    """Start the background trigger tracker once per process"""
+    global _trigger_tracker_thread
+    if _trigger_tracker_thread and _trigger_tracker_thread.is_alive():
+        return
+    _trigger_tracker_thread = threading.Thread(target=_trigger_tracker_loop, name="trigger-tracker", daemon=True)
+    _trigger_tracker_thread.start()
+
+
+def run_trigger_job(job_id):
+    """Forward a trigger job to its branch (runs on the trigger pool)"""
+    row = get_db().execute('SELECT branch, payload, emergency_id, created_by FROM trigger_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+    if not row:
+        return
+    branch, payload, emergency_id, username = row[0], json.loads(row[1]), row[2], row[3]
+    if emergency_id:
+        return
+    try:
+        result = _forward_trigger(job_id, branch, payload)
+        if result is None:
+            return
+        queued = result.get('status') == 'queued'
+        branch_name = BRANCHES[branch]['name']
+        if queued:
+            message = f"{branch_name} is busy; emergency queued at position {result.get('position')} and will start automatically"
+        else:
+            message = f'Emergency accepted on {branch_name}; technician notification in progress'
+        _update_trigger_job(job_id, status='queued' if queued else 'dispatching',
+                            emergency_id=result.get('emergency_id'), progress=json.dumps(result), message=message)
+        _trigger_tracker_wakeup.set()
+        send_sms_notification(f"INFO: Emergency {'queued' if queued else 'triggered'} on {branch_name} branch by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    except Exception as e:
+        print(f"Error running trigger job {job_id}: {e}")
+        _update_trigger_job(job_id, status='failed', error='An unexpected error occurred')
+
+
+def start_trigger_job(job_id):
+    _trigger_executor.submit(run_trigger_job, job_id)
+
+
+def resume_trigger_jobs():
+    """Restart forwarding for jobs a previous process accepted but never delivered
+
+    Forwarding jobs touch updated_at on every attempt, so only jobs idle for
+    a minute are taken over.
+    """
+    rows = get_db().execute('''SELECT id FROM trigger_jobs WHERE status IN ('pending', 'forwarding')
+                                 AND updated_at < datetime('now', '-60 seconds')
+                                 AND created_at > datetime('now', '-1 day')''').fetchall()
+    for (job_id,) in rows:
+        start_trigger_job(job_id)
+
+
+# --- Branch Restart Jobs ---
+# Jobs run on a small pool in the order they were queued, so a fleet restart
+# rolls through branches RESTART_WORKERS at a time
+_restart_executor = ThreadPoolExecutor(max_workers=RESTART_WORKERS, thread_name_prefix='restart')
+_restart_changed = threading.Condition()
+RESTART_FINAL_STATES = ('completed', 'failed', 'cancelled')
+
+
+def create_restart_jobs(branches, username, skip_drain=False):
+    """Queue one restart job per branch as a batch
+
+    Branches that already have an unfinished restart are left out. Returns
+    (batch_id, job ids, branches skipped).
+    """
+    batch_id = secrets.token_hex(8)
+    conn = get_db()
+    busy = {row[0] for row in conn.execute(
+        f'''SELECT branch FROM restart_jobs WHERE status NOT IN ({', '.join('?' * len(RESTART_FINAL_STATES))})''',
+        RESTART_FINAL_STATES).fetchall()}
+    job_ids = []
+    for branch in branches:
+        if branch in busy:
+            continue
+        job_id = secrets.token_hex(8)
+        conn.execute('''INSERT INTO restart_jobs (id, batch_id, position, branch, skip_drain, created_by)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (job_id, batch_id, len(job_ids), branch, 1 if skip_drain else 0, username))
+        job_ids.append(job_id)
+    conn.commit()
+    return batch_id, job_ids, [b for b in branches if b in busy]
+
+
+def get_restart_batch(batch_id):
+    """Jobs of a restart batch in the order they run"""
+    rows = get_db().execute('''SELECT id, branch, status, message, error, created_by, created_at, updated_at
+                               FROM restart_jobs WHERE batch_id = ? ORDER BY position''', (batch_id,)).fetchall()
+    return [{
+        'job_id': row[0],
+        'branch': row[1],
+        'status': row[2],
+        'final': row[2] in RESTART_FINAL_STATES,
+        'message': row[3],
+        'error': row[4],
+        'created_by': row[5],
+        'created_at': row[6],
+        'updated_at': row[7]
+    } for row in rows]
+
+
+def _update_restart_job(job_id, **fields):
+    """Update a job (with no fields, just marks it as still making progress)"""
+    conn = get_db()
+    assignments = ''.join(f'{name} = ?, ' for name in fields)
+    conn.execute(f'UPDATE restart_jobs SET {assignments}updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                 list(fields.values()) + [job_id])
+    conn.commit()
+    if fields:
+        with _restart_changed:
+            _restart_changed.notify_all()
+
+
+def _branch_idle(branch):
+    """True when a branch has no active or queued emergency, None when it can't be asked"""
+    try:
+        response = peer_request(branch, 'GET', f"{BRANCHES[branch]['url']}/api/queue", attempts=1,
+                                timeout=STATUS_POLL_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        queue = response.json()
+        return not queue.get('active') and not queue.get('depth')
+    except Exception:
+        return None
+
+
+def _wait_until_idle(job_id, branch):
+    """Wait for the branch to finish its emergencies
+
+    A branch that can't be asked might be mid-emergency, so it counts as busy.
+    Returns None once idle, otherwise why it was not idle at the deadline.
+    """
+    deadline = time.monotonic() + RESTART_DRAIN_TIMEOUT
+    while True:
+        idle = _branch_idle(branch)
+        if idle:
+            return None
+        if time.monotonic() >= deadline:
+            if idle is None:
+                return f'Could not confirm the branch was idle within {RESTART_DRAIN_TIMEOUT} seconds'
+            return f'Still handling an emergency after {RESTART_DRAIN_TIMEOUT} seconds'
+        _update_restart_job(job_id)
+        time.sleep(RESTART_POLL_INTERVAL)
+
+
+def run_restart_command(branch):
+    """Run CONTAINER_RESTART_COMMAND for a branch; returns an error message, or None on success"""
+    command = shlex.split(CONTAINER_RESTART_COMMAND.format(branch=branch))
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=RESTART_COMMAND_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return "Restart operation timed out"
+    except FileNotFoundError:
+        return f"{command[0]} is not available in this environment"
+    if result.returncode != 0:
+        # Log the actual error internally but don't expose it to users
+        error_msg = result.stderr.strip() if result.stderr else result.stdout.strip()
+        print(f"Container restart failed for {branch}: {error_msg}", flush=True)
+        return "Failed to restart container. Please contact administrator."
+    return None
+
+
+def _wait_until_healthy(job_id, branch):
+    """Poll the branch's /api/status until it answers; False after RESTART_HEALTH_TIMEOUT
+
+    While the circuit is open (the branch was down) checks fail fast until its
+    trial call, so this also respects PEER_CIRCUIT_RESET.
+    """
+    deadline = time.monotonic() + RESTART_HEALTH_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            response = peer_request(branch, 'GET', f"{BRANCHES[branch]['url']}/api/status", attempts=1,
+                                    timeout=STATUS_POLL_TIMEOUT)
+            if response.status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        _update_restart_job(job_id)
+        time.sleep(RESTART_POLL_INTERVAL)
+    return False
+
+
+def _cancel_rest_of_batch(job_id, reason):
+    """Stop a rolling restart after a branch failed to come back"""
+    conn = get_db()
+    conn.execute('''UPDATE restart_jobs SET status = 'cancelled', message = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'pending'
+                      AND batch_id = (SELECT batch_id FROM restart_jobs WHERE id = ?)''', (reason, job_id))
+    conn.commit()
+
+
+def run_restart_job(job_id):
+    """Drain, restart and health-check one branch (runs on the restart pool)"""
+    conn = get_db()
+    row = conn.execute('SELECT branch, skip_drain, created_by FROM restart_jobs WHERE id = ?', (job_id,)).fetchone()
+    # Claim the job so a resumed copy can't run it twice
+    claimed = conn.execute('''UPDATE restart_jobs SET status = 'draining', updated_at = CURRENT_TIMESTAMP
+                              WHERE id = ? AND status = 'pending' ''', (job_id,)).rowcount
+    conn.commit()
+    if not row or not claimed:
+        return
+    branch, skip_drain, username = row
+    if branch not in BRANCHES:
+        _update_restart_job(job_id, status='failed', error='Branch is no longer registered')
+        return
+    branch_name = BRANCHES[branch]['name']
+
+    try:
+        if not skip_drain:
+            _update_restart_job(job_id, status='draining',
+                                message=f'Waiting for {branch_name} to finish its emergencies')
+            busy = _wait_until_idle(job_id, branch)
+            if busy:
+                _update_restart_job(job_id, status='failed', message=f'{branch_name} was not restarted', error=busy)
+                return
+
+        _update_restart_job(job_id, status='restarting', message=f'Restarting {branch_name}')
+        error = run_restart_command(branch)
+        if error:
+            _update_restart_job(job_id, status='failed', error=error, message=f'{branch_name} restart failed')
+            _cancel_rest_of_batch(job_id, f'Cancelled: {branch_name} restart failed')
+            return
+        request_status_refresh()
+
+        _update_restart_job(job_id, status='verifying', message=f'Waiting for {branch_name} to report healthy')
+        if not _wait_until_healthy(job_id, branch):
+            _update_restart_job(job_id, status='failed', message=f'{branch_name} did not come back',
+                                error=f'No healthy status within {RESTART_HEALTH_TIMEOUT} seconds')
+            _cancel_rest_of_batch(job_id, f'Cancelled: {branch_name} did not come back after restart')
+            return
+
+        _update_restart_job(job_id, status='completed', message=f'{branch_name} restarted and healthy')
+        request_status_refresh()
+        send_sms_notification(f"INFO: {branch_name} branch container has been RESTARTED by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    except Exception as e:
+        print(f"Error running restart job {job_id}: {e}", flush=True)
+        _update_restart_job(job_id, status='failed', error='An unexpected error occurred')
+
+
+def start_restart_jobs(job_ids):
+    for job_id in job_ids:
+        _restart_executor.submit(run_restart_job, job_id)
+
+
+def resume_restart_jobs():
+    """Re-queue restarts a previous process accepted but never started
+
+    Jobs that were mid-restart when it stopped are marked failed rather than
+    repeated. Running jobs touch updated_at while they wait, so only jobs idle
+    for two minutes are treated as abandoned.
+    """
+    conn = get_db()
+    conn.execute('''UPDATE restart_jobs SET status = 'failed', error = 'Interrupted by a dashboard restart',
+                                            updated_at = CURRENT_TIMESTAMP
+                    WHERE status IN ('draining', 'restarting', 'verifying')
+                      AND updated_at < datetime('now', '-120 seconds')''')
+    conn.commit()
+    rows = conn.execute('''SELECT id FROM restart_jobs WHERE status = 'pending'
+                             AND created_at > datetime('now', '-1 day')
+                           ORDER BY created_at, position''').fetchall()
+    start_restart_jobs([row[0] for row in rows])
+
+
+# --- Federated Event Query ---
+_event_query_executor = ThreadPoolExecutor(max_workers=EVENT_QUERY_WORKERS, thread_name_prefix='event-query')
+# Filters passed through to every branch's /api/events
+EVENT_QUERY_PARAMS = ('since', 'until', 'event', 'status', 'emergency_id', 'q', 'limit')
+
+
+def _open_event_stream(branch, params):
+    """Start a branch's NDJSON event stream; returns (response, None) or (None, error)"""
+    try:
+        response = peer_request(branch, 'GET', f"{BRANCHES[branch]['url']}/api/events", params=params,
+                                stream=True, timeout=(STATUS_POLL_TIMEOUT, EVENT_QUERY_TIMEOUT))
+    except requests.exceptions.RequestException as e:
+        return None, f'Could not reach branch: {e.__class__.__name__}'
+    if response.status_code != 200:
+        response.close()
+        return None, f'Branch returned error: {response.status_code}'
+    return response, None
+
+
+def _event_lines(branch, response, errors):
+    """(timestamp, line) for each event in a branch stream, in time order
+
+    Lines are held back in a window of EVENT_REORDER_WINDOW so events a branch
+    logged slightly out of order are sorted before the merge relies on it. A
+    broken stream ends early.
+    """
+    pending = []
+    try:
+        for position, line in enumerate(response.iter_lines()):
+            if line:
+                heapq.heappush(pending, (normalize_event_time(json.loads(line)['timestamp']), position, line))
+                if len(pending) > EVENT_REORDER_WINDOW:
+                    timestamp, _, line = heapq.heappop(pending)
+                    yield timestamp, line
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        errors.append({'branch': branch, 'error': f'Stream interrupted: {e.__class__.__name__}'})
+    while pending:
+        timestamp, _, line = heapq.heappop(pending)
+        yield timestamp, line
+
+
+def query_branch_events(branches, params):
+    """Merged NDJSON lines of every branch's events, oldest first
+
+    All branch streams are opened concurrently with the filters pushed down,
+    then combined with a k-way heap merge that holds one pending event per
+    branch, so memory stays flat however many events each branch returns.
+    Branches that fail are reported as {"branch", "error"} lines.
+    """
+    opened = list(_event_query_executor.map(lambda b: (b, *_open_event_stream(b, params)), branches))
+    responses = [(branch, response) for branch, response, _ in opened if response is not None]
+    unreachable = [{'branch': branch, 'error': error} for branch, response, error in opened if response is None]
+    broken = []
+    limit = params.get('limit')
+    try:
+        for error in unreachable:
+            yield json.dumps(error) + '\n'
+        merged = heapq.merge(*(_event_lines(branch, response, broken) for branch, response in responses),
+                             key=lambda item: item[0])
+        for count, (_, line) in enumerate(merged, 1):
+            yield line.decode('utf-8') + '\n'
+            if limit and count >= limit:
+                break
+        # Streams that broke off part way
+        for error in broken:
+            yield json.dumps(error) + '\n'
+    finally:
+        for _, response in responses:
+            response.close()
+
+
+# --- Branch Event Store ---
+_events_pruned_at = 0
+
+
+def normalize_event_time(value):
+    """ISO timestamp -> naive UTC string with microseconds, so stored times compare as text"""
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec='microseconds')
+
+
+def _read_event_batch():
+    """JSON body of an event batch, gunzipped when sent with Content-Encoding: gzip"""
+    body = request.get_data()
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, EVENT_BATCH_MAX_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Event batch too large')
+    return json.loads(body)
+
+
+def store_events(branch, events):
+    """Insert shipped events, skipping ids already stored; returns (stored, invalid)"""
+    rows = []
+    for event in events:
+        try:
+            rows.append((str(event['id']), branch, str(event['event']), event.get('status'),
+                         event.get('emergency_id'), normalize_event_time(event['timestamp']),
+                         json.dumps(event.get('data') or {}, default=str)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+    conn = get_db()
+    stored = conn.executemany('''INSERT OR IGNORE INTO events (id, branch, event, status, emergency_id, occurred_at, details)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?)''', rows).rowcount
+    conn.commit()
+    return stored, len(events) - len(rows)
+
+
+def prune_events():
+    """Drop events older than EVENT_RETENTION_DAYS (at most once an hour)"""
+    global _events_pruned_at
+    if time.monotonic() - _events_pruned_at < 3600:
+        return
+    _events_pruned_at = time.monotonic()
+    cutoff = (datetime.utcnow() - timedelta(days=EVENT_RETENTION_DAYS)).isoformat(timespec='microseconds')
+    conn = get_db()
+    deleted = conn.execute('DELETE FROM events WHERE occurred_at < ?', (cutoff,)).rowcount
+    conn.commit()
+    if deleted:
+        print(f"Pruned {deleted} events older than {EVENT_RETENTION_DAYS} days")
+
+
+def events_fts_query(text):
+    """FTS5 MATCH expression requiring every word of `text` (each quoted, so no query syntax)"""
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+# --- Settings Reload Push ---
+_settings_push_executor = ThreadPoolExecutor(max_workers=SETTINGS_PUSH_WORKERS,
+                                             thread_name_prefix='settings-push')
+
+
+def _record_settings_push(branch, version, status, error=None):
+    """Update a branch's push row unless a newer version has been pushed since"""
+    conn = get_db()
+    conn.execute('''UPDATE settings_push_acks
+                    SET status = ?, attempts = attempts + 1, error = ?,
+                        acked_at = CASE WHEN ? = 'acked' THEN CURRENT_TIMESTAMP END
+                    WHERE branch = ? AND version = ?''', (status, error, status, branch, version))
+    conn.commit()
+
+
+def _push_settings_reload(branch, version):
+    """Ask a branch to reload its settings, retrying with backoff (runs on the push pool)"""
+    error = None
+    for attempt in range(SETTINGS_PUSH_ATTEMPTS):
+        if attempt:
+            time.sleep(peer_retry_delay(attempt) + 1)
+        try:
+            response = peer_request(branch, 'POST', f"{BRANCHES[branch]['url']}/api/reload_settings",
+                                    attempts=1, timeout=SETTINGS_PUSH_TIMEOUT)
+            if response.status_code == 200:
+                _record_settings_push(branch, version, 'acked')
+                print(f"Settings v{version} reloaded on {branch}")
+                return True
+            error = f'HTTP {response.status_code}'
+        except Exception as e:
+            error = str(e)
+        last = attempt == SETTINGS_PUSH_ATTEMPTS - 1
+        _record_settings_push(branch, version, 'failed' if last else 'retrying', error)
+    print(f"Failed to reload settings v{version} on {branch}: {error}")
+    return False
 
 
-def get_branch_status(branch_key):
-    """Get status from a branch instance"""
+def push_settings_reload(versions):
+    """Queue reload notifications for {branch: version} and return immediately
+
+    Each branch is pushed concurrently on a background pool; progress is kept in
+    settings_push_acks so a slow or offline branch never holds up the caller.
+    Branches that miss the push still pick the change up through their
+    settings long poll.
+    """
+    conn = get_db()
+    conn.executemany('''INSERT INTO settings_push_acks (branch, version, status, attempts, pushed_at)
+                        VALUES (?, ?, 'pending', 0, CURRENT_TIMESTAMP)
+                        ON CONFLICT(branch) DO UPDATE SET
+                            version = excluded.version, status = 'pending', attempts = 0,
+                            pushed_at = excluded.pushed_at, acked_at = NULL, error = NULL
+                        WHERE excluded.version >= settings_push_acks.version''',
+                     list(versions.items()))
+    conn.commit()
+    for branch, version in versions.items():
+        _settings_push_executor.submit(_push_settings_reload, branch, version)
+
+
+def get_settings_push_status(branch):
+    """Latest reload push for a branch and whether the branch acknowledged it"""
+    row = get_db().execute('''SELECT version, status, attempts, pushed_at, acked_at, error
+                              FROM settings_push_acks WHERE branch = ?''', (branch,)).fetchone()
+    if not row:
+        return None
+    return {
+        'version': row[0],
+        'status': row[1],
+        'attempts': row[2],
+        'pushed_at': row[3],
+        'acked_at': row[4],
+        'error': row[5]
+    }
+
+
+# --- Branch Status Cache ---
+_branch_status_cache = {}
+_branch_status_lock = threading.Lock()
+# Notified whenever a poll changes some branch's status (wakes SSE streams)
+_branch_status_changed = threading.Condition(_branch_status_lock)
+_status_poll_wakeup = threading.Event()
+# Open SSE streams (status and restart progress) in this worker
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+_status_poll_executor = ThreadPoolExecutor(max_workers=STATUS_POLL_WORKERS, thread_name_prefix='status-poll')
+_status_poller_thread = None
+
+
+def get_enabled_branches():
+    """Enabled flag for every branch in a single query"""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('SELECT branch, is_enabled FROM branch_status')
+    rows = c.fetchall()
+    enabled = {branch_key: True for branch_key in BRANCHES}
+    enabled.update({branch: bool(is_enabled) for branch, is_enabled in rows})
+    return enabled
+
+
+def check_branch_health(branch_key):
+    """Query a branch instance's /api/status (network only, no database access)"""
     try:
         url = BRANCHES[branch_key]['url']
-        response = requests.get(f"{url}/api/status", timeout=5)
+        response = peer_request(branch_key, 'GET', f"{url}/api/status", timeout=STATUS_POLL_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             return {
                 'online': True,
                 'status': data.get('status', 'Unknown'),
-                'message': data.get('message', ''),
-                'enabled': is_branch_enabled(branch_key)
+                'message': data.get('message', '')
             }
     except Exception as e:
         print(f"Error checking {branch_key}: {e}")
@@ -329,11 +1649,138 @@ def get_branch_status(branch_key):
     return {
         'online': False,
         'status': 'Offline',
-        'message': 'Cannot connect to branch instance',
-        'enabled': is_branch_enabled(branch_key)
+        'message': 'Cannot connect to branch instance'
     }
 
 
+def poll_branch_statuses(branch_keys=None):
+    """Check the given (default: all) branches concurrently and update the cache"""
+    branch_keys = list(branch_keys or BRANCHES.keys())
+    if not branch_keys:
+        return
+    results = dict(zip(branch_keys, _status_poll_executor.map(check_branch_health, branch_keys)))
+    checked_at = datetime.now()
+    with _branch_status_lock:
+        changed = False
+        for branch_key, result in results.items():
+            previous = _branch_status_cache.get(branch_key)
+            if previous is None or any(previous[k] != result[k] for k in result):
+                changed = True
+            _branch_status_cache[branch_key] = {**result, 'checked_at': checked_at}
+        if changed:
+            _branch_status_changed.notify_all()
+
+
+def _branch_status_poller():
+    """Background loop refreshing the branch status cache
+
+    Each pass splits the branches into shards of STATUS_POLL_SHARD_SIZE and
+    spreads them over STATUS_POLL_INTERVAL, so a large fleet is checked in
+    steady small batches instead of one burst. A refresh request starts a new
+    full pass at once.
+    """
+    while True:
+        try:
+            branch_keys = sorted(refresh_branches())
+        except Exception as e:
+            print(f"Error loading branches: {e}")
+            branch_keys = sorted(BRANCHES)
+        shards = [branch_keys[i:i + STATUS_POLL_SHARD_SIZE]
+                  for i in range(0, len(branch_keys), STATUS_POLL_SHARD_SIZE)] or [[]]
+        pause = STATUS_POLL_INTERVAL / len(shards)
+        for shard in shards:
+            try:
+                poll_branch_statuses(shard)
+            except Exception as e:
+                print(f"Error polling branch statuses: {e}")
+            if _status_poll_wakeup.wait(pause):
+                _status_poll_wakeup.clear()
+                break
+
+
+def start_status_poller():
+    """Start the background status poller once per process"""
+    global _status_poller_thread
+    if _status_poller_thread and _status_poller_thread.is_alive():
+        return
+    _status_poller_thread = threading.Thread(target=_branch_status_poller, name="branch-status-poller", daemon=True)
+    _status_poller_thread.start()
+
+
+def request_status_refresh():
+    """Ask the poller to re-check branches now instead of at the next interval"""
+    _status_poll_wakeup.set()
+
+
+def get_viewable_branches():
+    """Branch keys the logged-in user may view"""
+    if session.get('is_admin'):
+        return list(BRANCHES.keys())
+    perms = get_user_permissions(session['user_id'])
+    return [b for b in BRANCHES if b in perms and perms[b]['can_view']]
+
+
+def get_branch_statuses(branch_keys):
+    """Cached status for several branches, with enabled flags from one query"""
+    with _branch_status_lock:
+        missing = [b for b in branch_keys if b not in _branch_status_cache]
+    if missing:
+        # Check branches the poller hasn't reached yet in one concurrent batch
+        poll_branch_statuses(missing)
+    enabled = get_enabled_branches()
+    return {b: get_branch_status(b, enabled.get(b, True)) for b in branch_keys}
+
+
+def get_branch_status(branch_key, enabled=None):
+    """Get the cached status of a branch instance"""
+    with _branch_status_lock:
+        cached = _branch_status_cache.get(branch_key)
+    if cached is None:
+        # Poller hasn't reported yet (e.g. first request after start-up)
+        poll_branch_statuses([branch_key])
+        with _branch_status_lock:
+            cached = _branch_status_cache[branch_key]
+    
+    checked_at = cached['checked_at']
+    age = (datetime.now() - checked_at).total_seconds()
+    return {
+        'online': cached['online'],
+        'status': cached['status'],
+        'message': cached['message'],
+        'enabled': is_branch_enabled(branch_key) if enabled is None else enabled,
+        'checked_at': checked_at.isoformat(),
+        'age_seconds': round(age, 1),
+        'stale': age > STATUS_POLL_INTERVAL * 3,
+        'circuit_open': not peer_available(branch_key)
+    }
+
+
+def list_dashboard_branches(branch_keys, search='', status='', page=1, per_page=DASHBOARD_PAGE_SIZE):
+    """One page of branches matching a name/key search and a status filter
+
+    status is '', 'online', 'offline' or 'disabled'. Returns (branches with
+    their cached status, total matches, page, total pages).
+    """
+    if search:
+        needle = search.lower()
+        branch_keys = [b for b in branch_keys if needle in b.lower() or needle in BRANCHES[b]['name'].lower()]
+    if status:
+        statuses = get_branch_statuses(branch_keys)
+        if status == 'disabled':
+            branch_keys = [b for b in branch_keys if not statuses[b]['enabled']]
+        else:
+            online = status == 'online'
+            branch_keys = [b for b in branch_keys if statuses[b]['enabled'] and statuses[b]['online'] == online]
+    
+    total = len(branch_keys)
+    total_pages = max((total + per_page - 1) // per_page, 1)
+    page = min(max(page, 1), total_pages)
+    page_keys = branch_keys[(page - 1) * per_page:page * per_page]
+    statuses = get_branch_statuses(page_keys)
+    branches = {b: {**BRANCHES[b], **statuses[b]} for b in page_keys}
+    return branches, total, page, total_pages
+
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
@@ -378,13 +1825,15 @@ def favicon_16():
 @app.route('/')
 @login_required
 def dashboard():
-    """Main dashboard showing all branches"""
-    branch_statuses = {}
-    for branch_key, branch_info in BRANCHES.items():
-        branch_statuses[branch_key] = {
-            **branch_info,
-            **get_branch_status(branch_key)
-        }
+    """Main dashboard showing branches (paginated, searchable, filterable by status)"""
+    search = request.args.get('q', '').strip()
+    status = request.args.get('status', '')
+    if status not in ('online', 'offline', 'disabled'):
+        status = ''
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', DASHBOARD_PAGE_SIZE, type=int), 1), 200)
+    branch_statuses, total, page, total_pages = list_dashboard_branches(
+        get_viewable_branches(), search, status, page, per_page)
     
     user_permissions = {}
     if not session.get('is_admin'):
@@ -394,6 +1843,12 @@ def dashboard():
                          branches=branch_statuses,
                          user_permissions=user_permissions,
                          is_admin=session.get('is_admin', False),
+                         search=search,
+                         status_filter=status,
+                         page=page,
+                         per_page=per_page,
+                         total=total,
+                         total_pages=total_pages,
                          now=datetime.now())
 
 
@@ -441,6 +1896,275 @@ def branch_status_api(branch):
     return jsonify(status)
 
 
+@app.route('/api/branches/status')
+@login_required
+def branches_status_api():
+    """Status of every branch the user can view, from the poller cache"""
+    return jsonify({'branches': get_branch_statuses(get_viewable_branches()),
+                    'generated_at': datetime.now().isoformat()})
+
+
+@app.route('/api/branches/status/stream')
+@login_required
+def branches_status_stream():
+    """Server-Sent Events stream of branch status changes
+
+    Sends a full snapshot on connect, then only branches whose status, message,
+    online or enabled flag changed. A heartbeat comment keeps proxies from
+    closing an idle connection and doubles as the re-check for enabled changes
+    made by other workers. Streams end after STREAM_MAX_SECONDS; when all
+    stream slots are taken the snapshot is sent alone with a longer retry.
+    """
+    branch_keys = get_viewable_branches()
+
+    def snapshot():
+        statuses = get_branch_statuses(branch_keys)
+        return statuses, {b: (st['online'], st['status'], st['message'], bool(st['enabled']))
+                          for b, st in statuses.items()}
+
+    def generate():
+        statuses, last_sent = snapshot()
+        if not _stream_slots.acquire(blocking=False):
+            yield f"retry: {STREAM_BUSY_RETRY * 1000}\nevent: status\ndata: {json.dumps(statuses)}\n\n"
+            return
+        try:
+            yield f"event: status\ndata: {json.dumps(statuses)}\n\n"
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                with _branch_status_changed:
+                    notified = _branch_status_changed.wait(STATUS_STREAM_HEARTBEAT)
+                statuses, current = snapshot()
+                changes = {b: statuses[b] for b in branch_keys if current[b] != last_sent.get(b)}
+                last_sent = current
+                if changes:
+                    yield f"event: status\ndata: {json.dumps(changes)}\n\n"
+                elif not notified:
+                    yield ": heartbeat\n\n"
+        finally:
+            _stream_slots.release()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/branches', methods=['GET'])
+@login_required
+def branches_api():
+    """Branches the user can view, paginated (?q=, ?status=online|offline|disabled, ?page=, ?per_page=)"""
+    status = request.args.get('status', '')
+    if status not in ('', 'online', 'offline', 'disabled'):
+        return jsonify({'error': 'status must be online, offline or disabled'}), 400
+    per_page = min(max(request.args.get('per_page', DASHBOARD_PAGE_SIZE, type=int), 1), 200)
+    branches, total, page, total_pages = list_dashboard_branches(
+        get_viewable_branches(), request.args.get('q', '').strip(), status,
+        request.args.get('page', 1, type=int), per_page)
+    return jsonify({
+        'branches': [{'key': key, **info} for key, info in branches.items()],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'total_pages': total_pages
+    })
+
+
+@app.route('/api/events', methods=['GET'])
+@login_required
+def federated_events():
+    """Events from every branch the user can view, merged by timestamp as NDJSON
+
+    Takes the branch /api/events filters (since, until, event, status,
+    emergency_id, q, limit) plus branches=tuc,poc to narrow the branches.
+    """
+    branches = get_viewable_branches()
+    if request.args.get('branches'):
+        requested = [b.strip() for b in request.args['branches'].split(',') if b.strip()]
+        denied = [b for b in requested if b not in branches]
+        if denied:
+            return jsonify({'error': 'Permission denied', 'branches': denied}), 403
+        branches = requested
+    params = {name: request.args[name] for name in EVENT_QUERY_PARAMS if request.args.get(name)}
+    if 'limit' in params:
+        params['limit'] = request.args.get('limit', type=int)
+        if not params['limit'] or params['limit'] < 0:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+    return Response(query_branch_events(branches, params), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/events/search', methods=['GET'])
+@login_required
+def search_events():
+    """Search events shipped by branches, newest first
+
+    Query parameters: q (words that must all appear in the event details),
+    branches, event (comma-separated), status, emergency_id, since, until
+    (ISO dates or timestamps, UTC), limit and cursor (next_cursor of the
+    previous page).
+    """
+    where = []
+    params = []
+    branches = [b.strip() for b in request.args.get('branches', '').split(',') if b.strip()]
+    if not session.get('is_admin'):
+        viewable = get_viewable_branches()
+        denied = [b for b in branches if b not in viewable]
+        if denied:
+            return jsonify({'error': 'Permission denied', 'branches': denied}), 403
+        branches = branches or viewable
+        if not branches:
+            return jsonify({'success': True, 'events': [], 'count': 0, 'next_cursor': None, 'full_text': EVENTS_FTS})
+    if branches:
+        where.append(f"branch IN ({', '.join('?' * len(branches))})")
+        params += branches
+    event_types = [e.strip() for e in request.args.get('event', '').split(',') if e.strip()]
+    if event_types:
+        where.append(f"event IN ({', '.join('?' * len(event_types))})")
+        params += event_types
+    for column in ('status', 'emergency_id'):
+        if request.args.get(column):
+            where.append(f'{column} = ?')
+            params.append(request.args[column])
+    try:
+        if request.args.get('since'):
+            where.append('occurred_at >= ?')
+            params.append(normalize_event_time(request.args['since']))
+        if request.args.get('until'):
+            until = request.args['until']
+            if len(until) == 10:
+                # Date only: include the whole day
+                where.append('occurred_at < ?')
+                params.append(normalize_event_time((datetime.fromisoformat(until) + timedelta(days=1)).isoformat()))
+            else:
+                where.append('occurred_at <= ?')
+                params.append(normalize_event_time(until))
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates or timestamps'}), 400
+    text = request.args.get('q', '').strip()
+    if text:
+        if EVENTS_FTS:
+            where.append('rowid IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)')
+            params.append(events_fts_query(text))
+        else:
+            for term in text.split():
+                escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                where.append("details LIKE ? ESCAPE '\\'")
+                params.append(f'%{escaped}%')
+    
+    # Keyset pagination: rows strictly after the cursor in (occurred_at, id) order
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after_time, after_id = decode_recordings_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        where.append('(occurred_at < ? OR (occurred_at = ? AND id < ?))')
+        params += [after_time, after_time, after_id]
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    
+    rows = get_db().execute(f'''SELECT id, branch, event, status, emergency_id, occurred_at, details
+                                FROM events {'WHERE ' + ' AND '.join(where) if where else ''}
+                                ORDER BY occurred_at DESC, id DESC LIMIT ?''', params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'success': True,
+        'events': [{
+            'id': row[0],
+            'branch': row[1],
+            'event': row[2],
+            'status': row[3],
+            'emergency_id': row[4],
+            'timestamp': row[5],
+            'data': json.loads(row[6]) if row[6] else {}
+        } for row in rows],
+        'count': len(rows),
+        'next_cursor': encode_recordings_cursor(rows[-1][5], rows[-1][0]) if has_more else None,
+        'full_text': EVENTS_FTS
+    })
+
+
+@app.route('/api/internal/branch/<branch>/events', methods=['POST'])
+def ingest_branch_events(branch):
+    """Internal endpoint for branches to ship log events (no auth required for internal network)
+
+    Takes {"events": [...]}, optionally gzip-compressed. Events are stored once
+    per id, so a batch resent after a lost acknowledgement is harmless; a 200
+    tells the branch it may move past the batch.
+    """
+    if branch not in BRANCHES:
+        return jsonify({'error': 'Invalid branch'}), 404
+    try:
+        events = _read_event_batch()['events']
+        if not isinstance(events, list):
+            raise ValueError('events must be a list')
+    except (ValueError, KeyError, TypeError, zlib.error):
+        return jsonify({'error': 'Body must be {"events": [...]} JSON, optionally gzip-compressed'}), 400
+    
+    stored, invalid = store_events(branch, events)
+    prune_events()
+    return jsonify({
+        'success': True,
+        'received': len(events),
+        'stored': stored,
+        'duplicates': len(events) - invalid - stored,
+        'invalid': invalid
+    })
+
+
+@app.route('/api/branches', methods=['POST'])
+@admin_required
+def register_branch():
+    """Register a branch instance, or update the name/URLs of an existing one"""
+    data = request.get_json() or {}
+    key = (data.get('key') or '').strip().lower()
+    name = (data.get('name') or '').strip()
+    url = (data.get('url') or '').strip().rstrip('/')
+    public_url = (data.get('public_url') or '').strip().rstrip('/')
+    
+    if not BRANCH_KEY_PATTERN.match(key) or key == GLOBAL_SETTINGS_SCOPE:
+        return jsonify({'error': 'key must be 1-32 lowercase letters, digits, - or _'}), 400
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+    if not url.startswith(('http://', 'https://')) or (public_url and not public_url.startswith(('http://', 'https://'))):
+        return jsonify({'error': 'url and public_url must be http(s) URLs'}), 400
+    
+    conn = get_db()
+    existed = conn.execute('SELECT 1 FROM branches WHERE key = ?', (key,)).fetchone() is not None
+    conn.execute('''INSERT INTO branches (key, name, url, public_url, created_by) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET name = excluded.name, url = excluded.url,
+                                                   public_url = excluded.public_url''',
+                 (key, name, url, public_url, session['username']))
+    conn.execute('''INSERT OR IGNORE INTO branch_status (branch, is_enabled, last_check)
+                    VALUES (?, 1, CURRENT_TIMESTAMP)''', (key,))
+    bump_cache_version(conn, 'branches')
+    conn.commit()
+    refresh_branches()
+    request_status_refresh()
+    
+    print(f"Branch {key} {'updated' if existed else 'registered'} by {session['username']}")
+    return jsonify({'success': True, 'key': key, 'created': not existed, **BRANCHES[key]}), 200 if existed else 201
+
+
+@app.route('/api/branches/<branch>', methods=['DELETE'])
+@admin_required
+def deregister_branch(branch):
+    """Remove a branch from the registry (its settings, permissions and recordings are kept)"""
+    if branch not in BRANCHES:
+        return jsonify({'error': 'Invalid branch'}), 404
+    
+    conn = get_db()
+    conn.execute('DELETE FROM branches WHERE key = ?', (branch,))
+    conn.execute('DELETE FROM branch_status WHERE branch = ?', (branch,))
+    bump_cache_version(conn, 'branches')
+    conn.commit()
+    refresh_branches()
+    with _branch_status_changed:
+        _branch_status_cache.pop(branch, None)
+        _branch_status_changed.notify_all()
+    
+    print(f"Branch {branch} deregistered by {session['username']}")
+    return jsonify({'success': True, 'key': branch})
+
+
 @app.route('/api/branch/<branch>/disable', methods=['POST'])
 @login_required
 def disable_branch(branch):
@@ -491,41 +2215,45 @@ def enable_branch(branch):
     return jsonify({'success': True, 'message': f'{branch_name} branch enabled'})
 
 
-def restart_container(branch):
-    """Restart a Docker container for a specific branch"""
-    try:
-        # Get the container name from docker-compose.multi.yml naming convention
-        container_name = f"twilio_responder_{branch}"
-        
-        # Try to restart the container using docker CLI
-        result = subprocess.run(
-            ['docker', 'restart', container_name],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if result.returncode == 0:
-            return True, f"Container {container_name} restarted successfully"
-        else:
-            # Log the actual error internally but don't expose to user
-            error_msg = result.stderr.strip() if result.stderr else result.stdout.strip()
-            print(f"Container restart failed for {container_name}: {error_msg}", flush=True)
-            return False, "Failed to restart container. Please contact administrator."
-    except subprocess.TimeoutExpired:
-        return False, "Restart operation timed out"
-    except FileNotFoundError:
-        return False, "Docker CLI not available in this environment"
-    except Exception as e:
-        # Log the actual error internally but don't expose details to user
-        print(f"Unexpected error during restart: {str(e)}", flush=True)
-        return False, "An unexpected error occurred. Please contact administrator."
+@app.route('/api/notifications', methods=['GET'])
+@admin_required
+def notification_outbox():
+    """Recent admin SMS notifications and their delivery state"""
+    conn = get_db()
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM notification_outbox GROUP BY status').fetchall())
+    rows = conn.execute('''SELECT id, message, status, attempts, created_at, sent_at, error
+                           FROM notification_outbox ORDER BY id DESC LIMIT 50''').fetchall()
+    return jsonify({
+        'counts': counts,
+        'notifications': [{
+            'id': row[0],
+            'message': row[1],
+            'status': row[2],
+            'attempts': row[3],
+            'created_at': row[4],
+            'sent_at': row[5],
+            'error': row[6]
+        } for row in rows]
+    })
+
+
+def _restart_batch_response(batch_id, job_ids, skipped, message):
+    """202 reply for a queued restart batch"""
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'job_ids': job_ids,
+        'skipped': skipped,
+        'status_url': url_for('restart_batch_status', batch_id=batch_id),
+        'stream_url': url_for('restart_batch_stream', batch_id=batch_id),
+        'message': message
+    }), 202
 
 
 @app.route('/api/branch/<branch>/restart', methods=['POST'])
 @login_required
 def restart_branch(branch):
-    """Restart a branch container"""
+    """Queue a restart of a branch container (answers 202 with a batch to follow)"""
     if branch not in BRANCHES:
         return jsonify({'error': 'Invalid branch'}), 404
     
@@ -535,28 +2263,107 @@ def restart_branch(branch):
         if branch not in perms or not perms[branch].get('can_restart', False):
             return jsonify({'error': 'Permission denied'}), 403
     
-    confirm = request.json.get('confirm', False)
-    if not confirm:
+    data = request.get_json() or {}
+    if not data.get('confirm', False):
         return jsonify({'error': 'Confirmation required'}), 400
     
-    # Perform restart
-    success, message = restart_container(branch)
+    batch_id, job_ids, skipped = create_restart_jobs([branch], session['username'], bool(data.get('skip_drain')))
+    if skipped:
+        return jsonify({'error': f"{BRANCHES[branch]['name']} is already being restarted"}), 409
+    start_restart_jobs(job_ids)
+    return _restart_batch_response(batch_id, job_ids, skipped,
+                                   f"Restart of {BRANCHES[branch]['name']} queued")
+
+
+@app.route('/api/restarts', methods=['POST'])
+@admin_required
+def rolling_restart():
+    """Restart several branches one after another (all branches if none are listed)"""
+    data = request.get_json() or {}
+    if not data.get('confirm', False):
+        return jsonify({'error': 'Confirmation required'}), 400
+    branches = data.get('branches') or list(BRANCHES)
+    unknown = [b for b in branches if b not in BRANCHES]
+    if unknown:
+        return jsonify({'error': 'Invalid branch', 'branches': unknown}), 404
     
-    if success:
-        # Send SMS notification
-        branch_name = BRANCHES[branch]['name']
-        notification_message = f"INFO: {branch_name} branch container has been RESTARTED by {session['username']} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        send_sms_notification(notification_message)
-        
-        return jsonify({'success': True, 'message': message})
-    else:
-        return jsonify({'error': message}), 500
+    batch_id, job_ids, skipped = create_restart_jobs(branches, session['username'], bool(data.get('skip_drain')))
+    start_restart_jobs(job_ids)
+    print(f"Rolling restart of {len(job_ids)} branches queued by {session['username']}")
+    return _restart_batch_response(batch_id, job_ids, skipped,
+                                   f"Rolling restart of {len(job_ids)} branch{'' if len(job_ids) == 1 else 'es'} queued")
+
+
+def _viewable_restart_batch(batch_id):
+    """A batch's jobs limited to branches the user can view (None if there are none)"""
+    jobs = get_restart_batch(batch_id)
+    if not session.get('is_admin'):
+        viewable = set(get_viewable_branches())
+        jobs = [job for job in jobs if job['branch'] in viewable]
+    return jobs or None
+
+
+@app.route('/api/restarts/<batch_id>', methods=['GET'])
+@login_required
+def restart_batch_status(batch_id):
+    """Progress of a restart batch"""
+    jobs = _viewable_restart_batch(batch_id)
+    if jobs is None:
+        return jsonify({'error': 'Restart not found'}), 404
+    return jsonify({'batch_id': batch_id, 'jobs': jobs, 'final': all(job['final'] for job in jobs)})
+
+
+@app.route('/api/restarts/<batch_id>/stream')
+@login_required
+def restart_batch_stream(batch_id):
+    """Server-Sent Events stream of a restart batch
+
+    A `progress` event carries every job whenever one changes; a `done` event
+    follows once all jobs are final and the stream ends. Like the status stream
+    it is limited to STREAM_MAX_SECONDS and to the shared stream slots.
+    """
+    if _viewable_restart_batch(batch_id) is None:
+        return jsonify({'error': 'Restart not found'}), 404
+    is_admin = session.get('is_admin')
+    viewable = None if is_admin else set(get_viewable_branches())
+
+    def visible_jobs():
+        return [job for job in get_restart_batch(batch_id) if viewable is None or job['branch'] in viewable]
+
+    def generate():
+        if not _stream_slots.acquire(blocking=False):
+            jobs = visible_jobs()
+            yield f"retry: {STREAM_BUSY_RETRY * 1000}\nevent: progress\ndata: {json.dumps({'jobs': jobs})}\n\n"
+            if all(job['final'] for job in jobs):
+                yield f"event: done\ndata: {json.dumps({'jobs': jobs})}\n\n"
+            return
+        try:
+            last_sent = None
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                jobs = visible_jobs()
+                current = [(job['status'], job['message']) for job in jobs]
+                if current != last_sent:
+                    yield f"event: progress\ndata: {json.dumps({'jobs': jobs})}\n\n"
+                    last_sent = current
+                else:
+                    yield ": heartbeat\n\n"
+                if all(job['final'] for job in jobs):
+                    yield f"event: done\ndata: {json.dumps({'jobs': jobs})}\n\n"
+                    return
+                with _restart_changed:
+                    _restart_changed.wait(RESTART_POLL_INTERVAL * 2)
+        finally:
+            _stream_slots.release()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/branch/<branch>/trigger', methods=['POST'])
 @login_required
 def trigger_emergency(branch):
-    """Trigger an emergency on a branch"""
+    """Trigger an emergency on a branch (answers 202 with a job to follow)"""
     if branch not in BRANCHES:
         return jsonify({'error': 'Invalid branch'}), 404
     
@@ -578,65 +2385,90 @@ def trigger_emergency(branch):
         if not data.get(field):
             return jsonify({'error': f'Missing required field: {field}'}), 400
     
-    # Forward the request to the branch instance
-    try:
-        branch_url = BRANCHES[branch]['url']
-        response = requests.post(
-            f"{branch_url}/webhook",
-            json=data,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Send SMS notification
-            branch_name = BRANCHES[branch]['name']
-            notification_message = f"INFO: Emergency triggered on {branch_name} branch by {session['username']} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            send_sms_notification(notification_message)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Emergency triggered successfully on {branch_name}',
-                'data': result
-            })
-        else:
-            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            return jsonify({
-                'error': error_data.get('message', f'Branch returned error: {response.status_code}'),
-                'status_code': response.status_code
-            }), response.status_code
-            
-    except requests.exceptions.Timeout:
-        return jsonify({'error': 'Request to branch timed out'}), 504
-    except requests.exceptions.ConnectionError:
-        return jsonify({'error': 'Could not connect to branch instance'}), 503
-    except Exception as e:
-        print(f"Error triggering emergency on {branch}: {e}")
-        return jsonify({'error': 'An unexpected error occurred'}), 500
+    # Record the trigger and forward it in the background; the UI follows the job
+    job_id = create_trigger_job(branch, data, session['username'])
+    start_trigger_job(job_id)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('trigger_job_status', job_id=job_id),
+        'message': f"Emergency submitted to {BRANCHES[branch]['name']}"
+    }), 202
+
+
+@app.route('/api/trigger/jobs/<job_id>', methods=['GET'])
+@login_required
+def trigger_job_status(job_id):
+    """Progress of a dashboard emergency trigger"""
+    job = get_trigger_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown trigger job'}), 404
+    
+    if not session.get('is_admin'):
+        perms = get_user_permissions(session['user_id'])
+        if job['branch'] not in perms or not perms[job['branch']]['can_view']:
+            return jsonify({'error': 'Permission denied'}), 403
+    
+    return jsonify(job)
 
 
 @app.route('/users')
 @admin_required
 def users():
-    """User management page"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """User management page (paginated, searchable by username)"""
+    search = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', USERS_PAGE_SIZE, type=int), 1), 200)
+    
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('''SELECT id, username, is_admin, created_at FROM users ORDER BY created_at DESC''')
-    users_list = []
+    where = ''
+    params = []
+    if search:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where = "WHERE username LIKE ? ESCAPE '\\'"
+        params.append(f'%{escaped}%')
+    
+    c.execute(f'SELECT COUNT(*) FROM users {where}', params)
+    total = c.fetchone()[0]
+    total_pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, total_pages)
+    
+    # One query for the page of users and all of their branch permissions
+    c.execute(f'''SELECT u.id, u.username, u.is_admin, u.created_at,
+                        p.branch, p.can_view, p.can_trigger, p.can_disable,
+                        p.can_edit_basic_settings, p.can_edit_advanced_settings, p.can_restart
+                 FROM (SELECT id, username, is_admin, created_at FROM users {where}
+                       ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?) u
+                 LEFT JOIN user_permissions p ON p.user_id = u.id
+                 ORDER BY u.created_at DESC, u.id DESC''',
+              params + [per_page, (page - 1) * per_page])
+    users_by_id = {}
     for row in c.fetchall():
-        user_perms = get_user_permissions(row[0])
-        users_list.append({
-            'id': row[0],
-            'username': row[1],
-            'is_admin': bool(row[2]),
-            'created_at': row[3],
-            'permissions': user_perms
-        })
+        user = users_by_id.get(row[0])
+        if user is None:
+            user = users_by_id[row[0]] = {
+                'id': row[0],
+                'username': row[1],
+                'is_admin': bool(row[2]),
+                'created_at': row[3],
+                'permissions': {}
+            }
+        if row[4] is not None:
+            user['permissions'][row[4]] = {
+                'can_view': bool(row[5]),
+                'can_trigger': bool(row[6]),
+                'can_disable': bool(row[7]),
+                'can_edit_basic_settings': bool(row[8]),
+                'can_edit_advanced_settings': bool(row[9]),
+                'can_restart': bool(row[10])
+            }
     
-    conn.close()
-    return render_template('users.html', users=users_list, branches=BRANCHES)
+    return render_template('users.html', users=list(users_by_id.values()), branches=BRANCHES,
+                           search=search, page=page, per_page=per_page,
+                           total=total, total_pages=total_pages)
 
 
 @app.route('/users/create', methods=['POST'])
@@ -651,7 +2483,7 @@ def create_user():
         flash('Username and password are required', 'error')
         return redirect(url_for('users'))
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     try:
@@ -679,12 +2511,12 @@ def create_user():
                           1 if can_edit_basic else 0, 1 if can_edit_advanced else 0,
                           1 if can_restart else 0))
         
+        bump_cache_version(conn, 'permissions')
         conn.commit()
         flash(f'User {username} created successfully', 'success')
     except sqlite3.IntegrityError:
+        conn.rollback()
         flash(f'User {username} already exists', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('users'))
 
@@ -697,7 +2529,7 @@ def edit_user(user_id):
         flash('Cannot edit your own account permissions', 'error')
         return redirect(url_for('users'))
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     # Check if user exists
@@ -705,7 +2537,6 @@ def edit_user(user_id):
     user = c.fetchone()
     if not user:
         flash('User not found', 'error')
-        conn.close()
         return redirect(url_for('users'))
     
     username = user[0]
@@ -739,8 +2570,8 @@ def edit_user(user_id):
         # If promoted to admin, remove all specific permissions
         c.execute('DELETE FROM user_permissions WHERE user_id = ?', (user_id,))
     
+    bump_cache_version(conn, 'permissions')
     conn.commit()
-    conn.close()
     
     flash(f'User {username} updated successfully', 'success')
     return redirect(url_for('users'))
@@ -754,14 +2585,14 @@ def delete_user(user_id):
         flash('Cannot delete your own account', 'error')
         return redirect(url_for('users'))
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('DELETE FROM user_permissions WHERE user_id = ?', (user_id,))
     c.execute('DELETE FROM users WHERE id = ?', (user_id,))
     
+    bump_cache_version(conn, 'permissions')
     conn.commit()
-    conn.close()
     
     flash('User deleted successfully', 'success')
     return redirect(url_for('users'))
@@ -883,165 +2714,943 @@ def update_branch_settings_api(branch):
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    # Update each setting with permission checks
-    updated_keys = []
-    denied_keys = []
-    for key, value in data.items():
-        # Check if user has permission to edit this setting
-        if not can_edit_setting(key, is_admin, branch_perms):
-            denied_keys.append(key)
-            continue
-        
-        # Skip empty values for sensitive fields
-        if not value and (key.endswith('TOKEN') or key.endswith('SID')):
-            continue
-        
-        update_branch_setting(branch, key, value, session['username'])
-        updated_keys.append(key)
-    
+    # Check every key before writing anything so a save applies fully or not at all
+    denied_keys = [key for key in data if not can_edit_setting(key, is_admin, branch_perms)]
     if denied_keys:
         return jsonify({
             'error': f'Permission denied for settings: {", ".join(denied_keys)}',
             'denied_keys': denied_keys
         }), 403
     
-    # Trigger settings reload on the branch
-    try:
-        branch_url = BRANCHES[branch]['url']
-        reload_response = requests.post(f"{branch_url}/api/reload_settings", timeout=5)
-        if reload_response.status_code == 200:
-            print(f"Settings reloaded on {branch}")
-    except Exception as e:
-        print(f"Failed to reload settings on {branch}: {e}")
+    # Skip empty values for sensitive fields
+    updates = {key: value for key, value in data.items()
+               if value or not (key.endswith('TOKEN') or key.endswith('SID'))}
+    updated_keys = list(updates.keys())
+    
+    # A value equal to the global one is stored as no override, so it keeps following global changes
+    global_settings = get_global_settings()
+    for key, value in updates.items():
+        if key in global_settings and value == global_settings[key]:
+            updates[key] = None
     
-    # Send notification
     branch_name = BRANCHES[branch]['name']
+    if not updates:
+        return jsonify({'success': True, 'message': f'No changes for {branch_name}', 'updated_keys': []})
+    
+    version = update_branch_settings(branch, updates, session['username'])
+    
+    # Reload the branch in the background
+    push_settings_reload({branch: version})
     message = f"INFO: {branch_name} settings updated by {session['username']} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     send_sms_notification(message)
     
     return jsonify({
         'success': True, 
         'message': f'Settings updated for {branch_name}',
-        'updated_keys': updated_keys
+        'updated_keys': updated_keys,
+        'version': version,
+        'push_status_url': url_for('settings_push_status', branch=branch)
+    })
+
+
+@app.route('/api/branch/<branch>/settings/push', methods=['GET'])
+@login_required
+def settings_push_status(branch):
+    """Whether the branch has acknowledged its latest settings reload push"""
+    if branch not in BRANCHES:
+        return jsonify({'error': 'Invalid branch'}), 404
+    
+    if not session.get('is_admin'):
+        perms = get_user_permissions(session['user_id'])
+        if branch not in perms or not perms[branch]['can_view']:
+            return jsonify({'error': 'Permission denied'}), 403
+    
+    return jsonify({
+        'branch': branch,
+        'version': get_settings_version(branch),
+        'push': get_settings_push_status(branch)
+    })
+
+
+@app.route('/settings/global')
+@admin_required
+def global_settings_page():
+    """Global settings page (defaults inherited by every branch)"""
+    return render_template('branch_settings.html',
+                         branch_key=GLOBAL_SETTINGS_SCOPE,
+                         branch={'name': 'Global'},
+                         settings=get_global_settings(),
+                         is_global=True,
+                         is_admin=True,
+                         can_edit_basic=True,
+                         can_edit_advanced=True,
+                         basic_settings=BASIC_SETTINGS,
+                         advanced_settings=ADVANCED_SETTINGS,
+                         admin_only_settings=ADMIN_ONLY_SETTINGS)
+
+
+@app.route('/api/settings/global', methods=['GET'])
+@admin_required
+def get_global_settings_api():
+    """Global settings and the branches overriding each of them"""
+    overrides = {}
+    rows = get_db().execute('''SELECT setting_key, branch FROM branch_settings
+                               WHERE branch != ? ORDER BY branch''', (GLOBAL_SETTINGS_SCOPE,)).fetchall()
+    for key, branch in rows:
+        overrides.setdefault(key, []).append(branch)
+    settings = get_global_settings()
+    return jsonify({
+        'settings': settings,
+        'overridden_by': {key: overrides.get(key, []) for key in settings},
+        'version': get_cache_version(f'settings:{GLOBAL_SETTINGS_SCOPE}', fresh=True)
+    })
+
+
+@app.route('/api/settings/global', methods=['POST'])
+@admin_required
+def update_global_settings_api():
+    """Update global settings and push the change to every branch"""
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    rejected_keys = [key for key in data if key in BRANCH_ONLY_SETTINGS]
+    if rejected_keys:
+        return jsonify({
+            'error': f'Settings cannot be set globally: {", ".join(rejected_keys)}',
+            'rejected_keys': rejected_keys
+        }), 400
+    
+    # An empty value removes the global default
+    updates = {key: value if value != '' else None for key, value in data.items()}
+    update_branch_settings(GLOBAL_SETTINGS_SCOPE, updates, session['username'])
+    
+    # One version bump covers every branch; rebuild their views and push to all at once
+    versions = precompute_branch_settings()
+    push_settings_reload(versions)
+    message = f"INFO: Global settings updated by {session['username']} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    send_sms_notification(message)
+    
+    return jsonify({
+        'success': True,
+        'message': 'Global settings updated for all branches',
+        'updated_keys': list(updates.keys()),
+        'versions': versions
     })
 
 
 @app.route('/api/internal/branch/<branch>/settings', methods=['GET'])
 def internal_branch_settings(branch):
-    """Internal endpoint for branches to fetch their settings (no auth required for internal network)"""
+    """Internal endpoint for branches to fetch their settings (no auth required for internal network)
+
+    Responses carry the settings version as ETag and X-Settings-Version. A
+    matching If-None-Match gets 304. With ?since_version=N the request waits
+    (up to SETTINGS_LONG_POLL_TIMEOUT seconds) until the version passes N,
+    answering 304 if nothing changed in that time. When SETTINGS_LONG_POLL_MAX
+    requests are already waiting it answers at once with a Retry-After.
+    """
     if branch not in BRANCHES:
         return jsonify({'error': 'Invalid branch'}), 404
     
-    settings = get_branch_settings_with_defaults(branch)
+    since_version = request.args.get('since_version', type=int)
+    held = False
+    if since_version is not None:
+        held = _long_poll_slots.acquire(blocking=False)
+    if held:
+        try:
+            deadline = time.monotonic() + SETTINGS_LONG_POLL_TIMEOUT
+            # Updates from this process notify at once; other workers are seen by re-reading
+            while get_settings_version(branch) <= since_version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with _settings_changed:
+                    _settings_changed.wait(min(remaining, 1.0))
+        finally:
+            _long_poll_slots.release()
+    
+    version, settings = get_cached_branch_settings(branch)
+    etag = f'"{branch}-{version}"'
+    headers = {'ETag': etag, 'X-Settings-Version': str(version), 'Cache-Control': 'no-cache'}
+    if since_version is not None and not held:
+        headers['Retry-After'] = str(SETTINGS_LONG_POLL_RETRY)
+    if (since_version is not None and version <= since_version) or etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
     
     # Return all settings (including sensitive ones) since this is internal
-    return jsonify(settings)
+    response = jsonify(settings)
+    response.headers.update(headers)
+    return response
+
+
+# --- Call Recordings Index ---
+_recordings_sync_wakeup = threading.Event()
+_recordings_sync_thread = None
+# Re-read this much before the watermark; Twilio filters recordings by date
+RECORDINGS_SYNC_OVERLAP = timedelta(days=1)
+# A sync claimed longer ago than this is assumed dead and can be retaken;
+# each committed page renews it
+RECORDINGS_SYNC_LEASE = timedelta(minutes=10)
+RECORDINGS_SYNC_PAGE_SIZE = 500
+
+
+def normalize_phone(number):
+    """E.164-style form of a phone number for comparisons ('' if empty)"""
+    if not number:
+        return ''
+    digits = ''.join(ch for ch in number if ch.isdigit())
+    if not digits:
+        return ''
+    if not number.strip().startswith('+') and len(digits) == 10:
+        digits = '1' + digits
+    return '+' + digits
+
+
+def get_branch_numbers(settings):
+    """Normalized Twilio numbers that belong to a branch"""
+    keys = ('TWILIO_PHONE_NUMBER', 'TWILIO_AUTOMATED_NUMBER', 'TWILIO_TRANSFER_NUMBER')
+    return sorted({normalize_phone(settings.get(key)) for key in keys} - {''})
+
+
+def _recording_media_url(uri):
+    return f"{TWILIO_API_BASE_URL}{uri.replace('.json', '.mp3')}" if uri else None
+
+
+def _claim_recordings_sync(branch, account_sid):
+    """Take the sync lease for a branch
+
+    Returns (watermark, resume_before, resume_newest): the watermark is None
+    before the first sync, and the resume columns are set when the last sync
+    stopped part way. Returns False if another worker is already syncing it.
+    """
+    conn = get_db()
+    now = datetime.utcnow()
+    conn.execute('INSERT OR IGNORE INTO recording_sync_state (branch, account_sid) VALUES (?, ?)',
+                 (branch, account_sid))
+    row = conn.execute('''SELECT account_sid, watermark, resume_before, resume_newest
+                          FROM recording_sync_state WHERE branch = ?''', (branch,)).fetchone()
+    if row[0] != account_sid:
+        # Credentials changed: recordings from the old account no longer apply
+        conn.execute('DELETE FROM recordings WHERE branch = ?', (branch,))
+        conn.execute('''UPDATE recording_sync_state
+                        SET account_sid = ?, watermark = NULL, resume_before = NULL, resume_newest = NULL
+                        WHERE branch = ?''', (account_sid, branch))
+        row = (account_sid, None, None, None)
+    claimed = conn.execute('''UPDATE recording_sync_state SET sync_started_at = ?
+                              WHERE branch = ? AND (sync_started_at IS NULL OR sync_started_at < ?)''',
+                           (now.isoformat(), branch, (now - RECORDINGS_SYNC_LEASE).isoformat())).rowcount
+    conn.commit()
+    return tuple(row[1:]) if claimed else False
+
+
+def _recording_calls(client, recordings):
+    """Call details for a page of recordings, as {call_sid: call}
+
+    One calls listing over the page's time span covers most of them; calls
+    outside it are fetched singly.
+    """
+    wanted = {r.call_sid for r in recordings if r.call_sid}
+    created = [r.date_created.replace(tzinfo=None) for r in recordings if r.date_created]
+    calls = {}
+    if wanted and created:
+        for call in client.calls.stream(start_time_after=min(created) - RECORDINGS_SYNC_OVERLAP,
+                                        start_time_before=max(created) + RECORDINGS_SYNC_OVERLAP,
+                                        page_size=1000):
+            if call.sid in wanted:
+                calls[call.sid] = call
+                if len(calls) == len(wanted):
+                    break
+    for recording in recordings:
+        if recording.call_sid and recording.call_sid not in calls:
+            try:
+                calls[recording.call_sid] = client.calls(recording.call_sid).fetch()
+            except Exception as e:
+                print(f"Error fetching call details for recording {recording.sid}: {e}")
+    return calls
+
+
+def sync_branch_recordings(branch):
+    """Pull recordings created since the branch's watermark into the local index
+
+    Twilio lists recordings newest first. Each page's call details are looked
+    up before anything is written, then the page is written and committed on
+    its own, so the database is never locked across Twilio requests. The oldest
+    recording committed so far is kept as resume_before; a sync that fails part
+    way picks up from there next time, and the watermark only moves once the
+    whole window is in. Returns the number of recordings written, or None if
+    skipped.
+    """
+    settings = get_branch_settings_with_defaults(branch)
+    account_sid = settings.get('TWILIO_ACCOUNT_SID')
+    auth_token = settings.get('TWILIO_AUTH_TOKEN')
+    if not account_sid or not auth_token:
+        return None
+
+    claim = _claim_recordings_sync(branch, account_sid)
+    if claim is False:
+        return None
+    watermark, resume_before, newest = claim
+    newest = newest or watermark
+
+    conn = get_db()
+    error = None
+    written = 0
+    try:
+        client = Client(account_sid, auth_token)
+        window = {}
+        if watermark:
+            window['date_created_after'] = datetime.fromisoformat(watermark).replace(tzinfo=None) - RECORDINGS_SYNC_OVERLAP
+        if resume_before:
+            window['date_created_before'] = datetime.fromisoformat(resume_before).replace(tzinfo=None) + RECORDINGS_SYNC_OVERLAP
+
+        page = client.recordings.page(page_size=RECORDINGS_SYNC_PAGE_SIZE, **window)
+        while page is not None:
+            recordings = list(page)
+            calls = _recording_calls(client, recordings)
+            oldest = resume_before
+            for recording in recordings:
+                call = calls.get(recording.call_sid)
+                # '' rather than NULL so keyset pagination can compare every row
+                date_created = recording.date_created.isoformat() if recording.date_created else ''
+                conn.execute('''INSERT OR REPLACE INTO recordings
+                                (sid, branch, call_sid, duration, date_created, status, uri,
+                                 from_number, to_number, from_formatted, to_formatted, synced_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''',
+                             (recording.sid, branch, recording.call_sid,
+                              int(recording.duration) if recording.duration not in (None, '') else None,
+                              date_created, recording.status, recording.uri,
+                              normalize_phone(call.from_) if call else None,
+                              normalize_phone(call.to) if call else None,
+                              call.from_formatted if call else None,
+                              call.to_formatted if call else None))
+                written += 1
+                if date_created and (newest is None or date_created > newest):
+                    newest = date_created
+                if date_created and (oldest is None or date_created < oldest):
+                    oldest = date_created
+            resume_before = oldest
+            conn.execute('''UPDATE recording_sync_state
+                            SET resume_before = ?, resume_newest = ?, sync_started_at = ?
+                            WHERE branch = ?''',
+                         (resume_before, newest, datetime.utcnow().isoformat(), branch))
+            conn.commit()
+            page = page.next_page()
+
+        # The whole window is in: later syncs start from the newest recording
+        conn.execute('''UPDATE recording_sync_state
+                        SET watermark = ?, resume_before = NULL, resume_newest = NULL
+                        WHERE branch = ?''', (newest, branch))
+    except Exception as e:
+        error = str(e)
+        print(f"Error syncing recordings for {branch}: {e}")
+    finally:
+        conn.execute('''UPDATE recording_sync_state
+                        SET last_sync_at = CURRENT_TIMESTAMP, last_error = ?, sync_started_at = NULL
+                        WHERE branch = ?''', (error, branch))
+        conn.commit()
+    return written
+
+
+def _recordings_sync_loop():
+    """Background loop keeping every branch's recordings index current"""
+    while True:
+        try:
+            refresh_branches()
+        except Exception as e:
+            print(f"Error loading branches: {e}")
+        for branch in list(BRANCHES.keys()):
+            try:
+                sync_branch_recordings(branch)
+            except Exception as e:
+                print(f"Error in recordings sync for {branch}: {e}")
+        _recordings_sync_wakeup.wait(RECORDINGS_SYNC_INTERVAL)
+        _recordings_sync_wakeup.clear()
+
+
+def start_recordings_sync():
+    """Start the background recordings sync once per process"""
+    global _recordings_sync_thread
+    if _recordings_sync_thread and _recordings_sync_thread.is_alive():
+        return
+    _recordings_sync_thread = threading.Thread(target=_recordings_sync_loop, name="recordings-sync", daemon=True)
+    _recordings_sync_thread.start()
+
+
+def request_recordings_sync():
+    """Ask the sync thread to run now instead of at the next interval"""
+    _recordings_sync_wakeup.set()
+
+
+def encode_recordings_cursor(date_created, sid):
+    """Opaque cursor pointing just after a recording in (date_created, sid) order"""
+    raw = json.dumps([date_created, sid]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_recordings_cursor(cursor):
+    """Inverse of encode_recordings_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_created, sid = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(date_created, str) or not isinstance(sid, str):
+        raise ValueError('Invalid cursor')
+    return date_created, sid
+
+
+def _parse_date_bound(value, end=False):
+    """ISO date/datetime filter value -> comparable string (UTC); date-only 'end' is inclusive"""
+    parsed = datetime.fromisoformat(value)
+    if len(value) == 10:
+        if end:
+            parsed += timedelta(days=1)
+        return parsed.date().isoformat()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    # Same form as the stored Twilio timestamps ('...+00:00') so strings compare correctly
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def get_recordings_sync_state(branch):
+    """Sync progress for a branch as shown to the recordings UI"""
+    row = get_db().execute('''SELECT last_sync_at, last_error, sync_started_at
+                              FROM recording_sync_state WHERE branch = ?''', (branch,)).fetchone()
+    if not row:
+        return {'synced': False, 'in_progress': False, 'last_sync_at': None, 'last_error': None}
+    return {
+        'synced': row[0] is not None,
+        'in_progress': row[2] is not None,
+        'last_sync_at': row[0],
+        'last_error': row[1]
+    }
 
 
 @app.route('/api/branch/<branch>/recordings', methods=['GET'])
 @login_required
 def get_call_recordings(branch):
-    """Fetch call recordings for a specific branch from Twilio"""
+    """Call recordings for a specific branch, served from the local index"""
     if branch not in BRANCHES:
         return jsonify({'error': 'Invalid branch'}), 404
-    
+
     # Check permissions
     if not session.get('is_admin'):
         perms = get_user_permissions(session['user_id'])
         if branch not in perms or not perms[branch]['can_view']:
             return jsonify({'error': 'Permission denied'}), 403
+
+    _, settings = get_cached_branch_settings(branch)
+    if not settings.get('TWILIO_ACCOUNT_SID') or not settings.get('TWILIO_AUTH_TOKEN'):
+        return jsonify({'error': 'Twilio credentials not configured for this branch'}), 400
+
+    try:
+        page_size = min(max(int(request.args.get('page_size', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'page_size must be an integer'}), 400
+    
+    sync_state = get_recordings_sync_state(branch)
+    if not sync_state['synced'] and not sync_state['in_progress']:
+        request_recordings_sync()
+    
+    # Only calls to or from this branch's numbers (all recordings if none are set)
+    where = ['branch = ?']
+    params = [branch]
+    branch_numbers = get_branch_numbers(settings)
+    if branch_numbers:
+        placeholders = ', '.join('?' * len(branch_numbers))
+        where.append(f'(from_number IN ({placeholders}) OR to_number IN ({placeholders}))')
+        params += branch_numbers + branch_numbers
+    
+    # Optional filters
+    try:
+        if request.args.get('date_from'):
+            where.append('date_created >= ?')
+            params.append(_parse_date_bound(request.args['date_from']))
+        if request.args.get('date_to'):
+            date_to = request.args['date_to']
+            where.append('date_created < ?' if len(date_to) == 10 else 'date_created <= ?')
+            params.append(_parse_date_bound(date_to, end=True))
+    except ValueError:
+        return jsonify({'error': 'date_from and date_to must be ISO dates (YYYY-MM-DD)'}), 400
+    number = normalize_phone(request.args.get('number', ''))
+    if number:
+        where.append('(from_number = ? OR to_number = ?)')
+        params += [number, number]
+    
+    # Keyset pagination: rows strictly after the cursor in (date_created, sid) order
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after_date, after_sid = decode_recordings_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        where.append('(date_created < ? OR (date_created = ? AND sid < ?))')
+        params += [after_date, after_date, after_sid]
+    
+    rows = get_db().execute(f'''SELECT sid, call_sid, duration, date_created, from_formatted, to_formatted,
+                                       status, uri
+                                FROM recordings WHERE {' AND '.join(where)}
+                                ORDER BY date_created DESC, sid DESC LIMIT ?''',
+                            params + [page_size + 1]).fetchall()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    
+    recordings_data = [{
+        'sid': row[0],
+        'call_sid': row[1],
+        'duration': row[2],
+        'date_created': row[3] or None,
+        'from': row[4] or 'Unknown',
+        'to': row[5] or 'Unknown',
+        'status': row[6],
+        'uri': row[7],
+        'media_url': url_for('recording_media', branch=branch, sid=row[0])
+    } for row in rows]
     
-    # Get Twilio credentials for this branch
-    settings = get_branch_settings_with_defaults(branch)
+    return jsonify({
+        'success': True,
+        'recordings': recordings_data,
+        'page_size': page_size,
+        'count': len(recordings_data),
+        'has_more': has_more,
+        'next_cursor': encode_recordings_cursor(rows[-1][3], rows[-1][0]) if has_more else None,
+        'sync': sync_state
+    })
+
+
+# --- Recording Media Cache ---
+_media_cache_lock = threading.Lock()
+_media_download_locks = {}
+
+
+def _media_cache_path(sid):
+    return os.path.join(RECORDINGS_CACHE_DIR, f'{sid}.mp3')
+
+
+def _evict_media_cache(keep=None):
+    """Delete least recently used cached recordings until the cache fits its size limit"""
+    with _media_cache_lock:
+        entries = []
+        total = 0
+        for entry in os.scandir(RECORDINGS_CACHE_DIR):
+            if entry.is_file() and entry.name.endswith('.mp3'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= RECORDINGS_CACHE_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+def open_recording_media(sid, uri, account_sid, auth_token):
+    """Open file handle on a cached copy of a recording's MP3, downloading it from Twilio on a miss
+
+    The file is opened before the download lock is released, so cache eviction
+    removing it afterwards cannot break a response that is still being sent.
+    """
+    path = _media_cache_path(sid)
+    with _media_cache_lock:
+        download_lock = _media_download_locks.setdefault(sid, threading.Lock())
+    downloaded = False
+    try:
+        # One download per recording; concurrent requests wait for it
+        with download_lock:
+            if os.path.exists(path):
+                os.utime(path)  # mark as recently used
+            else:
+                tmp_path = f'{path}.{threading.get_ident()}.part'
+                try:
+                    with requests.get(_recording_media_url(uri), auth=(account_sid, auth_token),
+                                      stream=True, timeout=30) as response:
+                        response.raise_for_status()
+                        with open(tmp_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=64 * 1024):
+                                f.write(chunk)
+                    os.replace(tmp_path, path)
+                    downloaded = True
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            media = open(path, 'rb')
+    finally:
+        with _media_cache_lock:
+            if _media_download_locks.get(sid) is download_lock:
+                del _media_download_locks[sid]
+    if downloaded:
+        _evict_media_cache(keep=path)
+    return media
+
+
+@app.route('/api/branch/<branch>/recordings/<sid>/media', methods=['GET'])
+@login_required
+def recording_media(branch, sid):
+    """Stream a recording's audio through the local cache (supports Range requests)"""
+    if branch not in BRANCHES:
+        return jsonify({'error': 'Invalid branch'}), 404
+
+    # Check permissions
+    if not session.get('is_admin'):
+        perms = get_user_permissions(session['user_id'])
+        if branch not in perms or not perms[branch]['can_view']:
+            return jsonify({'error': 'Permission denied'}), 403
+
+    row = get_db().execute('SELECT uri FROM recordings WHERE sid = ? AND branch = ?', (sid, branch)).fetchone()
+    if not row or not row[0]:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    _, settings = get_cached_branch_settings(branch)
     account_sid = settings.get('TWILIO_ACCOUNT_SID')
     auth_token = settings.get('TWILIO_AUTH_TOKEN')
-    
     if not account_sid or not auth_token:
         return jsonify({'error': 'Twilio credentials not configured for this branch'}), 400
-    
+
     try:
-        # Initialize Twilio client
-        client = Client(account_sid, auth_token)
-        
-        # Get query parameters for filtering
-        page_size = int(request.args.get('page_size', 20))
-        # Note: page parameter is kept for backward compatibility but not used in Twilio API
-        page = int(request.args.get('page', 0))
-        
-        # Fetch recordings
-        # Note: list() method doesn't support 'page' parameter, using limit for result control
-        recordings = client.recordings.list(
-            limit=page_size
-        )
-        
-        # Filter by branch phone numbers if available
-        branch_numbers = []
-        if settings.get('TWILIO_PHONE_NUMBER'):
-            branch_numbers.append(settings.get('TWILIO_PHONE_NUMBER'))
-        if settings.get('TWILIO_AUTOMATED_NUMBER'):
-            branch_numbers.append(settings.get('TWILIO_AUTOMATED_NUMBER'))
-        if settings.get('TWILIO_TRANSFER_NUMBER'):
-            branch_numbers.append(settings.get('TWILIO_TRANSFER_NUMBER'))
-        
-        # Format recordings for frontend
-        recordings_data = []
-        for recording in recordings:
-            # Fetch call details to get from/to numbers
-            try:
-                call = client.calls(recording.call_sid).fetch()
-                from_number = call.from_formatted
-                to_number = call.to_formatted
-                
-                # Filter by branch numbers if we have them
-                if branch_numbers:
-                    if not (from_number in branch_numbers or to_number in branch_numbers):
-                        continue
-                
-                recordings_data.append({
-                    'sid': recording.sid,
-                    'call_sid': recording.call_sid,
-                    'duration': recording.duration,
-                    'date_created': recording.date_created.isoformat() if recording.date_created else None,
-                    'from': from_number,
-                    'to': to_number,
-                    'status': recording.status,
-                    'uri': recording.uri,
-                    'media_url': f"https://api.twilio.com{recording.uri.replace('.json', '.mp3')}"
-                })
-            except Exception as e:
-                # If we can't fetch call details, include recording without filtering
-                print(f"Error fetching call details for recording {recording.sid}: {e}")
-                recordings_data.append({
-                    'sid': recording.sid,
-                    'call_sid': recording.call_sid,
-                    'duration': recording.duration,
-                    'date_created': recording.date_created.isoformat() if recording.date_created else None,
-                    'from': 'Unknown',
-                    'to': 'Unknown',
-                    'status': recording.status,
-                    'uri': recording.uri,
-                    'media_url': f"https://api.twilio.com{recording.uri.replace('.json', '.mp3')}"
-                })
-        
-        return jsonify({
-            'success': True,
-            'recordings': recordings_data,
-            'page': page,
-            'page_size': page_size,
-            'count': len(recordings_data)
-        })
-        
+        media = open_recording_media(sid, row[0], account_sid, auth_token)
+    except Exception as e:
+        print(f"Error downloading recording {sid} for {branch}: {e}")
+        return jsonify({'error': 'Failed to fetch recording from Twilio'}), 502
+
+    # The open handle is handed to the server's file wrapper (sendfile under
+    # gunicorn) instead of read into memory. send_file can't size a handle, so
+    # the length is set here before answering Range/If-None-Match.
+    stat = os.fstat(media.fileno())
+    response = send_file(media, mimetype='audio/mpeg',
+                         as_attachment=request.args.get('download') == '1',
+                         download_name=f'{sid}.mp3', max_age=86400,
+                         etag=f'{sid}-{stat.st_size}', last_modified=stat.st_mtime)
+    response.content_length = stat.st_size
+    try:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+    except RequestedRangeNotSatisfiable:
+        media.close()
+        raise
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+# --- Recording Archive Jobs ---
+# An archive job lists a branch's recordings from the Twilio REST API (page by
+# page, checkpointing the next page URI), then downloads them with a bounded
+# pool into a content-addressed store: <archive dir>/ab/cd/<sha256>.mp3.
+# Progress lives in SQLite, so a job interrupted by a restart resumes from
+# its last listed page and skips recordings already archived.
+ARCHIVE_JOB_LEASE = timedelta(minutes=2)
+# A running job renews its lease this often (seconds), even while every download
+# is still in flight, so a slow recording can't let another worker take it over
+ARCHIVE_HEARTBEAT_INTERVAL = 20
+
+
+def _archive_path(sha256):
+    return os.path.join(RECORDINGS_ARCHIVE_DIR, sha256[:2], sha256[2:4], f'{sha256}.mp3')
+
+
+def create_archive_job(branch, date_from, date_to, username):
+    """Queue an archive job for a branch (optionally limited to a date range) and start it"""
+    conn = get_db()
+    cur = conn.execute('''INSERT INTO archive_jobs (branch, date_from, date_to, status, created_by)
+                          VALUES (?, ?, ?, 'pending', ?)''', (branch, date_from, date_to, username))
+    conn.commit()
+    start_archive_job(cur.lastrowid)
+    return cur.lastrowid
+
+
+def get_archive_job(job_id):
+    """Archive job progress as a dict, or None"""
+    cur = get_db().execute('''SELECT id, branch, date_from, date_to, status, created_by, created_at,
+                                 started_at, finished_at, listed, total, downloaded, skipped,
+                                 failed, bytes, error
+                          FROM archive_jobs WHERE id = ?''', (job_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    job = dict(zip([d[0] for d in cur.description], row))
+    job['listed'] = bool(job['listed'])
+    job['remaining'] = max(job['total'] - job['downloaded'] - job['skipped'] - job['failed'], 0)
+    return job
+
+
+def _claim_archive_job(job_id):
+    """Mark a job running in this process unless another live worker owns it"""
+    conn = get_db()
+    now = datetime.utcnow()
+    claimed = conn.execute('''UPDATE archive_jobs
+                              SET status = 'running', heartbeat_at = ?, error = NULL,
+                                  started_at = COALESCE(started_at, CURRENT_TIMESTAMP)
+                              WHERE id = ? AND (status IN ('pending', 'interrupted', 'failed')
+                                                OR (status = 'running' AND heartbeat_at < ?))''',
+                           (now.isoformat(), job_id, (now - ARCHIVE_JOB_LEASE).isoformat())).rowcount
+    conn.commit()
+    return bool(claimed)
+
+
+def _archive_heartbeat(conn, job_id):
+    conn.execute('UPDATE archive_jobs SET heartbeat_at = ? WHERE id = ?', (datetime.utcnow().isoformat(), job_id))
+
+
+def _list_archive_items(conn, job, account_sid, auth_token):
+    """List the job's recordings into archive_items, resuming from the checkpointed page"""
+    next_uri = job['list_next_uri']
+    if not next_uri:
+        params = ['PageSize=1000']
+        if job['date_from']:
+            params.append(f"DateCreated%3E={job['date_from']}")
+        if job['date_to']:
+            # Twilio's bound is midnight at the start of the date; make date_to inclusive
+            # like the recordings API does
+            params.append(f"DateCreated%3C={_parse_date_bound(job['date_to'], end=True)}")
+        next_uri = f"/2010-04-01/Accounts/{account_sid}/Recordings.json?{'&'.join(params)}"
+    while next_uri:
+        response = requests.get(f'{TWILIO_API_BASE_URL}{next_uri}', auth=(account_sid, auth_token), timeout=30)
+        response.raise_for_status()
+        page = response.json()
+        for recording in page.get('recordings', []):
+            conn.execute('''INSERT OR IGNORE INTO archive_items (job_id, sid, call_sid, uri, date_created)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (job['id'], recording['sid'], recording.get('call_sid'),
+                          recording.get('uri'), recording.get('date_created')))
+        next_uri = page.get('next_page_uri')
+        # Checkpoint: items of this page and where to continue are committed together
+        conn.execute('''UPDATE archive_jobs SET list_next_uri = ?,
+                               total = (SELECT COUNT(*) FROM archive_items WHERE job_id = ?)
+                        WHERE id = ?''', (next_uri, job['id'], job['id']))
+        _archive_heartbeat(conn, job['id'])
+        conn.commit()
+    conn.execute('UPDATE archive_jobs SET listed = 1 WHERE id = ?', (job['id'],))
+    conn.commit()
+
+
+def _download_archive_item(sid, uri, account_sid, auth_token):
+    """Download one recording into the content-addressed store
+
+    Runs in a pool thread and touches no database state; returns (sha256, size).
+    """
+    tmp_path = os.path.join(RECORDINGS_ARCHIVE_DIR, f'.{sid}.{threading.get_ident()}.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with requests.get(_recording_media_url(uri), auth=(account_sid, auth_token),
+                          stream=True, timeout=60) as response:
+            response.raise_for_status()
+            expected = response.headers.get('Content-Length')
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        if size == 0:
+            raise ValueError('empty download')
+        if expected is not None and int(expected) != size:
+            raise ValueError(f'size mismatch: expected {expected} bytes, got {size}')
+        sha256 = digest.hexdigest()
+        path = _archive_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            os.remove(tmp_path)  # identical content already stored
+        else:
+            os.replace(tmp_path, path)
+        return sha256, size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _archive_job_counts(conn, job_id):
+    conn.execute('''UPDATE archive_jobs SET
+                        downloaded = (SELECT COUNT(*) FROM archive_items WHERE job_id = ? AND status = 'downloaded'),
+                        skipped = (SELECT COUNT(*) FROM archive_items WHERE job_id = ? AND status = 'skipped'),
+                        failed = (SELECT COUNT(*) FROM archive_items WHERE job_id = ? AND status = 'failed'),
+                        bytes = (SELECT COALESCE(SUM(size), 0) FROM archive_items WHERE job_id = ? AND status = 'downloaded')
+                    WHERE id = ?''', (job_id, job_id, job_id, job_id, job_id))
+
+
+def run_archive_job(job_id):
+    """Run (or resume) an archive job to completion"""
+    if not _claim_archive_job(job_id):
+        return
+    conn = get_db()
+    row = conn.execute('SELECT id, branch, date_from, date_to, listed, list_next_uri FROM archive_jobs WHERE id = ?',
+                       (job_id,)).fetchone()
+    job = dict(zip(('id', 'branch', 'date_from', 'date_to', 'listed', 'list_next_uri'), row))
+    try:
+        settings = get_branch_settings_with_defaults(job['branch'])
+        account_sid = settings.get('TWILIO_ACCOUNT_SID')
+        auth_token = settings.get('TWILIO_AUTH_TOKEN')
+        if not account_sid or not auth_token:
+            raise ValueError('Twilio credentials not configured for this branch')
+
+        if not job['listed']:
+            _list_archive_items(conn, job, account_sid, auth_token)
+
+        # Recordings already in the store (from this or an earlier job) are skipped;
+        # items that failed on an earlier attempt are retried
+        conn.execute('''UPDATE archive_items SET status = 'skipped', error = NULL
+                        WHERE job_id = ? AND status IN ('pending', 'failed')
+                          AND sid IN (SELECT sid FROM archived_recordings)''', (job_id,))
+        conn.execute("UPDATE archive_items SET status = 'pending', error = NULL WHERE job_id = ? AND status = 'failed'",
+                     (job_id,))
+        _archive_job_counts(conn, job_id)
+        conn.commit()
+
+        pending = conn.execute("SELECT sid, uri, call_sid, date_created FROM archive_items WHERE job_id = ? AND status = 'pending'",
+                               (job_id,)).fetchall()
+        with ThreadPoolExecutor(max_workers=RECORDINGS_ARCHIVE_WORKERS) as executor:
+            futures = {executor.submit(_download_archive_item, sid, uri, account_sid, auth_token): (sid, call_sid, date_created)
+                       for sid, uri, call_sid, date_created in pending}
+            # Results are recorded from this thread only; each batch is a checkpoint.
+            # The wait times out so the heartbeat is written during long downloads too.
+            remaining = set(futures)
+            while remaining:
+                done, remaining = wait(remaining, timeout=ARCHIVE_HEARTBEAT_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sid, call_sid, date_created = futures[future]
+                    try:
+                        sha256, size = future.result()
+                        conn.execute('''INSERT OR REPLACE INTO archived_recordings
+                                        (sid, branch, call_sid, date_created, sha256, size, archived_at)
+                                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''',
+                                     (sid, job['branch'], call_sid, date_created, sha256, size))
+                        conn.execute('''UPDATE archive_items SET status = 'downloaded', sha256 = ?, size = ?
+                                        WHERE job_id = ? AND sid = ?''', (sha256, size, job_id, sid))
+                    except Exception as e:
+                        conn.execute('''UPDATE archive_items SET status = 'failed', error = ?
+                                        WHERE job_id = ? AND sid = ?''', (str(e)[:500], job_id, sid))
+                if done:
+                    _archive_job_counts(conn, job_id)
+                _archive_heartbeat(conn, job_id)
+                conn.commit()
+
+        failed = conn.execute("SELECT COUNT(*) FROM archive_items WHERE job_id = ? AND status = 'failed'",
+                              (job_id,)).fetchone()[0]
+        conn.execute('''UPDATE archive_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP, error = ?
+                        WHERE id = ?''',
+                     ('failed' if failed else 'completed',
+                      f'{failed} recording(s) failed; resume the job to retry' if failed else None, job_id))
+        conn.commit()
     except Exception as e:
-        print(f"Error fetching recordings for {branch}: {e}")
-        return jsonify({'error': 'Failed to fetch recordings from Twilio'}), 500
+        conn.rollback()
+        print(f"Archive job {job_id} failed: {e}")
+        conn.execute("UPDATE archive_jobs SET status = 'failed', error = ? WHERE id = ?", (str(e)[:500], job_id))
+        conn.commit()
+
+
+def start_archive_job(job_id):
+    """Run an archive job in a background thread"""
+    threading.Thread(target=run_archive_job, args=(job_id,), name=f"archive-job-{job_id}", daemon=True).start()
+
+
+def resume_archive_jobs():
+    """Restart jobs left running or pending by a previous process"""
+    conn = get_db()
+    stale = (datetime.utcnow() - ARCHIVE_JOB_LEASE).isoformat()
+    rows = conn.execute('''SELECT id FROM archive_jobs
+                           WHERE status = 'pending' OR (status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?))''',
+                        (stale,)).fetchall()
+    for (job_id,) in rows:
+        conn.execute("UPDATE archive_jobs SET status = 'interrupted' WHERE id = ? AND status = 'running'", (job_id,))
+        conn.commit()
+        start_archive_job(job_id)
+
+
+@app.route('/api/branch/<branch>/recordings/archive', methods=['GET', 'POST'])
+@login_required
+def branch_recordings_archive(branch):
+    """Start an archive job (POST) or list a branch's archive jobs (GET); admin only"""
+    if branch not in BRANCHES:
+        return jsonify({'error': 'Invalid branch'}), 404
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    if request.method == 'GET':
+        rows = get_db().execute('SELECT id FROM archive_jobs WHERE branch = ? ORDER BY id DESC LIMIT 50',
+                                (branch,)).fetchall()
+        return jsonify({'success': True, 'jobs': [get_archive_job(row[0]) for row in rows]})
+
+    data = request.get_json(silent=True) or {}
+    date_from = data.get('date_from') or None
+    date_to = data.get('date_to') or None
+    try:
+        for value in (date_from, date_to):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'date_from and date_to must be YYYY-MM-DD'}), 400
+
+    job_id = create_archive_job(branch, date_from, date_to, session['username'])
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('archive_job_status', job_id=job_id)
+    }), 202
+
+
+@app.route('/api/archive/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def archive_job_status(job_id):
+    """Progress of an archive job; admin only"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+    job = get_archive_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/api/archive/jobs/<int:job_id>/resume', methods=['POST'])
+@login_required
+def resume_archive_job(job_id):
+    """Resume a failed or interrupted archive job (retries failed recordings); admin only"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+    job = get_archive_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] == 'completed':
+        return jsonify({'error': 'Job already completed'}), 409
+    start_archive_job(job_id)
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('archive_job_status', job_id=job_id)}), 202
 
 
 # Initialize database on module load (runs with both gunicorn and direct execution)
 # Ensure data directory exists
 os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+os.makedirs(RECORDINGS_CACHE_DIR, exist_ok=True)
+os.makedirs(RECORDINGS_ARCHIVE_DIR, exist_ok=True)
 
 # Initialize database
 init_db()
+refresh_branches()
+
+# Start polling branch health in the background
+start_status_poller()
+
+# Keep the local call recordings index in sync with Twilio
+start_recordings_sync()
+
+# Send queued admin SMS notifications in the background
+start_notification_sender()
+
+# Forward and track dashboard emergency triggers
+start_trigger_tracker()
+resume_trigger_jobs()
+
+# Queue branch restarts accepted before the last shutdown
+resume_restart_jobs()
+
+# Pick up archive jobs interrupted by a restart
+resume_archive_jobs()
+
+# Build every branch's merged settings up front
+precompute_branch_settings()
 
 
 if __name__ == '__main__':
@@ -76,7 +76,7 @@ function enableBranch(branchKey, branchName) {
 }
 
 function restartBranch(branchKey, branchName) {
-    if (!confirm(`⚠️ RESTART CONTAINER: Are you sure you want to RESTART the ${branchName} branch container?\n\nThis will temporarily interrupt service for approximately 10-30 seconds while the container restarts.\n\nAny active emergency calls may be affected.\n\nAn SMS notification will be sent to the administrator.`)) {
+    if (!confirm(`⚠️ RESTART CONTAINER: Are you sure you want to RESTART the ${branchName} branch container?\n\nThe restart waits until the branch has no active or queued emergency, then interrupts service for approximately 10-30 seconds.\n\nAn SMS notification will be sent to the administrator.`)) {
         return;
     }
     
@@ -85,33 +85,99 @@ function restartBranch(branchKey, branchName) {
         return;
     }
     
-    // Show processing message
-    alert('Restarting container... Please wait. This may take 10-30 seconds.');
+    startRestart(`/api/branch/${branchKey}/restart`, { confirm: true });
+}
+
+function rollingRestart() {
+    if (!confirm(`⚠️ ROLLING RESTART: Restart EVERY branch container, one after another?\n\nEach branch waits until it has no active emergency, restarts, and must report healthy before the next one starts. The rollout stops if a branch does not come back.`)) {
+        return;
+    }
     
-    fetch(`/api/branch/${branchKey}/restart`, {
+    startRestart('/api/restarts', { confirm: true });
+}
+
+function startRestart(url, payload) {
+    fetch(url, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ confirm: true })
+        body: JSON.stringify(payload)
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            alert(`✓ ${data.message}\n\nThe container has been restarted successfully.\n\nAn SMS notification has been sent.`);
-            // Wait a moment before reloading to give container time to start
-            setTimeout(() => {
-                window.location.reload();
-            }, 3000);
-        } else {
+        if (!data.success) {
             alert(`Error: ${data.error || data.message}`);
+            return;
         }
+        renderRestartProgress(data.message, []);
+        followRestartBatch(data.stream_url, data.status_url, jobs => renderRestartProgress(data.message, jobs))
+            .then(jobs => {
+                const failed = jobs.filter(job => job.status !== 'completed');
+                if (failed.length) {
+                    alert(`✗ Restart finished with problems:\n\n${failed.map(job => `${job.message}${job.error ? ` (${job.error})` : ''}`).join('\n')}`);
+                } else {
+                    alert(`✓ ${jobs.length === 1 ? jobs[0].message : `${jobs.length} branches restarted and healthy`}\n\nAn SMS notification has been sent.`);
+                }
+                window.location.reload();
+            });
     })
     .catch(error => {
         alert(`Error: ${error}`);
     });
 }
 
+// Follow a restart batch over SSE (or by polling without EventSource); resolves with the final jobs
+function followRestartBatch(streamUrl, statusUrl, onProgress) {
+    return new Promise(resolve => {
+        if (!window.EventSource) {
+            const poll = () => {
+                fetch(statusUrl)
+                    .then(response => response.json())
+                    .then(batch => {
+                        onProgress(batch.jobs);
+                        if (batch.final) {
+                            resolve(batch.jobs);
+                        } else {
+                            setTimeout(poll, 2000);
+                        }
+                    })
+                    .catch(() => setTimeout(poll, 3000));
+            };
+            poll();
+            return;
+        }
+        const source = new EventSource(streamUrl);
+        source.addEventListener('progress', event => onProgress(JSON.parse(event.data).jobs));
+        source.addEventListener('done', event => {
+            source.close();
+            resolve(JSON.parse(event.data).jobs);
+        });
+    });
+}
+
+// Floating panel listing each branch in a restart batch and its current step
+function renderRestartProgress(title, jobs) {
+    let panel = document.getElementById('restartProgress');
+    if (!panel) {
+        panel = document.createElement('div');
+        panel.id = 'restartProgress';
+        panel.style.cssText = 'position: fixed; bottom: 20px; right: 20px; width: 340px; max-height: 50vh; overflow-y: auto; background: white; border-radius: 8px; box-shadow: 0 4px 16px rgba(0,0,0,0.2); padding: 15px; z-index: 1000;';
+        document.body.appendChild(panel);
+    }
+    const icons = { pending: '⏸', draining: '⏳', restarting: '🔄', verifying: '🩺', completed: '✓', failed: '✗', cancelled: '—' };
+    panel.innerHTML = '';
+    const heading = document.createElement('strong');
+    heading.textContent = title;
+    panel.appendChild(heading);
+    jobs.forEach(job => {
+        const line = document.createElement('div');
+        line.style.cssText = 'margin-top: 6px; font-size: 0.9em;';
+        line.textContent = `${icons[job.status] || ''} ${job.branch}: ${job.message || job.status}`;
+        panel.appendChild(line);
+    });
+}
+
 function triggerEmergency(event, branchKey, branchName) {
     event.preventDefault();
     
@@ -162,18 +228,26 @@ function triggerEmergency(event, branchKey, branchName) {
     })
     .then(response => response.json())
     .then(data => {
-        submitButton.disabled = false;
-        submitButton.textContent = originalText;
-        
         if (data.success) {
-            alert(`✓ ${data.message}\n\nThe emergency has been triggered successfully.\n\nAn SMS notification has been sent to the administrator.`);
-            // Clear the form
+            // Accepted for forwarding: follow the job until the branch finishes dispatch
             document.getElementById('emergencyForm').reset();
-            // Reload the page to show updated status
-            setTimeout(() => {
-                window.location.reload();
-            }, 1000);
+            submitButton.textContent = '⏳ Sending to branch...';
+            followTriggerJob(data.status_url, job => {
+                submitButton.textContent = `⏳ ${job.message || job.status}`;
+            }).then(job => {
+                submitButton.disabled = false;
+                submitButton.textContent = originalText;
+                if (job.status === 'completed') {
+                    alert(`✓ ${job.message}\n\nAn SMS notification has been sent to the administrator.`);
+                } else if (job.status === 'queued') {
+                    alert(`ℹ️ ${job.message}`);
+                } else {
+                    alert(`✗ ${job.message || 'Failed to trigger emergency'}${job.error ? `:\n${job.error}` : ''}`);
+                }
+            });
         } else {
+            submitButton.disabled = false;
+            submitButton.textContent = originalText;
             alert(`✗ Failed to trigger emergency:\n${data.error}`);
         }
     })
@@ -184,48 +258,98 @@ function triggerEmergency(event, branchKey, branchName) {
     });
 }
 
-// Auto-refresh status every 30 seconds
+// Poll a trigger job until it reaches a final state; resolves with the job
+function followTriggerJob(statusUrl, onProgress) {
+    return new Promise(resolve => {
+        const poll = () => {
+            fetch(statusUrl)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.final) {
+                        resolve(job);
+                        return;
+                    }
+                    // Queued emergencies may wait a long time; report progress and stop there
+                    if (job.status === 'queued') {
+                        resolve(job);
+                        return;
+                    }
+                    onProgress(job);
+                    setTimeout(poll, 1500);
+                })
+                .catch(() => setTimeout(poll, 3000));
+        };
+        poll();
+    });
+}
+
+// Live branch status: one SSE stream per tab, falling back to a single
+// batched poll every 30 seconds if the stream is unavailable
 let autoRefreshInterval;
+let statusEventSource;
 
 function startAutoRefresh() {
-    autoRefreshInterval = setInterval(() => {
-        updateBranchStatuses();
-    }, 30000); // 30 seconds
+    if (window.EventSource) {
+        statusEventSource = new EventSource('/api/branches/status/stream');
+        statusEventSource.addEventListener('status', event => {
+            applyBranchStatuses(JSON.parse(event.data));
+        });
+        statusEventSource.onerror = () => {
+            // EventSource reconnects by itself; poll meanwhile so cards stay fresh
+            if (!autoRefreshInterval) {
+                autoRefreshInterval = setInterval(updateBranchStatuses, 30000);
+            }
+        };
+        statusEventSource.onopen = () => {
+            if (autoRefreshInterval) {
+                clearInterval(autoRefreshInterval);
+                autoRefreshInterval = null;
+            }
+        };
+    } else {
+        autoRefreshInterval = setInterval(updateBranchStatuses, 30000); // 30 seconds
+    }
 }
 
 function updateBranchStatuses() {
-    const branchCards = document.querySelectorAll('.branch-card');
-    
-    branchCards.forEach(card => {
-        const branchKey = card.dataset.branch;
-        if (!branchKey) return;
+    fetch('/api/branches/status')
+        .then(response => response.json())
+        .then(data => applyBranchStatuses(data.branches || {}))
+        .catch(error => {
+            console.error('Error updating branch statuses:', error);
+        });
+}
+
+function applyBranchStatuses(statuses) {
+    Object.entries(statuses).forEach(([branchKey, data]) => {
+        const card = document.querySelector(`.branch-card[data-branch="${branchKey}"]`);
+        if (!card) return;
         
-        fetch(`/api/branch/${branchKey}/status`)
-            .then(response => response.json())
-            .then(data => {
-                // Update status badge
-                const statusBadge = card.querySelector('.status-badge');
-                if (statusBadge) {
-                    statusBadge.className = 'status-badge status-' + (data.online ? 'online' : 'offline');
-                    statusBadge.textContent = data.status;
-                }
-                
-                // Update message
-                const message = card.querySelector('.branch-message');
-                if (message) {
-                    message.textContent = data.message;
-                }
-                
-                // Update disabled state
-                if (!data.enabled) {
-                    card.classList.add('disabled');
-                } else {
-                    card.classList.remove('disabled');
-                }
-            })
-            .catch(error => {
-                console.error(`Error updating ${branchKey}:`, error);
-            });
+        // Update status badge
+        const statusBadge = card.querySelector('.status-badge');
+        if (statusBadge) {
+            statusBadge.className = 'status-badge status-' + (data.online ? 'online' : 'offline');
+            statusBadge.textContent = data.status;
+        }
+        
+        // Update message
+        const message = card.querySelector('.branch-message');
+        if (message) {
+            message.textContent = data.message;
+        }
+        
+        // Update freshness timestamp
+        const checkedAt = card.querySelector('.branch-checked-at');
+        if (checkedAt && data.checked_at) {
+            checkedAt.textContent = new Date(data.checked_at).toLocaleString() + (data.stale ? ' (stale)' : '');
+        }
+        
+        // Update disabled state
+        if (!data.enabled) {
+            card.classList.add('disabled');
+        } else {
+            card.classList.remove('disabled');
+        }
     });
     
     // Update timestamp
@@ -237,7 +361,7 @@ function updateBranchStatuses() {
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
-    // Start auto-refresh if on dashboard
+    // Start live status updates if on dashboard
     if (document.querySelector('.branches-grid')) {
         startAutoRefresh();
     }
@@ -248,12 +372,33 @@ window.addEventListener('beforeunload', () => {
     if (autoRefreshInterval) {
         clearInterval(autoRefreshInterval);
     }
+    if (statusEventSource) {
+        statusEventSource.close();
+    }
 });
 
 // Call Recordings Functions
+// Pages are fetched by cursor; recordingsCursors[i] is the cursor that loaded page i
+let recordingsCursors = [null];
 let currentRecordingsPage = 0;
 let isLoadingRecordings = false;
 
+function getRecordingsFilters() {
+    const filters = {};
+    const dateFrom = document.getElementById('recordings-date-from');
+    const dateTo = document.getElementById('recordings-date-to');
+    const number = document.getElementById('recordings-number');
+    if (dateFrom && dateFrom.value) filters.date_from = dateFrom.value;
+    if (dateTo && dateTo.value) filters.date_to = dateTo.value;
+    if (number && number.value.trim()) filters.number = number.value.trim();
+    return filters;
+}
+
+function applyRecordingsFilters(branchKey) {
+    recordingsCursors = [null];
+    loadCallRecordings(branchKey, 0);
+}
+
 function loadCallRecordings(branchKey, page = 0) {
     if (isLoadingRecordings) return;
     isLoadingRecordings = true;
@@ -267,16 +412,29 @@ function loadCallRecordings(branchKey, page = 0) {
     if (loadingIndicator) loadingIndicator.style.display = 'block';
     if (errorMessage) errorMessage.style.display = 'none';
     
-    fetch(`/api/branch/${branchKey}/recordings?page=${page}&page_size=20`)
+    const params = new URLSearchParams({ page_size: 20, ...getRecordingsFilters() });
+    if (recordingsCursors[page]) params.set('cursor', recordingsCursors[page]);
+    
+    fetch(`/api/branch/${branchKey}/recordings?${params.toString()}`)
         .then(response => response.json())
         .then(data => {
             isLoadingRecordings = false;
             if (loadingIndicator) loadingIndicator.style.display = 'none';
             
             if (data.success && data.recordings) {
+                if (data.sync && !data.sync.synced) {
+                    // First sync from Twilio is still running; check again shortly
+                    if (recordingsContainer) {
+                        recordingsContainer.innerHTML = '<p style="text-align: center; color: #666; padding: 20px;">Indexing call recordings from Twilio... this page will update automatically.</p>';
+                    }
+                    setTimeout(() => loadCallRecordings(branchKey, page), 5000);
+                    return;
+                }
                 currentRecordingsPage = page;
+                recordingsCursors = recordingsCursors.slice(0, page + 1);
+                if (data.next_cursor) recordingsCursors.push(data.next_cursor);
                 displayRecordings(data.recordings, recordingsContainer);
-                updatePaginationControls(branchKey, page, data.count, paginationControls);
+                updatePaginationControls(branchKey, page, data.has_more, paginationControls);
             } else {
                 if (errorMessage) {
                     errorMessage.textContent = data.error || 'Failed to load recordings';
@@ -325,12 +483,12 @@ function displayRecordings(recordings, container) {
                     </div>
                 </div>
                 <div style="margin-top: 10px;">
-                    <audio controls style="width: 100%; max-width: 400px;">
+                    <audio controls preload="none" style="width: 100%; max-width: 400px;">
                         <source src="${recording.media_url}" type="audio/mpeg">
                         Your browser does not support the audio element.
                     </audio>
                     <div style="margin-top: 8px;">
-                        <a href="${recording.media_url}" download class="btn btn-secondary" style="font-size: 0.85em; padding: 5px 12px; display: inline-block;">
+                        <a href="${recording.media_url}?download=1" download class="btn btn-secondary" style="font-size: 0.85em; padding: 5px 12px; display: inline-block;">
                             ⬇️ Download
                         </a>
                         <span style="margin-left: 10px; color: #999; font-size: 0.85em;">SID: ${recording.sid}</span>
@@ -344,7 +502,7 @@ function displayRecordings(recordings, container) {
     container.innerHTML = html;
 }
 
-function updatePaginationControls(branchKey, currentPage, count, container) {
+function updatePaginationControls(branchKey, currentPage, hasMore, container) {
     if (!container) return;
     
     let html = '<div style="display: flex; gap: 10px; justify-content: center; margin-top: 15px;">';
@@ -355,7 +513,7 @@ function updatePaginationControls(branchKey, currentPage, count, container) {
     
     html += `<span style="padding: 8px 15px; background: #f8f9fa; border-radius: 4px;">Page ${currentPage + 1}</span>`;
     
-    if (count >= 20) {
+    if (hasMore) {
         html += `<button onclick="loadCallRecordings('${branchKey}', ${currentPage + 1})" class="btn btn-secondary">Next →</button>`;
     }
     
@@ -0,0 +1,101 @@
+"""Local stand-in for a branch instance and its container runtime
+
+FakeBranch answers the endpoints the dashboard's restart jobs call:
+/api/queue (whether an emergency is active or queued) and /api/status. POST
+/restart makes it count a restart and then report unhealthy for
+`down_seconds`, like a container coming back up. POST /webhook answers with
+the queued `webhook_replies`, for trigger jobs.
+
+restart_command() is a CONTAINER_RESTART_COMMAND that "restarts" a branch by
+posting to its FakeBranch instead of running docker.
+"""
+import json
+import sys
+import time
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler
+
+from helpers import serve
+
+
+class FakeBranch:
+    """Fake branch whose busy/reachable/healthy state a test controls"""
+
+    def __init__(self, name, down_seconds=0.2):
+        self.name = name
+        self.busy = False
+        self.reachable = True  # False: /api/queue answers 500
+        self.comes_back = True  # False: stays unhealthy after a restart
+        self.down_seconds = down_seconds
+        self.restarts = []  # time of each restart
+        self.webhook_replies = []  # (status, body) for each POST /webhook, then 202
+        self.webhook_keys = []  # Idempotency-Key of each POST /webhook
+        self.down_until = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = fake.handle_get(self.path)
+                self.reply(status, body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path == '/webhook':
+                    with fake.lock:
+                        fake.webhook_keys.append(self.headers.get('Idempotency-Key'))
+                        reply = fake.webhook_replies.pop(0) if fake.webhook_replies else (
+                            202, {'status': 'accepted', 'emergency_id': 'e1'})
+                    return self.reply(*reply)
+                if self.path != '/restart':
+                    return self.reply(404, {})
+                with fake.lock:
+                    fake.restarts.append(time.monotonic())
+                    fake.down_until = time.monotonic() + fake.down_seconds if fake.comes_back else float('inf')
+                self.reply(200, {'restarted': fake.name})
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = serve(Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def handle_get(self, path):
+        with self.lock:
+            down = time.monotonic() < self.down_until
+        if down:
+            return 503, {'error': 'starting'}
+        if path.startswith('/api/queue'):
+            if not self.reachable:
+                return 500, {'error': 'unavailable'}
+            return 200, {'active': {'id': 'e1'} if self.busy else None, 'depth': 0}
+        if path.startswith('/api/status'):
+            return 200, {'status': 'Ready'}
+        return 404, {}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def restart_command(branches):
+    """CONTAINER_RESTART_COMMAND that restarts FakeBranches by key ({branch: FakeBranch})"""
+    urls = ' '.join(f'{key}={fake.url}' for key, fake in branches.items())
+    return f"{sys.executable} {__file__} {{branch}} {urls}"
+
+
+if __name__ == '__main__':
+    # Invoked as the restart command: fake_branch.py <branch> <key>=<url> ...
+    urls = dict(arg.split('=', 1) for arg in sys.argv[2:])
+    if sys.argv[1] not in urls:
+        sys.exit(f'No such container: {sys.argv[1]}')
+    urllib.request.urlopen(urllib.request.Request(f'{urls[sys.argv[1]]}/restart', method='POST'), timeout=5)
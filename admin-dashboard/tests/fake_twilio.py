@@ -0,0 +1,98 @@
+"""Local stand-in for the parts of the Twilio REST API the dashboard calls
+
+Serves paged Recordings.json listings and each recording's .mp3 media. The
+DateCreated< and DateCreated> filters behave like Twilio's: the bound is
+midnight UTC at the start of the given date, so DateCreated<=2024-01-31
+excludes recordings made on Jan 31.
+
+Point TWILIO_API_BASE_URL at FakeTwilio.url to use it.
+"""
+import json
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from helpers import serve
+
+
+class FakeTwilio:
+    """Fake Twilio API holding recordings as {sid: (date_created, audio bytes)}"""
+
+    def __init__(self, account_sid='ACtest', page_size=2):
+        self.account_sid = account_sid
+        self.page_size = page_size
+        self.recordings = {}
+        self.requests = []
+        self.media_delay = 0  # seconds each .mp3 takes to start, for slow downloads
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests.append(self.path)
+                status, body, content_type = fake.handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = serve(Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def add_recording(self, sid, date_created, audio=None):
+        self.recordings[sid] = (date_created.replace(tzinfo=timezone.utc), audio or f'audio-{sid}'.encode())
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, path):
+        parsed = urlparse(path)
+        media = re.search(r'/Recordings/(RE\w+)\.mp3$', parsed.path)
+        if media:
+            recording = self.recordings.get(media.group(1))
+            if not recording:
+                return 404, b'', 'text/plain'
+            time.sleep(self.media_delay)
+            return 200, recording[1], 'audio/mpeg'
+        if parsed.path == f'/2010-04-01/Accounts/{self.account_sid}/Recordings.json':
+            return 200, json.dumps(self.list_page(parse_qs(parsed.query))).encode(), 'application/json'
+        return 404, b'', 'text/plain'
+
+    def list_page(self, query):
+        before = query.get('DateCreated<', [None])[0]
+        after = query.get('DateCreated>', [None])[0]
+        page = int(query.get('Page', ['0'])[0])
+        size = int(query.get('PageSize', [self.page_size])[0])
+        size = min(size, self.page_size)
+        matches = []
+        for sid, (created, _) in sorted(self.recordings.items(), key=lambda item: item[1][0]):
+            if before and created >= _midnight(before):
+                continue
+            if after and created < _midnight(after):
+                continue
+            matches.append({
+                'sid': sid,
+                'call_sid': f'CA{sid[2:]}',
+                'date_created': format_datetime(created),
+                'uri': f'/2010-04-01/Accounts/{self.account_sid}/Recordings/{sid}.json'
+            })
+        next_page = None
+        if (page + 1) * size < len(matches):
+            params = [f'PageSize={size}', f'Page={page + 1}']
+            if before:
+                params.append(f'DateCreated%3C={before}')
+            if after:
+                params.append(f'DateCreated%3E={after}')
+            next_page = f"/2010-04-01/Accounts/{self.account_sid}/Recordings.json?{'&'.join(params)}"
+        return {'recordings': matches[page * size:(page + 1) * size], 'next_page_uri': next_page}
+
+
+def _midnight(value):
+    return datetime.strptime(value[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
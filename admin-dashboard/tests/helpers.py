@@ -0,0 +1,49 @@
+"""Shared setup for the admin dashboard tests
+
+The dashboard reads its configuration at import time, so it is imported once
+per test run against a throwaway database with every default branch pointed at
+a closed local port.
+"""
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+
+def load_dashboard():
+    """Import the dashboard app configured for tests"""
+    if 'app' in sys.modules:
+        return sys.modules['app']
+    data_dir = tempfile.mkdtemp(prefix='admin-dashboard-test-')
+    atexit.register(shutil.rmtree, data_dir, True)
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(data_dir, 'admin.db'),
+        'TUC_URL': 'http://127.0.0.1:9',
+        'POC_URL': 'http://127.0.0.1:9',
+        'REX_URL': 'http://127.0.0.1:9',
+        'STATUS_POLL_INTERVAL': '3600',
+        'RECORDINGS_SYNC_INTERVAL': '3600',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+    return app
+
+
+def admin_client(dashboard):
+    """Test client logged in as the default admin"""
+    client = dashboard.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['username'] = dashboard.ADMIN_USERNAME
+        session['is_admin'] = True
+    return client
+
+
+def serve(handler_class):
+    """Run an HTTP handler on a free local port; returns the server"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,90 @@
+"""Recording archive jobs against the local fake Twilio API"""
+import time
+import unittest
+from datetime import datetime
+
+from helpers import load_dashboard, admin_client
+from fake_twilio import FakeTwilio
+
+dashboard = load_dashboard()
+
+
+class RecordingArchiveTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.twilio = FakeTwilio()
+        dashboard.TWILIO_API_BASE_URL = cls.twilio.url
+        dashboard.update_branch_settings('poc', {
+            'TWILIO_ACCOUNT_SID': cls.twilio.account_sid,
+            'TWILIO_AUTH_TOKEN': 'token'
+        }, 'test')
+        cls.twilio.add_recording('RE0101', datetime(2024, 1, 1, 9, 0))
+        cls.twilio.add_recording('RE0115', datetime(2024, 1, 15, 12, 0))
+        cls.twilio.add_recording('RE0131', datetime(2024, 1, 31, 23, 30))
+        cls.twilio.add_recording('RE0201', datetime(2024, 2, 1, 0, 30))
+        cls.client = admin_client(dashboard)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.twilio.stop()
+
+    def start_archive(self, body):
+        response = self.client.post('/api/branch/poc/recordings/archive', json=body)
+        self.assertEqual(response.status_code, 202)
+        return response.get_json()
+
+    def run_archive(self, body):
+        return self.wait_for_job(self.start_archive(body)['status_url'])
+
+    def wait_for_job(self, status_url):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            job = self.client.get(status_url).get_json()['job']
+            if job['status'] not in ('pending', 'running'):
+                return job
+            time.sleep(0.05)
+        self.fail('archive job did not finish')
+
+    def archived_sids(self, job_id):
+        rows = dashboard.get_db().execute(
+            "SELECT sid FROM archive_items WHERE job_id = ? ORDER BY sid", (job_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def test_date_range_is_inclusive_and_repeat_is_skipped(self):
+        job = self.run_archive({'date_from': '2024-01-01', 'date_to': '2024-01-31'})
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(self.archived_sids(job['id']), ['RE0101', 'RE0115', 'RE0131'])
+        self.assertEqual(job['downloaded'], 3)
+
+        again = self.run_archive({'date_from': '2024-01-31', 'date_to': '2024-02-01'})
+        self.assertEqual(self.archived_sids(again['id']), ['RE0131', 'RE0201'])
+        self.assertEqual((again['downloaded'], again['skipped']), (1, 1))
+
+    def test_lease_is_renewed_while_a_download_is_slow(self):
+        dashboard.ARCHIVE_HEARTBEAT_INTERVAL = 0.1
+        self.twilio.add_recording('RE0301', datetime(2024, 3, 1, 9, 0))
+        self.twilio.media_delay = 1
+        try:
+            started = self.start_archive({'date_from': '2024-03-01', 'date_to': '2024-03-01'})
+            job_id = started['job_id']
+            heartbeats = set()
+            deadline = time.monotonic() + 0.8
+            while time.monotonic() < deadline:
+                heartbeats.add(dashboard.get_db().execute(
+                    'SELECT heartbeat_at FROM archive_jobs WHERE id = ?', (job_id,)).fetchone()[0])
+                time.sleep(0.05)
+            self.assertEqual(dashboard.get_archive_job(job_id)['downloaded'], 0)
+            self.assertGreater(len(heartbeats - {None}), 2)
+        finally:
+            self.twilio.media_delay = 0
+            dashboard.ARCHIVE_HEARTBEAT_INTERVAL = 20
+        self.assertEqual(self.wait_for_job(started['status_url'])['status'], 'completed')
+
+    def test_invalid_dates_are_rejected(self):
+        response = self.client.post('/api/branch/poc/recordings/archive', json={'date_to': '31/01/2024'})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Recording playback through the local media cache, against the fake Twilio API"""
+import os
+import shutil
+import unittest
+from datetime import datetime
+
+from helpers import load_dashboard, admin_client
+from fake_twilio import FakeTwilio
+
+dashboard = load_dashboard()
+
+
+class RecordingMediaTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.twilio = FakeTwilio(account_sid='ACmedia')
+        cls.saved = dashboard.TWILIO_API_BASE_URL
+        dashboard.TWILIO_API_BASE_URL = cls.twilio.url
+        dashboard.update_branch_settings('tuc', {
+            'TWILIO_ACCOUNT_SID': cls.twilio.account_sid,
+            'TWILIO_AUTH_TOKEN': 'token'
+        }, 'test')
+        cls.twilio.add_recording('REmedia', datetime(2024, 3, 1, 12, 0), audio=b'0123456789' * 100)
+        db = dashboard.get_db()
+        db.execute('''INSERT OR REPLACE INTO recordings (sid, branch, call_sid, date_created, uri)
+                      VALUES ('REmedia', 'tuc', 'CAmedia', '2024-03-01T12:00:00+00:00', ?)''',
+                   (f'/2010-04-01/Accounts/{cls.twilio.account_sid}/Recordings/REmedia.json',))
+        db.commit()
+        cls.client = admin_client(dashboard)
+
+    @classmethod
+    def tearDownClass(cls):
+        dashboard.TWILIO_API_BASE_URL = cls.saved
+        cls.twilio.stop()
+
+    def setUp(self):
+        shutil.rmtree(dashboard.RECORDINGS_CACHE_DIR, ignore_errors=True)
+        os.makedirs(dashboard.RECORDINGS_CACHE_DIR)
+
+    def get_media(self, **kwargs):
+        return self.client.get('/api/branch/tuc/recordings/REmedia/media', **kwargs)
+
+    def test_played_recordings_leave_no_download_locks(self):
+        for _ in range(2):  # a download, then a cache hit
+            response = self.get_media()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(), b'0123456789' * 100)
+            response.close()
+        self.assertEqual(dashboard._media_download_locks, {})
+
+    def test_range_request(self):
+        response = self.get_media(headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get_data(), b'0123456789')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 10-19/1000')
+        response.close()
+
+    def test_eviction_during_a_response_does_not_break_it(self):
+        self.get_media().close()
+        open_media = dashboard.open_recording_media
+
+        def open_then_evict(*args):
+            # Another request's download evicts this recording before it is sent
+            media = open_media(*args)
+            saved_limit = dashboard.RECORDINGS_CACHE_MAX_BYTES
+            dashboard.RECORDINGS_CACHE_MAX_BYTES = 0
+            try:
+                dashboard._evict_media_cache()
+            finally:
+                dashboard.RECORDINGS_CACHE_MAX_BYTES = saved_limit
+            return media
+
+        dashboard.open_recording_media = open_then_evict
+        try:
+            response = self.get_media()
+        finally:
+            dashboard.open_recording_media = open_media
+        self.assertFalse(os.path.exists(dashboard._media_cache_path('REmedia')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), b'0123456789' * 100)
+        response.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
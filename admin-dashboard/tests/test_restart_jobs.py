@@ -0,0 +1,89 @@
+"""Branch restart jobs against stand-in branches and a stand-in container runtime"""
+import time
+import threading
+import unittest
+
+from helpers import load_dashboard, admin_client
+from fake_branch import FakeBranch, restart_command
+
+dashboard = load_dashboard()
+
+
+class RestartJobsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = admin_client(dashboard)
+        cls.branches = {key: FakeBranch(key) for key in ('rolla', 'rollb', 'rollc')}
+        for key, fake in cls.branches.items():
+            response = cls.client.post('/api/branches', json={'key': key, 'name': key.title(), 'url': fake.url})
+            assert response.status_code in (200, 201), response.get_json()
+        cls.saved = {name: getattr(dashboard, name) for name in (
+            'CONTAINER_RESTART_COMMAND', 'RESTART_POLL_INTERVAL', 'RESTART_DRAIN_TIMEOUT',
+            'RESTART_HEALTH_TIMEOUT', 'PEER_CIRCUIT_RESET')}
+        dashboard.CONTAINER_RESTART_COMMAND = restart_command(cls.branches)
+        dashboard.RESTART_POLL_INTERVAL = 0.05
+        dashboard.RESTART_DRAIN_TIMEOUT = 1
+        dashboard.RESTART_HEALTH_TIMEOUT = 3
+        dashboard.PEER_CIRCUIT_RESET = 0.2
+
+    @classmethod
+    def tearDownClass(cls):
+        for name, value in cls.saved.items():
+            setattr(dashboard, name, value)
+        for fake in cls.branches.values():
+            fake.stop()
+
+    def setUp(self):
+        for fake in self.branches.values():
+            fake.busy, fake.reachable, fake.comes_back = False, True, True
+            fake.restarts.clear()
+            fake.down_until = 0
+
+    def restart(self, branches):
+        response = self.client.post('/api/restarts', json={'confirm': True, 'branches': branches})
+        self.assertEqual(response.status_code, 202, response.get_json())
+        batch_id = response.get_json()['batch_id']
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            batch = self.client.get(f'/api/restarts/{batch_id}').get_json()
+            if batch['final']:
+                return {job['branch']: job for job in batch['jobs']}
+            time.sleep(0.05)
+        self.fail('restart batch did not finish')
+
+    def test_rolling_restart_waits_for_emergencies_and_goes_in_order(self):
+        a, b = self.branches['rolla'], self.branches['rollb']
+        a.busy = True
+
+        def finish_emergency():
+            time.sleep(0.3)
+            a.busy = False
+        threading.Thread(target=finish_emergency).start()
+
+        jobs = self.restart(['rolla', 'rollb'])
+        self.assertEqual([jobs[k]['status'] for k in ('rolla', 'rollb')], ['completed', 'completed'])
+        self.assertEqual((len(a.restarts), len(b.restarts)), (1, 1))
+        self.assertLess(a.restarts[0], b.restarts[0])
+
+    def test_unreachable_branch_is_not_restarted(self):
+        self.branches['rolla'].reachable = False
+        jobs = self.restart(['rolla'])
+        self.assertEqual(jobs['rolla']['status'], 'failed')
+        self.assertIn('Could not confirm', jobs['rolla']['error'])
+        self.assertEqual(self.branches['rolla'].restarts, [])
+
+    def test_branch_that_does_not_come_back_cancels_the_rest(self):
+        self.branches['rolla'].comes_back = False
+        dashboard.RESTART_HEALTH_TIMEOUT = 1
+        try:
+            jobs = self.restart(['rolla', 'rollb', 'rollc'])
+        finally:
+            dashboard.RESTART_HEALTH_TIMEOUT = 3
+        self.assertEqual([jobs[k]['status'] for k in ('rolla', 'rollb', 'rollc')],
+                         ['failed', 'cancelled', 'cancelled'])
+        self.assertEqual(self.branches['rollb'].restarts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Forwarding trigger jobs to a stand-in branch webhook"""
+import unittest
+
+from helpers import load_dashboard, admin_client
+from fake_branch import FakeBranch
+
+dashboard = load_dashboard()
+
+EMERGENCY = {'chosen_phone': '+15551234567', 'customer_name': 'Pat'}
+
+
+class TriggerForwardTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeBranch('trig')
+        response = admin_client(dashboard).post('/api/branches', json={'key': 'trig', 'name': 'Trig', 'url': cls.fake.url})
+        assert response.status_code in (200, 201), response.get_json()
+        cls.saved_backoff = dashboard.PEER_RETRY_BACKOFF
+        dashboard.PEER_RETRY_BACKOFF = 0.01
+
+    @classmethod
+    def tearDownClass(cls):
+        dashboard.PEER_RETRY_BACKOFF = cls.saved_backoff
+        cls.fake.stop()
+
+    def setUp(self):
+        self.fake.webhook_replies.clear()
+        self.fake.webhook_keys.clear()
+
+    def forward(self):
+        job_id = dashboard.create_trigger_job('trig', EMERGENCY, 'test')
+        result = dashboard._forward_trigger(job_id, 'trig', EMERGENCY)
+        return job_id, result, dashboard.get_trigger_job(job_id)
+
+    def test_still_processing_reply_is_retried_with_the_same_key(self):
+        self.fake.webhook_replies.append(
+            (409, {'status': 'error', 'message': 'An identical request is still being processed.'}))
+        job_id, result, job = self.forward()
+        self.assertEqual(result['emergency_id'], 'e1')
+        self.assertNotEqual(job['status'], 'rejected')
+        self.assertEqual(self.fake.webhook_keys, [f'trigger-{job_id}'] * 2)
+
+    def test_invalid_request_is_rejected_without_retrying(self):
+        self.fake.webhook_replies.append((400, {'status': 'error', 'message': 'Missing required field: chosen_phone'}))
+        _, result, job = self.forward()
+        self.assertIsNone(result)
+        self.assertEqual(job['status'], 'rejected')
+        self.assertEqual(job['error'], 'Missing required field: chosen_phone')
+        self.assertEqual(len(self.fake.webhook_keys), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
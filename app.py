@@ -5,19 +5,28 @@ import requests
 import atexit
 import json
 import platform
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
+import random
+from flask import Flask, Response, request, jsonify, render_template_string, redirect, url_for
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import threading
 import csv
 import re
 import socket
+import sqlite3
+from contextlib import contextmanager
 from urllib.parse import quote_plus
 
 import uuid
+import hashlib
+import gzip
+import itertools
+import heapq
+from collections import OrderedDict, deque
+from functools import wraps
 
-# Docker-friendly log path (inside container)
-LOG_PATH = "/app/logs/app.log"
+# Docker-friendly log path (inside container); the multi-tenant host gives each branch its own
+LOG_PATH = os.environ.get('LOG_PATH', "/app/logs/app.log")
 
 # Delay before initiating connection after customer enters queue
 # This ensures the customer is properly enqueued before dequeue attempt
@@ -57,8 +66,9 @@ def send_debug(event_type, data=None):
         # Still persist to local log even if no webhook is configured
         pass
     payload = {
+        "id": uuid.uuid4().hex,
         "event": event_type,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "data": data or {}
     }
 
@@ -132,21 +142,111 @@ except Exception as e:
 # Global settings cache
 _settings_cache = {}
 _settings_last_updated = None
+# Version/ETag of the cached settings as reported by the admin dashboard
+_settings_version = None
+_settings_etag = None
+# Hold a ?since_version= request open this long waiting for a change
+SETTINGS_WATCH_TIMEOUT = 25
+
+# --- Admin Dashboard Client ---
+# Keep-alive connections to the admin dashboard, bounded retries with jitter, and a
+# circuit breaker so an unreachable dashboard fails fast instead of timing out each call
+ADMIN_RETRY_ATTEMPTS = int(os.environ.get('ADMIN_RETRY_ATTEMPTS', 3))
+ADMIN_RETRY_BACKOFF = float(os.environ.get('ADMIN_RETRY_BACKOFF', 0.5))
+ADMIN_CIRCUIT_THRESHOLD = int(os.environ.get('ADMIN_CIRCUIT_THRESHOLD', 3))
+ADMIN_CIRCUIT_RESET = int(os.environ.get('ADMIN_CIRCUIT_RESET', 30))
+_admin_http = requests.Session()
+_admin_circuit = {"failures": 0, "open_until": 0}
+_admin_circuit_lock = threading.Lock()
+
+
+def _acquire_admin_circuit():
+    """Whether a call may go out; once an open circuit is due, a single trial call is let through."""
+    with _admin_circuit_lock:
+        if _admin_circuit["failures"] < ADMIN_CIRCUIT_THRESHOLD:
+            return True
+        now = time.monotonic()
+        if _admin_circuit["open_until"] > now:
+            return False
+        _admin_circuit["open_until"] = now + ADMIN_CIRCUIT_RESET
+        return True
+
+
+def _record_admin_result(ok):
+    event = None
+    with _admin_circuit_lock:
+        if ok:
+            if _admin_circuit["failures"] >= ADMIN_CIRCUIT_THRESHOLD:
+                event = "admin_circuit_closed"
+            _admin_circuit["failures"] = 0
+            _admin_circuit["open_until"] = 0
+        else:
+            _admin_circuit["failures"] += 1
+            if _admin_circuit["failures"] >= ADMIN_CIRCUIT_THRESHOLD:
+                if _admin_circuit["failures"] == ADMIN_CIRCUIT_THRESHOLD:
+                    event = "admin_circuit_open"
+                _admin_circuit["open_until"] = time.monotonic() + ADMIN_CIRCUIT_RESET
+    if event:
+        send_debug(event, {"failures": _admin_circuit["failures"]})
+
+
+def admin_request(method, path, attempts=None, **kwargs):
+    """Calls the admin dashboard over the pooled session.
+
+    Connection errors, timeouts and 502/503/504 replies are retried with
+    jittered exponential backoff. While the circuit is open this raises
+    requests.ConnectionError immediately.
+    """
+    attempts = attempts or ADMIN_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(random.uniform(0, ADMIN_RETRY_BACKOFF * 2 ** (attempt - 1)))
+        if not _acquire_admin_circuit():
+            raise requests.exceptions.ConnectionError("Admin dashboard unavailable (circuit open)")
+        try:
+            response = _admin_http.request(method, f"{ADMIN_DASHBOARD_URL}{path}", **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            _record_admin_result(False)
+            if attempt == attempts - 1:
+                raise
+            continue
+        if response.status_code in (502, 503, 504):
+            _record_admin_result(False)
+            if attempt < attempts - 1:
+                continue
+        else:
+            _record_admin_result(True)
+        return response
+
+
+def _store_admin_settings(response):
+    """Caches a 200 settings response along with its version"""
+    global _settings_cache, _settings_last_updated, _settings_version, _settings_etag
+    settings = response.json()
+    _settings_cache = settings
+    _settings_last_updated = datetime.now()
+    _settings_etag = response.headers.get('ETag')
+    version = response.headers.get('X-Settings-Version')
+    _settings_version = int(version) if version is not None else None
+    send_debug("settings_loaded_from_admin", {"branch": BRANCH_NAME, "keys": list(settings.keys()),
+                                              "version": _settings_version})
+    return settings
 
 
 def load_settings_from_admin():
-    """Load settings from the admin dashboard database"""
-    global _settings_cache, _settings_last_updated
+    """Load settings from the admin dashboard database (conditional on the cached version)"""
+    global _settings_last_updated
     
     try:
-        # Try to fetch settings from admin dashboard
-        response = requests.get(f"{ADMIN_DASHBOARD_URL}/api/internal/branch/{BRANCH_NAME}/settings", timeout=5)
-        if response.status_code == 200:
-            settings = response.json()
-            _settings_cache = settings
+        # Try to fetch settings from admin dashboard; unchanged settings come back as 304
+        headers = {'If-None-Match': _settings_etag} if _settings_etag and _settings_cache else {}
+        response = admin_request("GET", f"/api/internal/branch/{BRANCH_NAME}/settings",
+                                 headers=headers, timeout=5)
+        if response.status_code == 304:
             _settings_last_updated = datetime.now()
-            send_debug("settings_loaded_from_admin", {"branch": BRANCH_NAME, "keys": list(settings.keys())})
-            return settings
+            return _settings_cache
+        if response.status_code == 200:
+            return _store_admin_settings(response)
     except Exception as e:
         send_debug("settings_load_error", {"error": str(e), "admin_dashboard_unreachable": True})
     
@@ -184,7 +284,31 @@ def get_twilio_client():
     return Client(account_sid, auth_token)
 
 
-# Initialize settings on startup
+def _settings_watcher():
+    """Long-polls the admin dashboard so setting changes apply within seconds"""
+    while True:
+        if _settings_version is None:
+            # Admin dashboard doesn't report versions (or is unreachable); rely on periodic refresh
+            time.sleep(60)
+            load_settings_from_admin()
+            continue
+        try:
+            response = admin_request("GET", f"/api/internal/branch/{BRANCH_NAME}/settings", attempts=1,
+                                     params={"since_version": _settings_version},
+                                     timeout=SETTINGS_WATCH_TIMEOUT + 10)
+            if response.status_code == 200:
+                _store_admin_settings(response)
+            elif response.status_code != 304:
+                time.sleep(30)
+            elif response.headers.get('Retry-After', '').isdigit():
+                # The dashboard is holding as many long-polls as it allows; come back later
+                time.sleep(int(response.headers['Retry-After']))
+        except Exception as e:
+            send_debug("settings_watch_error", {"error": str(e)})
+            time.sleep(30)
+
+
+# Initialize settings on startup (the watcher starts with the other background work)
 load_settings_from_admin()
 
 # --- Contact Mapping ---
@@ -217,6 +341,332 @@ def send_to_all(subject, body):
 active_emergency = {}
 active_emergency_lock = threading.Lock()
 
+# Emergencies that arrived while the branch was busy, waiting for their turn.
+# Guarded by active_emergency_lock so admission and promotion are atomic.
+intake_queue = []
+INTAKE_QUEUE_DEFAULT_SIZE = 10
+_recent_queue_waits = deque(maxlen=50)  # seconds queued emergencies waited to start
+
+
+# --- Durable Emergency State ---
+# The in-memory emergency above is mirrored to a SQLite (WAL) file so that a
+# container restart mid-call does not lose it. Writes are queued and flushed by a
+# background thread (write-behind); every snapshot queued within one flush window
+# is committed in a single transaction (group commit), so request handlers never
+# wait on disk I/O.
+EMERGENCY_STATE_DB = os.environ.get('EMERGENCY_STATE_DB', os.path.join(os.path.dirname(LOG_PATH), 'emergency_state.db'))
+STATE_FLUSH_INTERVAL = 0.05  # seconds to gather writes into one commit
+STATE_HISTORY_DAYS = 7  # concluded emergencies older than this are pruned on boot
+
+# "local": this process owns the state (memory + write-behind mirror).
+# "shared": the database is the source of truth so several replicas behind one
+# PUBLIC_URL (or several gunicorn workers) can serve any callback. Point
+# EMERGENCY_STATE_DB at a volume every replica mounts. WAL needs all replicas on
+# one host; use EMERGENCY_STATE_JOURNAL=DELETE when the volume spans hosts.
+EMERGENCY_STATE_MODE = os.environ.get('EMERGENCY_STATE_MODE', 'local').strip().lower()
+SHARED_STATE = EMERGENCY_STATE_MODE == 'shared'
+EMERGENCY_STATE_JOURNAL = os.environ.get('EMERGENCY_STATE_JOURNAL', 'WAL').strip().upper()
+EMERGENCY_LOCK_TTL = 30  # seconds before an abandoned per-emergency lock expires
+EMERGENCY_LOCK_WAIT = 10  # seconds a callback waits for a per-emergency lock
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_state_pending = {}  # emergency_id -> (data_json, status, concluded, updated_at)
+_state_pending_lock = threading.Lock()
+_state_flush_event = threading.Event()
+_state_writer_thread = None
+_state_local = threading.local()
+_local_emergency_locks = [threading.RLock() for _ in range(64)]
+
+
+def _encode_state_value(value):
+    """JSON encoder hook that keeps datetimes round-trippable."""
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return str(value)
+
+
+def _decode_state_object(obj):
+    """JSON object hook that restores datetimes written by _encode_state_value."""
+    if len(obj) == 1 and "$dt" in obj:
+        try:
+            return datetime.fromisoformat(obj["$dt"])
+        except ValueError:
+            return obj["$dt"]
+    return obj
+
+
+def _state_db_connect():
+    """Open the emergency state database, creating it if needed."""
+    state_dir = os.path.dirname(EMERGENCY_STATE_DB)
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    conn = sqlite3.connect(EMERGENCY_STATE_DB, timeout=5, check_same_thread=False)
+    conn.execute(f'PRAGMA journal_mode={EMERGENCY_STATE_JOURNAL}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS emergencies (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        status TEXT,
+        concluded INTEGER DEFAULT 0,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_emergencies_concluded ON emergencies(concluded, updated_at)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS emergency_locks (
+        emergency_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        status INTEGER,
+        body BLOB,
+        content_type TEXT,
+        created_at REAL NOT NULL
+    )''')
+    conn.commit()
+    return conn
+
+
+def _shared_state_conn():
+    """Returns this thread's connection to the shared state database."""
+    conn = getattr(_state_local, 'conn', None)
+    if conn is None:
+        conn = _state_db_connect()
+        # Transactions are opened explicitly with BEGIN IMMEDIATE
+        conn.isolation_level = None
+        _state_local.conn = conn
+    return conn
+
+
+@contextmanager
+def shared_state_transaction():
+    """Serializes a read-modify-write against every replica sharing the database."""
+    conn = _shared_state_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _load_active_row(conn):
+    """Reads the current active emergency from the state database."""
+    row = conn.execute('''SELECT data FROM emergencies
+                          WHERE concluded = 0 AND (status IS NULL OR status != 'queued')
+                          ORDER BY updated_at DESC LIMIT 1''').fetchone()
+    return json.loads(row[0], object_hook=_decode_state_object) if row else {}
+
+
+def _load_queued_rows(conn):
+    """Reads the intake queue from the state database, in start order."""
+    rows = conn.execute("SELECT data FROM emergencies WHERE concluded = 0 AND status = 'queued'").fetchall()
+    return sorted((json.loads(row[0], object_hook=_decode_state_object) for row in rows), key=_queue_order)
+
+
+def _queue_order(emergency):
+    """Sort key for the intake queue: highest priority first, then first come."""
+    return (-int(emergency.get('priority') or 0), emergency.get('queued_at') or datetime.min)
+
+
+def _write_emergency_row(conn, emergency, concluded=False):
+    """Writes an emergency snapshot synchronously (shared mode)."""
+    conn.execute(
+        '''INSERT OR REPLACE INTO emergencies (id, data, status, concluded, updated_at)
+           VALUES (?, ?, ?, ?, ?)''',
+        (emergency['id'], json.dumps(emergency, default=_encode_state_value),
+         emergency.get('status'), 1 if concluded else 0, time.time())
+    )
+
+
+@contextmanager
+def emergency_lock(emergency_id, timeout=EMERGENCY_LOCK_WAIT):
+    """Holds a per-emergency lock so concurrent callbacks apply in order.
+
+    In shared mode the lock is a leased row in the state database, so it also
+    excludes callbacks being handled by other replicas. If the lock cannot be
+    acquired in time the callback proceeds anyway rather than being dropped.
+    """
+    if not emergency_id:
+        yield
+        return
+
+    if not SHARED_STATE:
+        lock = _local_emergency_locks[hash(emergency_id) % len(_local_emergency_locks)]
+        acquired = lock.acquire(timeout=timeout)
+        if not acquired:
+            send_debug("emergency_lock_timeout", {"emergency_id": emergency_id})
+        try:
+            yield
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    token = f"{REPLICA_ID}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + timeout
+    acquired = False
+    while True:
+        with shared_state_transaction() as conn:
+            now = time.time()
+            conn.execute('DELETE FROM emergency_locks WHERE emergency_id = ? AND expires_at < ?',
+                         (emergency_id, now))
+            cursor = conn.execute('''INSERT OR IGNORE INTO emergency_locks (emergency_id, owner, expires_at)
+                                     VALUES (?, ?, ?)''', (emergency_id, token, now + EMERGENCY_LOCK_TTL))
+            acquired = cursor.rowcount == 1
+        if acquired or time.monotonic() >= deadline:
+            break
+        time.sleep(0.02)
+
+    if not acquired:
+        send_debug("emergency_lock_timeout", {"emergency_id": emergency_id, "replica": REPLICA_ID})
+    try:
+        yield
+    finally:
+        if acquired:
+            with shared_state_transaction() as conn:
+                conn.execute('DELETE FROM emergency_locks WHERE emergency_id = ? AND owner = ?',
+                             (emergency_id, token))
+
+
+def queue_emergency_write(emergency, concluded=False):
+    """Queues a snapshot of an emergency for the background writer."""
+    emergency_id = emergency.get('id') if emergency else None
+    if not emergency_id:
+        return
+    snapshot = (
+        json.dumps(emergency, default=_encode_state_value),
+        emergency.get('status'),
+        1 if concluded else 0,
+        time.time()
+    )
+    with _state_pending_lock:
+        # Only the newest snapshot per emergency needs to reach disk
+        _state_pending[emergency_id] = snapshot
+    _state_flush_event.set()
+
+
+def flush_emergency_state(conn=None):
+    """Writes all queued snapshots in one transaction."""
+    with _state_pending_lock:
+        if not _state_pending:
+            return 0
+        batch = dict(_state_pending)
+        _state_pending.clear()
+
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = _state_db_connect()
+        with conn:
+            conn.executemany(
+                '''INSERT OR REPLACE INTO emergencies (id, data, status, concluded, updated_at)
+                   VALUES (?, ?, ?, ?, ?)''',
+                [(eid,) + snapshot for eid, snapshot in batch.items()]
+            )
+        return len(batch)
+    except Exception as e:
+        # Put the batch back (unless newer snapshots arrived) so it is retried
+        with _state_pending_lock:
+            for eid, snapshot in batch.items():
+                _state_pending.setdefault(eid, snapshot)
+        send_debug("emergency_state_write_error", {"error": str(e), "pending": len(batch)})
+        return 0
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
+
+
+def _emergency_state_writer():
+    """Background loop that drains queued snapshots into the state database."""
+    conn = None
+    while True:
+        _state_flush_event.wait()
+        # Give concurrent updates a moment to land in the same commit
+        time.sleep(STATE_FLUSH_INTERVAL)
+        _state_flush_event.clear()
+        try:
+            if conn is None:
+                conn = _state_db_connect()
+            flush_emergency_state(conn)
+        except Exception as e:
+            send_debug("emergency_state_write_error", {"error": str(e)})
+            conn = None
+            time.sleep(1)
+
+
+def start_emergency_state_writer():
+    """Starts the write-behind thread (idempotent)."""
+    global _state_writer_thread
+    if _state_writer_thread is not None and _state_writer_thread.is_alive():
+        return
+    _state_writer_thread = threading.Thread(target=_emergency_state_writer, name="emergency-state-writer", daemon=True)
+    _state_writer_thread.start()
+
+
+def restore_emergency_state():
+    """Reloads the in-flight and queued emergencies left behind by a previous process."""
+    global active_emergency
+    started = time.perf_counter()
+    try:
+        conn = _state_db_connect()
+    except Exception as e:
+        send_debug("emergency_state_restore_error", {"error": str(e), "path": EMERGENCY_STATE_DB})
+        return None
+
+    try:
+        with conn:
+            conn.execute('DELETE FROM emergencies WHERE concluded = 1 AND updated_at < ?',
+                         (time.time() - STATE_HISTORY_DAYS * 86400,))
+        rows = conn.execute('''SELECT id, data FROM emergencies
+                               WHERE concluded = 0 ORDER BY updated_at DESC''').fetchall()
+    except Exception as e:
+        send_debug("emergency_state_restore_error", {"error": str(e), "path": EMERGENCY_STATE_DB})
+        conn.close()
+        return None
+
+    restored = None
+    queued = []
+    stale_ids = []
+    for emergency_id, data in rows:
+        emergency = json.loads(data, object_hook=_decode_state_object)
+        if emergency.get('status') == 'queued':
+            queued.append(emergency)
+        elif restored is None:
+            restored = emergency
+        else:
+            # Only one emergency can be active; anything older was orphaned
+            stale_ids.append(emergency_id)
+
+    with active_emergency_lock:
+        if restored:
+            active_emergency = restored
+        intake_queue[:] = sorted(queued, key=_queue_order)
+    if stale_ids:
+        with conn:
+            conn.executemany('UPDATE emergencies SET concluded = 1, status = ? WHERE id = ?',
+                             [('abandoned', eid) for eid in stale_ids])
+    conn.close()
+
+    send_debug("emergency_state_restored", {
+        "emergency_id": restored.get('id') if restored else None,
+        "status": restored.get('status') if restored else None,
+        "queued": len(queued),
+        "abandoned": len(stale_ids),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+    return restored
+
+
+# Flush anything still queued when the worker shuts down cleanly
+atexit.register(flush_emergency_state)
+
+# Recover any emergency that was in flight when the previous process stopped.
+# In shared mode every read goes to the database, so there is nothing to reload.
+if not SHARED_STATE:
+    restore_emergency_state()
+
 
 # --- Log Parsing and Status Functions ---
 def get_network_info():
@@ -232,6 +682,9 @@ def get_network_info():
 def get_simple_status():
     """Determines the simple status: Ready, In Use, or Error."""
     if get_active_emergency():
+        queued = len(get_intake_queue())
+        if queued:
+            return "In Use", f"An emergency call is being processed. {queued} more waiting in the intake queue."
         return "In Use", "An emergency call is being processed."
 
     try:
@@ -264,7 +717,7 @@ def get_last_n_calls(n=3):
 
 def parse_log_for_timeline():
     events = []
-    error_keywords = ['error', 'failed', 'critical', 'warning', 'unavailable', 'unable']
+    error_keywords = LOG_ERROR_KEYWORDS
     title_map = {
         "NEW WEBHOOK RECEIVED": "Webhook: Emergency Triggered",
         "INCOMING TWILIO CALL": "Telephony: Incoming Call",
@@ -323,36 +776,564 @@ def parse_log_for_timeline():
     return sorted(events, key=lambda x: x['raw_timestamp'], reverse=True)
 
 
+# --- Event Stream ---
+# Every send_debug block starts with a "--- EVENT_TYPE ---" header line
+LOG_BLOCK_HEADER = re.compile(r'^--- (.*?) ---$')
+LOG_ERROR_KEYWORDS = ['error', 'failed', 'critical', 'warning', 'unavailable', 'unable']
+# Threads writing at the same moment can append blocks slightly out of time order;
+# events are re-sorted within a window of this many
+EVENT_REORDER_WINDOW = 256
+
+
+def _log_event_from_block(title, lines):
+    """Event for one log block (None if the block has no timestamp)"""
+    text = '\n'.join(lines).strip()
+    match = re.match(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ', text)
+    if not match:
+        return None
+    body = text[match.end():]
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        payload = {"data": {"text": body}}
+    data = payload.get('data') if isinstance(payload.get('data'), dict) else {}
+    try:
+        timestamp = event_time_utc(payload.get('timestamp') or match.group(1))
+    except (TypeError, ValueError):
+        timestamp = event_time_utc(match.group(1))
+    return {
+        # Blocks written before events carried ids get a stable one from their content
+        "id": payload.get('id') or hashlib.sha1(f"{BRANCH_NAME}\n{text}".encode('utf-8')).hexdigest(),
+        "branch": BRANCH_NAME,
+        "timestamp": timestamp,
+        "event": payload.get('event') or title.lower(),
+        "status": "error" if any(keyword in text.lower() for keyword in LOG_ERROR_KEYWORDS) else "success",
+        "emergency_id": data.get('emergency_id'),
+        "data": data
+    }
+
+
+def iter_log_blocks(path, offset=0, complete_only=False):
+    """Yields (event, offset just past its block) from a log file, starting at a block boundary
+
+    With complete_only, a final block that is still being written (its JSON
+    not yet closed) is left for the next read.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        title, lines, position = None, [], offset
+        for raw in f:
+            line = raw.decode('utf-8', errors='replace').rstrip('\n')
+            header = LOG_BLOCK_HEADER.match(line)
+            if header:
+                if title is not None:
+                    event = _log_event_from_block(title, lines)
+                    if event:
+                        yield event, position
+                title, lines = header.group(1).strip(), []
+            elif title is not None:
+                lines.append(line)
+            position += len(raw)
+        if title is not None and (not complete_only or (lines and lines[-1].rstrip() == '}' and raw.endswith(b'\n'))):
+            event = _log_event_from_block(title, lines)
+            if event:
+                yield event, position
+
+
+def iter_log_events():
+    """Yields events from the log file oldest first, reading one block at a time"""
+    for event, _ in iter_log_blocks(LOG_PATH):
+        yield event
+
+
+def event_time_utc(value):
+    """Event timestamp -> fixed-width UTC ISO string, so event times compare as text
+
+    Blocks written before timestamps carried an offset are in this host's local time.
+    """
+    parsed = datetime.fromisoformat(value.strip().replace(' ', 'T'))
+    return parsed.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def parse_event_time(value):
+    """Normalizes an ISO 8601 query value to the UTC form events use; naive values are UTC (raises ValueError)"""
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def filter_log_events(events, since=None, until=None, event_types=None, status=None, emergency_id=None, text=None):
+    """Applies event query filters (the log is only nearly in time order, so every event is checked)"""
+    text = text.lower() if text else None
+    for event in events:
+        if since and event['timestamp'] < since:
+            continue
+        if until and event['timestamp'] > until:
+            continue
+        if event_types and event['event'] not in event_types:
+            continue
+        if status and event['status'] != status:
+            continue
+        if emergency_id and event['emergency_id'] != emergency_id:
+            continue
+        if text and text not in json.dumps(event['data'], default=str).lower():
+            continue
+        yield event
+
+
+def sort_log_events(events, window=EVENT_REORDER_WINDOW):
+    """Yields events in time order, given none is more than `window` places out of order"""
+    pending = []
+    for position, event in enumerate(events):
+        heapq.heappush(pending, (event['timestamp'], position, event))
+        if len(pending) > window:
+            yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+# --- Event Shipping ---
+# Log events are shipped to the admin dashboard in gzip batches. The log file is
+# the durable outbox: a cursor (file inode and byte offset) only advances once
+# the dashboard acknowledges a batch, and a resent batch is deduplicated there
+# by event id, so delivery is at-least-once. 0 disables shipping.
+EVENT_SHIP_INTERVAL = float(os.environ.get('EVENT_SHIP_INTERVAL', 5))
+EVENT_SHIP_BATCH = int(os.environ.get('EVENT_SHIP_BATCH', 500))
+EVENT_SHIP_CURSOR = os.path.join(os.path.dirname(LOG_PATH), 'event_ship_cursor.json')
+# DELETE /api/logs and /resolve_errors rename the log to <LOG_PATH>.<kind>.<time>
+LOG_ARCHIVE_KINDS = ('cleared', 'resolved')
+
+
+def log_archive_path(kind):
+    """Path to rename the log to when archiving it; kept next to LOG_PATH so the shipper finds it"""
+    return f"{LOG_PATH}.{kind}.{int(time.time())}"
+
+
+def _log_archives():
+    """Archived logs next to LOG_PATH, oldest first"""
+    log_dir = os.path.dirname(LOG_PATH) or '.'
+    prefixes = tuple(f"{os.path.basename(LOG_PATH)}.{kind}." for kind in LOG_ARCHIVE_KINDS)
+    archives = [entry for entry in os.scandir(log_dir) if entry.name.startswith(prefixes) and entry.is_file()]
+    return sorted(archives, key=lambda entry: entry.stat().st_mtime)
+
+
+def _load_ship_cursor():
+    try:
+        with open(EVENT_SHIP_CURSOR, 'r', encoding='utf-8') as f:
+            cursor = json.load(f)
+        return cursor['inode'], cursor['offset']
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return None, 0
+
+
+def _save_ship_cursor(inode, offset):
+    tmp_path = f"{EVENT_SHIP_CURSOR}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"inode": inode, "offset": offset}, f)
+    os.replace(tmp_path, EVENT_SHIP_CURSOR)
+
+
+def _live_log_inode():
+    try:
+        return os.stat(LOG_PATH).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _ship_source():
+    """(path, inode, offset) to ship from next
+
+    After DELETE /api/logs or /resolve_errors renames the log, the rest of the
+    archived file is shipped before moving on to the new one.
+    """
+    inode, offset = _load_ship_cursor()
+    current_inode = _live_log_inode()
+    if inode is None or inode == current_inode:
+        return LOG_PATH, current_inode, offset if inode is not None else 0
+    for entry in _log_archives():
+        if entry.inode() == inode:
+            return entry.path, inode, offset
+    return LOG_PATH, current_inode, 0
+
+
+def _next_ship_inode(inode):
+    """Inode to ship after the archived log `inode`: a later archive, else the live log"""
+    archives = [entry.inode() for entry in _log_archives()]
+    if inode in archives and archives.index(inode) + 1 < len(archives):
+        return archives[archives.index(inode) + 1]
+    return _live_log_inode()
+
+
+def ship_events():
+    """Ship the next batch of log events; returns how many were acknowledged"""
+    path, inode, offset = _ship_source()
+    if inode is None:
+        return 0
+    batch, end = [], offset
+    for event, end in iter_log_blocks(path, offset, complete_only=True):
+        batch.append(event)
+        if len(batch) >= EVENT_SHIP_BATCH:
+            break
+    if not batch:
+        if path != LOG_PATH:
+            # Archived log fully shipped; continue with the next archive or the live log
+            next_inode = _next_ship_inode(inode)
+            if next_inode is not None:
+                _save_ship_cursor(next_inode, 0)
+        return 0
+
+    body = gzip.compress(json.dumps({"events": batch}, default=str).encode('utf-8'))
+    response = admin_request("POST", f"/api/internal/branch/{BRANCH_NAME}/events", attempts=1, data=body,
+                             headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                             timeout=10)
+    if response.status_code != 200:
+        raise RuntimeError(f"admin dashboard answered {response.status_code}")
+    _save_ship_cursor(inode, end)
+    return len(batch)
+
+
+def _event_shipper():
+    """Background loop shipping log events to the admin dashboard"""
+    last_error = None
+    while True:
+        try:
+            shipped = ship_events()
+            last_error = None
+        except Exception as e:
+            # Printed (once per distinct error) rather than sent through send_debug,
+            # which would log and ship more events
+            if str(e) != last_error:
+                print(f"Event shipping failed, will retry: {e}", flush=True)
+            last_error = str(e)
+            shipped = 0
+        if shipped < EVENT_SHIP_BATCH:
+            time.sleep(EVENT_SHIP_INTERVAL)
+
+
+def start_event_shipper():
+    if EVENT_SHIP_INTERVAL > 0:
+        threading.Thread(target=_event_shipper, name="event-shipper", daemon=True).start()
+
+
 # --- Emergency Logic Functions ---
 def get_active_emergency():
     """Safely gets the active emergency data."""
+    if SHARED_STATE:
+        return _load_active_row(_shared_state_conn())
     with active_emergency_lock:
         return active_emergency.copy()
 
 def set_active_emergency(data):
     """Safely sets the active emergency data."""
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            _write_emergency_row(conn, data)
+        return
     with active_emergency_lock:
         global active_emergency
         active_emergency = data
+        queue_emergency_write(data)
 
-def update_active_emergency(key, value):
-    """Safely updates a specific key in the active emergency data."""
-    with active_emergency_lock:
-        if active_emergency:
-            active_emergency[key] = value
-        else:
-            # Log if trying to update when no emergency is active
-            send_debug("update_emergency_failed", {
-                "reason": "no_active_emergency",
-                "attempted_key": key,
-                "attempted_value": str(value)
-            })
+def update_active_emergency(key, value, emergency_id=None):
+    """Safely updates a specific key in the active emergency data.
+
+    If emergency_id is given, the update only applies while that emergency is
+    still the active one (background work must not touch its successor).
+    """
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            emergency = _load_active_row(conn)
+            if emergency and emergency_id and emergency.get('id') != emergency_id:
+                emergency = {}
+            if emergency:
+                emergency[key] = value
+                _write_emergency_row(conn, emergency)
+    else:
+        with active_emergency_lock:
+            emergency = active_emergency
+            if emergency and emergency_id and emergency.get('id') != emergency_id:
+                emergency = {}
+            if emergency:
+                emergency[key] = value
+                queue_emergency_write(emergency)
+    if not emergency:
+        # Log if trying to update when no emergency is active
+        send_debug("update_emergency_failed", {
+            "reason": "no_active_emergency" if not emergency_id else "emergency_not_active",
+            "emergency_id": emergency_id,
+            "attempted_key": key,
+            "attempted_value": str(value)
+        })
 
 def clear_active_emergency():
-    """Safely clears the active emergency data."""
+    """Safely clears the active emergency data and starts the next queued one."""
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            emergency = _load_active_row(conn)
+            if emergency:
+                _write_emergency_row(conn, emergency, concluded=True)
+    else:
+        with active_emergency_lock:
+            global active_emergency
+            if active_emergency:
+                queue_emergency_write(active_emergency, concluded=True)
+            active_emergency = {}
+    promote_next_emergency()
+
+
+def conclude_emergency(emergency_id):
+    """Clears emergency_id only while it is still the active emergency.
+
+    Returns True if it was cleared (which also starts the next queued one).
+    """
+    with emergency_lock(emergency_id):
+        if get_active_emergency().get('id') != emergency_id:
+            return False
+        clear_active_emergency()
+        return True
+
+
+# --- Intake Queue ---
+def get_intake_queue_size():
+    """Maximum number of emergencies that may wait while the branch is busy."""
+    try:
+        return max(0, int(get_setting('intake_queue_size', INTAKE_QUEUE_DEFAULT_SIZE)))
+    except (TypeError, ValueError):
+        return INTAKE_QUEUE_DEFAULT_SIZE
+
+
+def get_emergency_priority(emergency_data):
+    """Scores an emergency using the branch's intake_priority_rules setting.
+
+    The setting is a JSON list such as
+    [{"keyword": "gas leak", "priority": 10}, {"technician": "+12085550100", "priority": 5}].
+    A keyword rule matches the emergency description (case-insensitive), a
+    technician rule matches chosen_phone. The highest matching priority wins;
+    unmatched emergencies get 0.
+    """
+    rules_str = get_setting('intake_priority_rules', '')
+    if not rules_str:
+        return 0
+    try:
+        rules = json.loads(rules_str)
+    except (json.JSONDecodeError, ValueError, TypeError):
+        send_debug("intake_priority_rules_invalid", {"value": rules_str})
+        return 0
+    if not isinstance(rules, list):
+        return 0
+
+    description = (emergency_data.get('emergency_description_text') or '').lower()
+    technician_number = emergency_data.get('technician_number') or ''
+    priority = 0
+    for rule in rules:
+        if not isinstance(rule, dict):
+            continue
+        try:
+            value = int(rule.get('priority', 0))
+        except (TypeError, ValueError):
+            continue
+        keyword = str(rule.get('keyword') or '').strip().lower()
+        technician = str(rule.get('technician') or '').strip()
+        if (keyword and keyword in description) or (technician and technician == technician_number):
+            priority = max(priority, value)
+    return priority
+
+
+def admit_emergency(data, queue_size):
+    """Starts an emergency if the branch is idle, otherwise places it in the intake queue.
+
+    Returns ('started', 0), ('queued', position) or ('full', None).
+    """
+    now = datetime.now()
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            queued = _load_queued_rows(conn)
+            if not _load_active_row(conn) and not queued:
+                data['started_at'] = now
+                _write_emergency_row(conn, data)
+                return 'started', 0
+            if len(queued) >= queue_size:
+                return 'full', None
+            data['status'] = 'queued'
+            data['queued_at'] = now
+            _write_emergency_row(conn, data)
+            queued.append(data)
+    else:
+        with active_emergency_lock:
+            global active_emergency
+            if not active_emergency and not intake_queue:
+                data['started_at'] = now
+                active_emergency = data
+                queue_emergency_write(data)
+                return 'started', 0
+            if len(intake_queue) >= queue_size:
+                return 'full', None
+            data['status'] = 'queued'
+            data['queued_at'] = now
+            intake_queue.append(data)
+            intake_queue.sort(key=_queue_order)
+            queue_emergency_write(data)
+            queued = list(intake_queue)
+
+    position = next(i for i, e in enumerate(sorted(queued, key=_queue_order), 1) if e['id'] == data['id'])
+    # The active emergency may have finished while this one was being admitted
+    promote_next_emergency()
+    return 'queued', position
+
+
+def get_intake_queue():
+    """Returns the queued emergencies in the order they will start."""
+    if SHARED_STATE:
+        return _load_queued_rows(_shared_state_conn())
     with active_emergency_lock:
-        global active_emergency
-        active_emergency = {}
+        return [e.copy() for e in intake_queue]
+
+
+def promote_next_emergency():
+    """Starts the next queued emergency if the branch is idle.
+
+    The emergency becomes active immediately; the technician SMS/call is placed
+    from a background thread so callers (often Twilio callbacks) are not held up.
+    """
+    now = datetime.now()
+    next_emergency = None
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            if not _load_active_row(conn):
+                queued = _load_queued_rows(conn)
+                if queued:
+                    next_emergency = queued[0]
+                    next_emergency['status'] = 'informing_technician'
+                    next_emergency['started_at'] = now
+                    _write_emergency_row(conn, next_emergency)
+    else:
+        with active_emergency_lock:
+            global active_emergency
+            if not active_emergency and intake_queue:
+                next_emergency = intake_queue.pop(0)
+                next_emergency['status'] = 'informing_technician'
+                next_emergency['started_at'] = now
+                active_emergency = next_emergency
+                queue_emergency_write(next_emergency)
+
+    if not next_emergency:
+        return None
+
+    queued_at = next_emergency.get('queued_at')
+    wait_seconds = (now - queued_at).total_seconds() if isinstance(queued_at, datetime) else 0
+    _recent_queue_waits.append(wait_seconds)
+    send_debug("queued_emergency_started", {
+        "emergency_id": next_emergency['id'],
+        "priority": next_emergency.get('priority', 0),
+        "wait_seconds": round(wait_seconds, 1)
+    })
+    start_emergency_dispatch(next_emergency['id'], next_emergency.copy())
+    return next_emergency
+
+
+# --- Emergency Dispatch ---
+# /webhook only validates and persists; the Twilio client, SMS sends and the
+# technician call run here in the background. Progress is kept on the emergency
+# record under "dispatch" and served by /api/emergencies/<id>.
+def _iso(value):
+    """Formats datetimes for JSON responses."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def new_dispatch_progress():
+    """Initial dispatch progress record for a newly accepted emergency."""
+    return {"state": "pending", "steps": [], "error": None, "updated_at": datetime.now().isoformat()}
+
+
+def record_dispatch_progress(emergency_id, step=None, status=None, detail=None, state=None, error=None):
+    """Appends a dispatch step and/or changes the overall dispatch state."""
+    emergency = get_active_emergency()
+    if emergency.get('id') != emergency_id:
+        return
+    progress = dict(emergency.get('dispatch') or new_dispatch_progress())
+    progress['steps'] = list(progress.get('steps') or [])
+    now = datetime.now().isoformat()
+    if step:
+        entry = {"step": step, "status": status, "at": now}
+        if detail:
+            entry["detail"] = detail
+        progress['steps'].append(entry)
+    if state:
+        progress['state'] = state
+    if error:
+        progress['error'] = error
+    progress['updated_at'] = now
+    update_active_emergency('dispatch', progress, emergency_id=emergency_id)
+
+
+def start_emergency_dispatch(emergency_id, emergency_data):
+    """Runs the technician notification for an accepted emergency in the background."""
+    threading.Thread(
+        target=_dispatch_emergency,
+        args=(emergency_id, emergency_data),
+        name=f"dispatch-{emergency_id[:8]}",
+        daemon=True
+    ).start()
+
+
+def _dispatch_emergency(emergency_id, emergency_data):
+    """Notifies the technician; on failure the emergency is concluded so the next can start."""
+    record_dispatch_progress(emergency_id, state="in_progress")
+    try:
+        success, message = make_emergency_call(emergency_id, emergency_data)
+    except Exception as e:
+        success, message = False, f"Unexpected error in dispatch: {str(e)}"
+    if success:
+        record_dispatch_progress(emergency_id, state="completed")
+        return
+    send_debug("webhook_call_failed", {"emergency_id": emergency_id, "error": message})
+    record_dispatch_progress(emergency_id, state="failed", error=message)
+    # Clearing also promotes the next emergency in line
+    conclude_emergency(emergency_id)
+
+
+def find_emergency(emergency_id):
+    """Looks up an emergency by id: active, queued, or from the state database.
+
+    Returns (emergency, concluded) or (None, None) if unknown.
+    """
+    active = get_active_emergency()
+    if active.get('id') == emergency_id:
+        return active, False
+    for emergency in get_intake_queue():
+        if emergency.get('id') == emergency_id:
+            return emergency, False
+    with _state_pending_lock:
+        pending = _state_pending.get(emergency_id)
+    if pending:
+        return json.loads(pending[0], object_hook=_decode_state_object), bool(pending[2])
+    row = _shared_state_conn().execute('SELECT data, concluded FROM emergencies WHERE id = ?',
+                                       (emergency_id,)).fetchone()
+    if row:
+        return json.loads(row[0], object_hook=_decode_state_object), bool(row[1])
+    return None, None
+
+
+def webhook_replay_is_current(cached):
+    """A cached /webhook acceptance is stale once that emergency has concluded or its dispatch has failed."""
+    body, status, _ = cached
+    if status != 202:
+        return True
+    try:
+        emergency_id = json.loads(body).get('emergency_id')
+    except (ValueError, AttributeError):
+        return True
+    emergency, concluded = find_emergency(emergency_id) if emergency_id else (None, None)
+    if concluded:
+        return False
+    return ((emergency or {}).get('dispatch') or {}).get('state') != 'failed'
 
 
 def log_request_details(req):
@@ -366,6 +1347,234 @@ def log_request_details(req):
     except Exception as e:
         send_debug("request_log_failed", {"error": str(e)})
 
+# --- Idempotent Request Handling ---
+# Twilio retries status callbacks and upstream systems sometimes re-POST /webhook.
+# Each inbound POST route derives a key for "this exact event"; the first request
+# runs normally and its response is cached, repeats get the cached response back
+# without repeating side effects (SMS, calls, final emails, state changes).
+IDEMPOTENCY_CACHE_SIZE = 2048
+IDEMPOTENCY_TTL = 3600  # seconds a completed response is replayed
+# A body hash can't tell a retry from a genuine repeat (same caller, same form),
+# so keys derived from one are only kept for a short retry window
+IDEMPOTENCY_PAYLOAD_TTL = 120
+IDEMPOTENCY_PAYLOAD_PREFIX = 'sha256:'
+IDEMPOTENCY_WAIT = 15  # seconds a duplicate waits for the original to finish
+
+_idempotency_cache = OrderedDict()  # key -> {"done": Event, "response": tuple|None, "at": float}
+_idempotency_lock = threading.Lock()
+
+
+def idempotency_key_from_header():
+    """Uses the client-supplied Idempotency-Key header, if any."""
+    return request.headers.get('Idempotency-Key', '').strip() or None
+
+
+def idempotency_key_from_payload():
+    """Uses the Idempotency-Key header, falling back to a hash of the request body."""
+    header_key = idempotency_key_from_header()
+    if header_key:
+        return header_key
+    body = request.get_data(cache=True)
+    if not body:
+        return None
+    return IDEMPOTENCY_PAYLOAD_PREFIX + hashlib.sha256(body).hexdigest()
+
+
+def idempotency_key_from_twilio(*fields):
+    """Builds a key from the Twilio CallSid/MessageSid plus the event fields given."""
+    def key_func():
+        sid = request.values.get('CallSid') or request.values.get('MessageSid') or request.values.get('SmsSid')
+        if not sid:
+            return idempotency_key_from_header()
+        parts = [sid, request.args.get('emergency_id', '')]
+        parts.extend(request.values.get(field, '') for field in fields)
+        return ':'.join(parts)
+    return key_func
+
+
+def _idempotency_ttl(key):
+    """Seconds a completed response for key is replayed."""
+    if f":{IDEMPOTENCY_PAYLOAD_PREFIX}" in key:
+        return IDEMPOTENCY_PAYLOAD_TTL
+    return IDEMPOTENCY_TTL
+
+
+def _idempotency_claim_local(key):
+    """Returns (entry, is_owner) for key from the in-process LRU."""
+    now = time.time()
+    with _idempotency_lock:
+        entry = _idempotency_cache.get(key)
+        if entry is not None and entry['response'] is not None and now - entry['at'] > _idempotency_ttl(key):
+            del _idempotency_cache[key]
+            entry = None
+        if entry is not None:
+            _idempotency_cache.move_to_end(key)
+            return entry, False
+        entry = {'done': threading.Event(), 'response': None, 'at': now}
+        _idempotency_cache[key] = entry
+        # Evict the oldest completed responses; in-flight claims stay so duplicates keep waiting on them
+        if len(_idempotency_cache) > IDEMPOTENCY_CACHE_SIZE:
+            for old_key in [k for k, e in _idempotency_cache.items() if e['response'] is not None]:
+                if len(_idempotency_cache) <= IDEMPOTENCY_CACHE_SIZE:
+                    break
+                del _idempotency_cache[old_key]
+        return entry, True
+
+
+def _idempotency_claim_shared(key):
+    """Claims key in the shared state database so other replicas see it too.
+
+    Returns (cached_response, is_owner); cached_response is None while the
+    original request is still running.
+    """
+    with shared_state_transaction() as conn:
+        conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (time.time() - IDEMPOTENCY_TTL,))
+        conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status IS NOT NULL AND created_at < ?',
+                     (key, time.time() - _idempotency_ttl(key)))
+        cursor = conn.execute('''INSERT OR IGNORE INTO idempotency_keys (key, created_at)
+                                 VALUES (?, ?)''', (key, time.time()))
+        if cursor.rowcount == 1:
+            return None, True
+        row = conn.execute('SELECT status, body, content_type FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+    if row and row[0] is not None:
+        return (row[1], row[0], row[2]), False
+    return None, False
+
+
+def _idempotency_wait_shared(key):
+    """Polls the shared database until the original request stores its response.
+
+    Returns (cached_response, still_running); both are falsy when the original
+    failed and released the key.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    conn = _shared_state_conn()
+    while time.monotonic() < deadline:
+        row = conn.execute('SELECT status, body, content_type FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, False
+        if row[0] is not None:
+            return (row[1], row[0], row[2]), False
+        time.sleep(0.05)
+    return None, True
+
+
+def _idempotency_store(key, entry, cached):
+    """Publishes the original response (or releases the key if it should not be cached)."""
+    _idempotency_publish_local(key, entry, cached)
+    if SHARED_STATE:
+        with shared_state_transaction() as conn:
+            if cached is None:
+                conn.execute('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+            else:
+                conn.execute('''UPDATE idempotency_keys SET body = ?, status = ?, content_type = ?
+                                WHERE key = ?''', cached + (key,))
+
+
+def _idempotency_publish_local(key, entry, cached):
+    """Records a response another replica produced (or releases the local claim)."""
+    with _idempotency_lock:
+        if cached is None:
+            _idempotency_cache.pop(key, None)
+        else:
+            entry['response'] = cached
+            entry['at'] = time.time()
+    entry['done'].set()
+
+
+def _idempotency_discard(key, entry):
+    """Forgets a cached response that must not be replayed any more."""
+    with _idempotency_lock:
+        if _idempotency_cache.get(key) is entry:
+            del _idempotency_cache[key]
+    if SHARED_STATE and entry['response'] is not None:
+        _idempotency_discard_shared(key, entry['response'])
+
+
+def _idempotency_discard_shared(key, cached):
+    """Deletes the shared copy of a stale response (unless it has already been replaced)."""
+    with shared_state_transaction() as conn:
+        conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status = ? AND body = ?',
+                     (key, cached[1], cached[0]))
+
+
+def _replay_response(cached, key):
+    """Rebuilds a cached response for a duplicate request."""
+    body, status, content_type = cached
+    send_debug("duplicate_request_replayed", {"endpoint": request.endpoint, "key": key, "status": status})
+    response = Response(body, status=status, content_type=content_type)
+    response.headers['Idempotent-Replay'] = 'true'
+    return response
+
+
+def idempotent(key_func=idempotency_key_from_header, replayable=None):
+    """Makes a POST/DELETE route safe to retry.
+
+    Responses with a 5xx status are not cached, so a retry after a server error
+    runs the handler again; duplicates that were waiting on a failed original
+    run it again too instead of being turned away. replayable(cached) can veto
+    replaying a cached response whose outcome has since failed.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method == 'GET':
+                return f(*args, **kwargs)
+            key = key_func()
+            if not key:
+                return f(*args, **kwargs)
+            key = f"{request.endpoint}:{key}"
+
+            while True:
+                entry, is_owner = _idempotency_claim_local(key)
+                if is_owner:
+                    break
+                if not entry['done'].wait(IDEMPOTENCY_WAIT):
+                    return jsonify({"status": "error", "message": "An identical request is still being processed."}), 409
+                if entry['response'] is not None:
+                    if replayable is None or replayable(entry['response']):
+                        return _replay_response(entry['response'], key)
+                    _idempotency_discard(key, entry)
+                # The original failed (or its outcome did) and released the key; claim it again
+
+            while SHARED_STATE:
+                try:
+                    cached, shared_owner = _idempotency_claim_shared(key)
+                except Exception as e:
+                    send_debug("idempotency_store_error", {"error": str(e)})
+                    cached, shared_owner = None, True
+                if shared_owner:
+                    break
+                # Another replica handled (or is handling) this event
+                still_running = False
+                if cached is None:
+                    cached, still_running = _idempotency_wait_shared(key)
+                if cached is not None and replayable is not None and not replayable(cached):
+                    _idempotency_discard_shared(key, cached)
+                    continue
+                if cached is not None:
+                    _idempotency_publish_local(key, entry, cached)
+                    return _replay_response(cached, key)
+                if still_running:
+                    _idempotency_publish_local(key, entry, None)
+                    return jsonify({"status": "error", "message": "An identical request is still being processed."}), 409
+                # That replica failed and released the key; claim it again
+
+            cached = None
+            try:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code < 500 and not response.is_streamed:
+                    cached = (response.get_data(), response.status_code, response.content_type)
+                return response
+            finally:
+                try:
+                    _idempotency_store(key, entry, cached)
+                except Exception as e:
+                    send_debug("idempotency_store_error", {"error": str(e)})
+        return wrapper
+    return decorator
+
+
 # --- Formatting and Helper Functions ---
 
 def validate_phone_number(phone_number, field_name="phone number"):
@@ -385,6 +1594,15 @@ def validate_phone_number(phone_number, field_name="phone number"):
     return True, None
 
 
+def same_phone_number(first, second):
+    """True if two phone numbers match, ignoring formatting and a missing country code."""
+    first_digits = re.sub(r'\D', '', first or '')
+    second_digits = re.sub(r'\D', '', second or '')
+    if not first_digits or not second_digits:
+        return False
+    return first_digits[-10:] == second_digits[-10:]
+
+
 def add_pauses_to_number(text):
     """Adds periods between characters to create pauses for TTS."""
     return '. '.join(list(text)) + '.'
@@ -476,7 +1694,7 @@ def send_sms_to_all_recipients(client, sms_message):
     
     if not recipients_str:
         send_debug("sms_recipients_not_set", {"message": "RECIPIENT_PHONES not configured in admin dashboard"})
-        return
+        return 0
 
     # Parse recipients - support both JSON format (with labels) and comma-separated format
     phone_numbers = []
@@ -497,6 +1715,7 @@ def send_sms_to_all_recipients(client, sms_message):
     
     automated_number = get_setting('TWILIO_AUTOMATED_NUMBER', '')
     
+    sent_count = 0
     for phone_number in phone_numbers:
         try:
             if not phone_number.startswith('+'):
@@ -505,8 +1724,10 @@ def send_sms_to_all_recipients(client, sms_message):
             
             message = client.messages.create(body=sms_message, from_=automated_number, to=phone_number)
             send_debug("sms_sent", {"to": phone_number, "sid": message.sid})
+            sent_count += 1
         except Exception as e:
             send_debug("sms_error", {"to": phone_number, "error": str(e)})
+    return sent_count
 
 def make_emergency_call(emergency_id, emergency_data):
     """Initiates the detailed call to the technician."""
@@ -542,18 +1763,22 @@ def make_emergency_call(emergency_id, emergency_data):
             send_debug("emergency_call_config_error", {"error": str(e)})
             return False, str(e)
         send_debug("twilio_client_created", {"technician_number": technician_number})
+        record_dispatch_progress(emergency_id, "twilio_client", "ready")
         
         # Send SMS
         sms_text = format_emergency_sms(emergency_data)
         try:
             sms_message = client.messages.create(body=sms_text, from_=automated_number, to=technician_number)
             send_debug("primary_sms_sent", {"to": technician_number, "sid": sms_message.sid})
+            record_dispatch_progress(emergency_id, "technician_sms", "sent")
         except Exception as sms_error:
             error_msg = f"Failed to send SMS: {str(sms_error)}"
             send_debug("sms_send_error", {"error": error_msg, "to": technician_number})
+            record_dispatch_progress(emergency_id, "technician_sms", "failed")
             # Continue with call even if SMS fails
         
-        send_sms_to_all_recipients(client, sms_text)
+        sent_count = send_sms_to_all_recipients(client, sms_text)
+        record_dispatch_progress(emergency_id, "recipient_sms", "sent", {"count": sent_count})
 
         # Make call
         message = format_emergency_message(emergency_data)
@@ -566,11 +1791,13 @@ def make_emergency_call(emergency_id, emergency_data):
             )
             
             send_debug("emergency_call_initiated", {"to": technician_number, "call_sid": call.sid})
-            update_active_emergency('technician_call_sid', call.sid)
+            update_active_emergency('technician_call_sid', call.sid, emergency_id=emergency_id)
+            record_dispatch_progress(emergency_id, "technician_call", "initiated", {"call_sid": call.sid})
             return True, "Call initiated successfully"
         except Exception as call_error:
             error_msg = f"Failed to initiate call: {str(call_error)}"
             send_debug("call_initiation_error", {"error": error_msg, "to": technician_number})
+            record_dispatch_progress(emergency_id, "technician_call", "failed")
             return False, error_msg
             
     except Exception as e:
@@ -720,7 +1947,65 @@ def api_status():
     return jsonify({"status": status, "message": status_message})
 
 
+@app.route('/api/queue', methods=['GET'])
+def api_queue():
+    """Reports intake queue depth, order and wait times."""
+    now = datetime.now()
+    active = get_active_emergency()
+    queued = get_intake_queue()
+    waits = list(_recent_queue_waits)
+
+    queued_view = []
+    for position, emergency in enumerate(queued, 1):
+        queued_at = emergency.get('queued_at')
+        queued_view.append({
+            "ticket_id": emergency.get('id'),
+            "position": position,
+            "priority": emergency.get('priority', 0),
+            "queued_at": _iso(queued_at),
+            "waiting_seconds": round((now - queued_at).total_seconds(), 1) if isinstance(queued_at, datetime) else None
+        })
+
+    return jsonify({
+        "depth": len(queued),
+        "capacity": get_intake_queue_size(),
+        "active": {
+            "emergency_id": active.get('id'),
+            "status": active.get('status'),
+            "started_at": _iso(active.get('started_at') or active.get('timestamp'))
+        } if active else None,
+        "queued": queued_view,
+        "oldest_wait_seconds": max((q["waiting_seconds"] or 0 for q in queued_view), default=0),
+        "recent_average_wait_seconds": round(sum(waits) / len(waits), 1) if waits else None
+    })
+
+
+@app.route('/api/emergencies/<emergency_id>', methods=['GET'])
+def api_emergency(emergency_id):
+    """Reports an emergency's progress: queue position, dispatch steps and call state."""
+    emergency, concluded = find_emergency(emergency_id)
+    if emergency is None:
+        return jsonify({"status": "error", "message": "Unknown emergency id"}), 404
+
+    result = {
+        "emergency_id": emergency.get('id'),
+        "status": emergency.get('status'),
+        "concluded": concluded,
+        "created_at": _iso(emergency.get('timestamp')),
+        "started_at": _iso(emergency.get('started_at')),
+        "priority": emergency.get('priority', 0),
+        "dispatch": emergency.get('dispatch'),
+        "technician_call_sid": emergency.get('technician_call_sid'),
+        "conference_status": emergency.get('conference_status')
+    }
+    if emergency.get('status') == 'queued' and not concluded:
+        queued_ids = [e.get('id') for e in get_intake_queue()]
+        result["queue_position"] = queued_ids.index(emergency_id) + 1 if emergency_id in queued_ids else None
+    return jsonify(result)
+
+
 @app.route('/api/reload_settings', methods=['POST'])
+@idempotent()
 def reload_settings():
     """Reload settings from admin dashboard"""
     try:
@@ -735,6 +2020,7 @@ def reload_settings():
         return jsonify({"status": "error", "message": "Failed to reload settings"}), 500
 
 @app.route('/api/logs', methods=['GET', 'DELETE'])
+@idempotent()
 def api_logs():
     """Returns or clears logs from the application.
     
@@ -753,10 +2039,7 @@ def api_logs():
             log_path = LOG_PATH
             if os.path.exists(log_path):
                 # Archive the log file with timestamp
-                archive_path = os.path.join(
-                    os.path.dirname(log_path), 
-                    f"app.log.cleared.{int(time.time())}"
-                )
+                archive_path = log_archive_path('cleared')
                 os.rename(log_path, archive_path)
                 send_debug("logs_cleared_via_api", {
                     "archive_path": archive_path,
@@ -835,11 +2118,51 @@ def api_logs():
         }), 500
 
 
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """Streams log events oldest first as NDJSON (one JSON object per line).
+
+    Query parameters (all optional):
+    - since, until: ISO 8601 time range
+    - event: comma-separated event types (e.g. sms_send_error,webhook_call_failed)
+    - status: success or error
+    - emergency_id: events for one emergency
+    - q: case-insensitive text search in event data
+    - limit: stop after this many events
+    The log is read one block at a time, so memory use does not grow with its size.
+    """
+    try:
+        since = parse_event_time(request.args['since']) if request.args.get('since') else None
+        until = parse_event_time(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "since and until must be ISO 8601 timestamps"}), 400
+    status = request.args.get('status') or None
+    if status not in (None, 'success', 'error'):
+        return jsonify({"status": "error", "message": "status must be success or error"}), 400
+    limit = None
+    if request.args.get('limit'):
+        limit = request.args.get('limit', type=int)
+        if not limit or limit < 0:
+            return jsonify({"status": "error", "message": "limit must be a positive integer"}), 400
+    event_types = {e.strip() for e in request.args.get('event', '').split(',') if e.strip()} or None
+    events = sort_log_events(filter_log_events(iter_log_events(), since, until, event_types, status,
+                                               request.args.get('emergency_id') or None, request.args.get('q') or None))
+    if limit:
+        events = itertools.islice(events, limit)
+
+    def generate():
+        for event in events:
+            yield json.dumps(event, default=str) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
 @app.route('/resolve_errors', methods=['POST'])
+@idempotent()
 def resolve_errors():
     log_path = LOG_PATH
     if os.path.exists(log_path):
-        archive_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"app.log.resolved.{int(time.time())}")
+        archive_path = log_archive_path('resolved')
         try:
             os.rename(log_path, archive_path)
             send_debug("errors_resolved", {"archive_path": archive_path})
@@ -849,6 +2172,7 @@ def resolve_errors():
 
 
 @app.route('/debug_firehose', methods=['POST', 'GET'])
+@idempotent()
 def debug_firehose():
     """Posts a log dump and parsed timeline to a webhook URL.
 
@@ -910,16 +2234,14 @@ def debug_firehose():
     return jsonify({"target": target, "results": results, "timeline_count": len(timeline)})
 
 @app.route('/webhook', methods=['POST'])
+@idempotent(idempotency_key_from_payload, replayable=webhook_replay_is_current)
 def webhook_listener():
     """Starts the emergency workflow."""
     send_debug("webhook_received", {"method": request.method, "url": request.url})
     log_request_details(request)
     send_debug("webhook_state_check", {})
-    if get_active_emergency():
-        current_emergency = get_active_emergency()
-        send_debug("webhook_while_active", {"active_emergency": current_emergency})
-        return jsonify({"status": "error", "message": "System is busy."}), 503
 
+    started_id = None  # set while an admitted emergency has no dispatch running yet
     try:
         data = request.get_json()
         
@@ -946,31 +2268,55 @@ def webhook_listener():
             "customer_call_sid": None,
             "technician_call_sid": None,
             "conference_status": None,
-            "conference_duration": None
+            "conference_duration": None,
+            "dispatch": new_dispatch_progress()
         }
-        set_active_emergency(emergency_data)
-
-        # Attempt to make the emergency call
-        success, message = make_emergency_call(emergency_id, emergency_data)
-        
-        if not success:
-            # Call failed, clear the emergency state and return error
-            clear_active_emergency()
-            send_debug("webhook_call_failed", {"emergency_id": emergency_id, "error": message})
-            # Don't expose detailed error messages to external users for security
-            return jsonify({"status": "error", "message": "Failed to initiate emergency call. Please check configuration and try again."}), 500
-        
-        return jsonify({"status": "success", "message": "Emergency call initiated successfully"}), 200
+        emergency_data['priority'] = get_emergency_priority(emergency_data)
+
+        # Start now if idle, otherwise wait in the intake queue for capacity
+        outcome, position = admit_emergency(emergency_data, get_intake_queue_size())
+        if outcome == 'started':
+            started_id = emergency_id
+        if outcome == 'full':
+            send_debug("webhook_while_active", {"active_emergency": get_active_emergency(), "queue_full": True})
+            return jsonify({"status": "error", "message": "System is busy and the intake queue is full."}), 503
+        if outcome == 'queued':
+            send_debug("emergency_queued", {
+                "emergency_id": emergency_id,
+                "position": position,
+                "priority": emergency_data['priority']
+            })
+            return jsonify({
+                "status": "queued",
+                "message": "System is busy; the emergency has been queued and will start automatically.",
+                "emergency_id": emergency_id,
+                "ticket_id": emergency_id,
+                "position": position,
+                "priority": emergency_data['priority'],
+                "status_url": f"/api/emergencies/{emergency_id}"
+            }), 202
+
+        # Accepted and persisted; notify the technician without holding the caller
+        start_emergency_dispatch(emergency_id, emergency_data)
+        started_id = None
+        return jsonify({
+            "status": "accepted",
+            "message": "Emergency accepted; technician notification is in progress.",
+            "emergency_id": emergency_id,
+            "status_url": f"/api/emergencies/{emergency_id}"
+        }), 202
 
     except Exception as e:
-        # Make sure to clear emergency state on any error
-        clear_active_emergency()
+        # Make sure an emergency we started doesn't stay active with nothing dispatching it
+        if started_id:
+            conclude_emergency(started_id)
         send_debug("webhook_processing_error", {"error": str(e)})
         # Don't expose detailed error messages to external users for security
         return jsonify({"status": "error", "message": "An error occurred processing the emergency request."}), 500
 
 
 @app.route('/sms_reply', methods=['POST'])
+@idempotent(idempotency_key_from_twilio())
 def sms_reply():
     send_debug("incoming_sms", {"from": request.form.get('From'), "body": request.form.get('Body')})
     log_request_details(request)
@@ -982,6 +2328,7 @@ def sms_reply():
     return '', 204
 
 @app.route("/incoming_twilio_call", methods=['POST'])
+@idempotent(idempotency_key_from_twilio())
 def handle_incoming_twilio_call():
     """Handles the incoming call from the customer."""
     send_debug("incoming_call", {
@@ -992,9 +2339,26 @@ def handle_incoming_twilio_call():
     })
     
     response = VoiceResponse()
-    emergency = get_active_emergency()
+    caller = request.values.get('From')
+    emergency = get_active_emergency() or {}
     send_debug("emergency_state", {"emergency": emergency})
 
+    # A caller whose own emergency is still waiting in the intake queue must not
+    # be attached to the active one (callers matching neither are, as before)
+    if not (emergency and same_phone_number(emergency.get('user_stated_callback_number'), caller)):
+        for position, queued in enumerate(get_intake_queue(), 1):
+            if same_phone_number(queued.get('user_stated_callback_number'), caller):
+                send_debug("caller_emergency_queued", {
+                    "emergency_id": queued.get('id'),
+                    "position": position,
+                    "call_sid": request.values.get('CallSid')
+                })
+                response.say(f"Your emergency has been received and is number {position} in line. "
+                             "The technician will be notified as soon as they are available. "
+                             "Please call back in a few minutes to be connected.")
+                response.hangup()
+                return str(response), 200, {'Content-Type': 'application/xml'}
+
     if not emergency:
         send_debug("no_active_emergency")
         response.say("There is no active emergency. Please hang up.")
@@ -1002,131 +2366,144 @@ def handle_incoming_twilio_call():
         return str(response), 200, {'Content-Type': 'application/xml'}
 
     emergency_id = emergency.get('id')
-    emergency_status = emergency.get('status')
-    update_active_emergency('status', 'customer_waiting')
-    update_active_emergency('customer_call_sid', request.values.get('CallSid'))
+    with emergency_lock(emergency_id):
+        # Re-read under the lock: technician_call_ended may have just changed the status
+        emergency = get_active_emergency() or {}
+        if emergency.get('id') != emergency_id:
+            send_debug("emergency_mismatch", {
+                "received_id": emergency_id,
+                "active_emergency_id": emergency.get('id') if emergency else None
+            })
+            response.say("There is no active emergency. Please hang up.")
+            response.hangup()
+            return str(response), 200, {'Content-Type': 'application/xml'}
 
-    # Check if technician was already informed (notification completed before customer called)
-    technician_already_informed = (emergency_status == 'technician_informed')
+        emergency_status = emergency.get('status')
+        update_active_emergency('status', 'customer_waiting', emergency_id=emergency_id)
+        update_active_emergency('customer_call_sid', request.values.get('CallSid'), emergency_id=emergency_id)
+
+        # Check if technician was already informed (notification completed before customer called)
+        technician_already_informed = (emergency_status == 'technician_informed')
     
-    if technician_already_informed:
-        send_debug("customer_called_after_notification", {
-            "emergency_id": emergency_id,
-            "previous_status": emergency_status,
-            "action": "will_initiate_connection_immediately"
-        })
+        if technician_already_informed:
+            send_debug("customer_called_after_notification", {
+                "emergency_id": emergency_id,
+                "previous_status": emergency_status,
+                "action": "will_initiate_connection_immediately"
+            })
 
-    try:
-        # Check if transfer call is enabled
-        enable_transfer = get_setting('enable_transfer_call', 'false')
+        try:
+            # Check if transfer call is enabled
+            enable_transfer = get_setting('enable_transfer_call', 'false')
         
-        if enable_transfer == 'true':
-            # Transfer call mode: directly connect to transfer target number
-            transfer_target = get_setting('TRANSFER_TARGET_PHONE_NUMBER', '')
-            transfer_from = get_setting('TWILIO_TRANSFER_NUMBER', '')
+            if enable_transfer == 'true':
+                # Transfer call mode: directly connect to transfer target number
+                transfer_target = get_setting('TRANSFER_TARGET_PHONE_NUMBER', '')
+                transfer_from = get_setting('TWILIO_TRANSFER_NUMBER', '')
             
-            # Validate transfer configuration
-            is_valid, error_msg = validate_phone_number(transfer_target, "transfer target")
-            if not is_valid:
-                send_debug("transfer_config_error", {"error": error_msg})
-                response.say("We apologize, but the transfer service is not properly configured. Please try again later.")
-                response.hangup()
-            else:
-                # Put customer on hold while technician receives notification
-                response.say("Please hold while we notify the technician about your emergency.")
+                # Validate transfer configuration
+                is_valid, error_msg = validate_phone_number(transfer_target, "transfer target")
+                if not is_valid:
+                    send_debug("transfer_config_error", {"error": error_msg})
+                    response.say("We apologize, but the transfer service is not properly configured. Please try again later.")
+                    response.hangup()
+                else:
+                    # Put customer on hold while technician receives notification
+                    response.say("Please hold while we notify the technician about your emergency.")
+                
+                    # Put the customer in a queue with hold music
+                    # They will be transferred after the technician notification call completes
+                    response.enqueue(emergency_id, wait_url="http://com.twilio.music.classical.s3.amazonaws.com/BusyStrings.mp3")
                 
+                    send_debug("customer_queued_for_transfer", {
+                        "emergency_id": emergency_id,
+                        "transfer_target": transfer_target,
+                        "waiting_for_notification": True,
+                        "technician_already_informed": technician_already_informed
+                    })
+                
+                    # Store transfer configuration in emergency state for later use
+                    update_active_emergency('transfer_target', transfer_target)
+                    update_active_emergency('transfer_from', transfer_from)
+                
+                    # If technician was already informed, immediately initiate transfer
+                    # We need to let the TwiML return first, then initiate the transfer
+                    # The transfer will dequeue the customer from the queue
+                    if technician_already_informed:
+                        # Schedule the transfer to happen shortly after this response completes
+                        # Use a background thread to avoid blocking the TwiML response
+                        # Daemon=True is appropriate here because:
+                        # 1. Flask app is long-running, not expected to shutdown during operation
+                        # 2. If process exits, Twilio handles call state independently
+                        # 3. We don't want to delay shutdown waiting for transfers
+                        def delayed_transfer(eid, target, from_num):
+                            try:
+                                time.sleep(CUSTOMER_ENQUEUE_DELAY)
+                                send_debug("delayed_transfer_executing", {
+                                    "emergency_id": eid,
+                                    "transfer_target": target
+                                })
+                                transfer_customer_to_target(eid, target, from_num)
+                            except Exception as e:
+                                send_debug("delayed_transfer_error", {
+                                    "emergency_id": eid,
+                                    "error": str(e),
+                                    "type": str(type(e))
+                                })
+                        threading.Thread(
+                            target=delayed_transfer,
+                            args=(emergency_id, transfer_target, transfer_from),
+                            daemon=True
+                        ).start()
+            else:
+                # Queue mode: original behavior
+                response.say("Please hold while we connect you to the emergency technician.")
+            
                 # Put the customer in a queue with hold music
-                # They will be transferred after the technician notification call completes
                 response.enqueue(emergency_id, wait_url="http://com.twilio.music.classical.s3.amazonaws.com/BusyStrings.mp3")
-                
-                send_debug("customer_queued_for_transfer", {
+
+                send_debug("customer_queued", {
                     "emergency_id": emergency_id,
-                    "transfer_target": transfer_target,
-                    "waiting_for_notification": True,
                     "technician_already_informed": technician_already_informed
                 })
-                
-                # Store transfer configuration in emergency state for later use
-                update_active_emergency('transfer_target', transfer_target)
-                update_active_emergency('transfer_from', transfer_from)
-                
-                # If technician was already informed, immediately initiate transfer
-                # We need to let the TwiML return first, then initiate the transfer
-                # The transfer will dequeue the customer from the queue
+            
+                # If technician was already informed, immediately connect
                 if technician_already_informed:
-                    # Schedule the transfer to happen shortly after this response completes
+                    # Schedule the connection to happen shortly after this response completes
                     # Use a background thread to avoid blocking the TwiML response
-                    # Daemon=True is appropriate here because:
-                    # 1. Flask app is long-running, not expected to shutdown during operation
-                    # 2. If process exits, Twilio handles call state independently
-                    # 3. We don't want to delay shutdown waiting for transfers
-                    def delayed_transfer(eid, target, from_num):
+                    # Daemon=True is appropriate here (same reasoning as transfer mode above)
+                    technician_number = emergency.get('technician_number')
+                    def delayed_connect(eid, tech_num):
                         try:
                             time.sleep(CUSTOMER_ENQUEUE_DELAY)
-                            send_debug("delayed_transfer_executing", {
+                            send_debug("delayed_connect_executing", {
                                 "emergency_id": eid,
-                                "transfer_target": target
+                                "technician_number": tech_num
                             })
-                            transfer_customer_to_target(eid, target, from_num)
+                            connect_technician_to_customer(eid, tech_num)
                         except Exception as e:
-                            send_debug("delayed_transfer_error", {
+                            send_debug("delayed_connect_error", {
                                 "emergency_id": eid,
                                 "error": str(e),
                                 "type": str(type(e))
                             })
                     threading.Thread(
-                        target=delayed_transfer,
-                        args=(emergency_id, transfer_target, transfer_from),
+                        target=delayed_connect,
+                        args=(emergency_id, technician_number),
                         daemon=True
                     ).start()
-        else:
-            # Queue mode: original behavior
-            response.say("Please hold while we connect you to the emergency technician.")
             
-            # Put the customer in a queue with hold music
-            response.enqueue(emergency_id, wait_url="http://com.twilio.music.classical.s3.amazonaws.com/BusyStrings.mp3")
-
-            send_debug("customer_queued", {
-                "emergency_id": emergency_id,
-                "technician_already_informed": technician_already_informed
-            })
-            
-            # If technician was already informed, immediately connect
-            if technician_already_informed:
-                # Schedule the connection to happen shortly after this response completes
-                # Use a background thread to avoid blocking the TwiML response
-                # Daemon=True is appropriate here (same reasoning as transfer mode above)
-                technician_number = emergency.get('technician_number')
-                def delayed_connect(eid, tech_num):
-                    try:
-                        time.sleep(CUSTOMER_ENQUEUE_DELAY)
-                        send_debug("delayed_connect_executing", {
-                            "emergency_id": eid,
-                            "technician_number": tech_num
-                        })
-                        connect_technician_to_customer(eid, tech_num)
-                    except Exception as e:
-                        send_debug("delayed_connect_error", {
-                            "emergency_id": eid,
-                            "error": str(e),
-                            "type": str(type(e))
-                        })
-                threading.Thread(
-                    target=delayed_connect,
-                    args=(emergency_id, technician_number),
-                    daemon=True
-                ).start()
-            
-    except Exception as e:
-        send_debug("call_handling_error", {"error": str(e), "type": str(type(e)), "repr": repr(e)})
-        response.say("We apologize, but there was an error connecting your call. Please try again.")
-        response.hangup()
+        except Exception as e:
+            send_debug("call_handling_error", {"error": str(e), "type": str(type(e)), "repr": repr(e)})
+            response.say("We apologize, but there was an error connecting your call. Please try again.")
+            response.hangup()
 
     send_debug("incoming_twiml", {"twiml": str(response)})
     return str(response), 200, {'Content-Type': 'application/xml'}
 
 
 @app.route("/transfer_complete", methods=['POST'])
+@idempotent(idempotency_key_from_twilio('DialCallStatus', 'CallStatus'))
 def transfer_complete():
     """Callback for when a transfer call completes."""
     emergency_id = request.args.get('emergency_id')
@@ -1137,34 +2514,37 @@ def transfer_complete():
         "call_sid": request.values.get('CallSid')
     })
     
-    emergency = get_active_emergency()
-    send_debug("emergency_state", {"emergency": emergency})
+    # Held until cleanup so a concurrent duplicate callback sees the cleared state
+    with emergency_lock(emergency_id):
+        emergency = get_active_emergency()
+        send_debug("emergency_state", {"emergency": emergency})
 
-    if not emergency or emergency.get('id') != emergency_id:
-        send_debug("emergency_mismatch", {
-            "received_id": emergency_id,
-            "active_emergency_id": emergency.get('id') if emergency else None
-        })
-        return '', 200
+        if not emergency or emergency.get('id') != emergency_id:
+            send_debug("emergency_mismatch", {
+                "received_id": emergency_id,
+                "active_emergency_id": emergency.get('id') if emergency else None
+            })
+            return '', 200
 
-    # Update emergency with transfer details
-    update_active_emergency('conference_status', request.values.get('DialCallStatus'))
-    update_active_emergency('conference_duration', request.values.get('DialCallDuration'))
+        # Update emergency with transfer details
+        update_active_emergency('conference_status', request.values.get('DialCallStatus'))
+        update_active_emergency('conference_duration', request.values.get('DialCallDuration'))
 
-    # Send final email
-    subject, body = format_final_email(get_active_emergency())
-    if subject and body:
-        send_to_all(subject, body)
-        send_debug("final_status_email", {"subject": subject})
+        # Send final email
+        subject, body = format_final_email(get_active_emergency())
+        if subject and body:
+            send_to_all(subject, body)
+            send_debug("final_status_email", {"subject": subject})
 
-    # Clean up
-    clear_active_emergency()
-    send_debug("emergency_concluded", {"emergency_id": emergency_id})
+        # Clean up
+        clear_active_emergency()
+        send_debug("emergency_concluded", {"emergency_id": emergency_id})
 
     return '', 200
 
 
 @app.route("/technician_call_ended", methods=['POST'])
+@idempotent(idempotency_key_from_twilio('CallStatus'))
 def technician_call_ended():
     """Callback for when the initial technician call ends."""
     emergency_id = request.args.get('emergency_id')
@@ -1176,22 +2556,23 @@ def technician_call_ended():
         "price": request.values.get('Price')
     })
     
-    emergency = get_active_emergency()
-    send_debug("emergency_state", {"emergency": emergency})
+    with emergency_lock(emergency_id):
+        emergency = get_active_emergency()
+        send_debug("emergency_state", {"emergency": emergency})
 
-    if not emergency or emergency.get('id') != emergency_id:
-        send_debug("emergency_mismatch", {
-            "received_id": emergency_id,
-            "active_emergency_id": emergency.get('id') if emergency else None
-        })
-        return '', 200
+        if not emergency or emergency.get('id') != emergency_id:
+            send_debug("emergency_mismatch", {
+                "received_id": emergency_id,
+                "active_emergency_id": emergency.get('id') if emergency else None
+            })
+            return '', 200
 
-    # First, check if a customer is already on hold.
-    customer_is_waiting = emergency.get('status') == 'customer_waiting'
-    send_debug("customer_waiting_status", {"customer_is_waiting": customer_is_waiting})
+        # First, check if a customer is already on hold.
+        customer_is_waiting = emergency.get('status') == 'customer_waiting'
+        send_debug("customer_waiting_status", {"customer_is_waiting": customer_is_waiting})
 
-    # Now, update the status to show the technician has been informed.
-    update_active_emergency('status', 'technician_informed')
+        # Now, update the status to show the technician has been informed.
+        update_active_emergency('status', 'technician_informed')
 
     # Check if we're in transfer mode
     transfer_target = emergency.get('transfer_target')
@@ -1371,6 +2752,7 @@ def connect_technician_to_customer(emergency_id, technician_number):
 
 
 @app.route("/conference_status", methods=['POST'])
+@idempotent(idempotency_key_from_twilio('StatusCallbackEvent', 'CallStatus'))
 def conference_status():
     """Callback for when the conference ends."""
     emergency_id = request.args.get('emergency_id')
@@ -1382,31 +2764,52 @@ def conference_status():
         "participant_count": request.values.get('ParticipantCount')
     })
     
-    emergency = get_active_emergency()
-    send_debug("emergency_state", {"emergency": emergency})
+    # Held until cleanup so a concurrent duplicate callback sees the cleared state
+    with emergency_lock(emergency_id):
+        emergency = get_active_emergency()
+        send_debug("emergency_state", {"emergency": emergency})
 
-    if not emergency or emergency.get('id') != emergency_id:
-        send_debug("emergency_mismatch", {
-            "received_id": emergency_id,
-            "active_emergency_id": emergency.get('id') if emergency else None
-        })
-        return '', 200
+        if not emergency or emergency.get('id') != emergency_id:
+            send_debug("emergency_mismatch", {
+                "received_id": emergency_id,
+                "active_emergency_id": emergency.get('id') if emergency else None
+            })
+            return '', 200
 
-    update_active_emergency('conference_status', request.values.get('StatusCallbackEvent'))
-    update_active_emergency('conference_duration', request.values.get('Duration'))
+        update_active_emergency('conference_status', request.values.get('StatusCallbackEvent'))
+        update_active_emergency('conference_duration', request.values.get('Duration'))
 
-    # Send final email
-    subject, body = format_final_email(get_active_emergency())
-    if subject and body:
-        send_to_all(subject, body)
-        send_debug("final_status_email", {"subject": subject})
+        # Send final email
+        subject, body = format_final_email(get_active_emergency())
+        if subject and body:
+            send_to_all(subject, body)
+            send_debug("final_status_email", {"subject": subject})
 
-    # Clean up
-    clear_active_emergency()
-    send_debug("emergency_concluded", {"emergency_id": emergency_id})
+        # Clean up
+        clear_active_emergency()
+        send_debug("emergency_concluded", {"emergency_id": emergency_id})
 
     return '', 200
 
+def start_background_work():
+    """Starts the branch's background threads.
+
+    The multi-tenant host sets DEFER_BACKGROUND_START=1 and calls this itself
+    once every branch has loaded, so no thread runs while it swaps the
+    environment for the next branch.
+    """
+    threading.Thread(target=_settings_watcher, name="settings-watcher", daemon=True).start()
+    if not SHARED_STATE:
+        start_emergency_state_writer()
+    # Resume draining an intake queue restored from disk
+    promote_next_emergency()
+    # Ship log events to the admin dashboard for fleet-wide search
+    start_event_shipper()
+
+
+if os.environ.get('DEFER_BACKGROUND_START') != '1':
+    start_background_work()
+
 if __name__ == '__main__':
     print("=====================================================")
     print(f"Starting Flask App on http://0.0.0.0:{FLASK_PORT}")
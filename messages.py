@@ -45,7 +45,7 @@ def send_debug_messages(event_type, data=None):
 # ==============================================================================
 
 # Configure logging
-log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages.log')
+log_file_path = os.environ.get('MESSAGES_LOG_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages.log')
 logging.basicConfig(
     filename=log_file_path,
     level=logging.INFO,
@@ -0,0 +1,163 @@
+"""Multi-tenant branch host: serves several branches from one process
+
+Each tenant is an independent copy of app.py (its own settings cache, emergency
+state, intake queue, idempotency cache and log file) loaded into this process,
+so the libraries and compiled code are shared while branch state is not.
+
+Requests are routed by Host header when a tenant's PUBLIC_URL has its own
+hostname, otherwise by path prefix (/tuc/webhook -> tenant tuc, /webhook).
+
+app.py reads its configuration from the environment while it loads, so each
+tenant's environment is swapped in only while no tenant has background threads
+running: every tenant loads first, then their threads are started together.
+Environment variables read at runtime (such as proxy settings) are the
+process's own and shared by all tenants.
+
+Run with: gunicorn --worker-class gthread --threads 16 --bind 0.0.0.0:5000 multitenant:app
+"""
+import os
+import sys
+import json
+import types
+import logging
+import threading
+from urllib.parse import urlparse
+
+APP_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Comma-separated branch keys served by this process, e.g. "tuc,poc,rex"
+BRANCH_TENANTS = [key.strip().lower() for key in os.environ.get('BRANCH_TENANTS', '').split(',') if key.strip()]
+# Each tenant logs to <TENANT_LOG_ROOT>/<branch>/app.log (its state DB sits next to it)
+TENANT_LOG_ROOT = os.environ.get('TENANT_LOG_ROOT', '/app/logs')
+
+tenants = {}  # branch key -> loaded app module
+_tenant_hosts = {}  # hostname -> branch key (tenants with a dedicated PUBLIC_URL host)
+_load_lock = threading.Lock()
+_app_code = None
+
+
+def tenant_environment(branch):
+    """Bootstrap environment for one tenant
+
+    Starts from this process's environment; BRANCH_NAME, PUBLIC_URL and LOG_PATH
+    are set per tenant, and any <BRANCH>_<NAME> variable (e.g. TUC_PUBLIC_URL)
+    overrides <NAME> for that tenant only.
+    """
+    env = dict(os.environ)
+    env['BRANCH_NAME'] = branch
+    env['LOG_PATH'] = os.path.join(TENANT_LOG_ROOT, branch, 'app.log')
+    # Threads start in load_tenants once every tenant has loaded
+    env['DEFER_BACKGROUND_START'] = '1'
+    # Without an override the state DB follows LOG_PATH into the tenant's directory
+    env.pop('EMERGENCY_STATE_DB', None)
+    if os.environ.get('PUBLIC_URL'):
+        env['PUBLIC_URL'] = f"{os.environ['PUBLIC_URL'].rstrip('/')}/{branch}"
+    prefix = f'{branch.upper()}_'
+    for name, value in os.environ.items():
+        if name.startswith(prefix):
+            env[name[len(prefix):]] = value
+    return env
+
+
+def load_tenant(branch):
+    """Load a fresh copy of app.py configured for one branch
+
+    app.py and messages.py read their configuration from the environment at
+    import time, so the tenant's environment is swapped in while it loads. Its
+    background threads are not started; see load_tenants.
+    """
+    global _app_code
+    with _load_lock:
+        if _app_code is None:
+            with open(APP_SOURCE, encoding='utf-8') as f:
+                _app_code = compile(f.read(), APP_SOURCE, 'exec')
+        name = f'branch_{branch}'
+        module = types.ModuleType(name)
+        module.__file__ = APP_SOURCE
+        sys.modules[name] = module  # lets Flask find the root path for favicons
+        saved_env = dict(os.environ)
+        env = tenant_environment(branch)
+        # Every tenant imports its own messages module with its own settings
+        sys.modules.pop('messages', None)
+        try:
+            os.environ.clear()
+            os.environ.update(env)
+            exec(_app_code, module.__dict__)
+        except SystemExit:
+            sys.modules.pop(name, None)
+            raise RuntimeError(f"Branch tenant {branch} failed to start")
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+            sys.modules.pop('messages', None)
+    return module
+
+
+def load_tenants(branches):
+    """Load every tenant, then start their background threads
+
+    Also indexes the tenants that have their own hostname.
+    """
+    # Library output (HTTP clients, server) is process-wide; keep it out of the branches' own logs
+    os.makedirs(TENANT_LOG_ROOT, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(TENANT_LOG_ROOT, 'host.log'), level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    for branch in branches:
+        os.makedirs(os.path.join(TENANT_LOG_ROOT, branch), exist_ok=True)
+        tenants[branch] = load_tenant(branch)
+        print(f"Loaded branch tenant {branch} (public URL {tenants[branch].public_url or 'not set'})")
+    for module in tenants.values():
+        module.start_background_work()
+
+    hosts = {}
+    for branch, module in tenants.items():
+        parsed = urlparse(module.public_url or '')
+        if parsed.hostname and parsed.path.strip('/') == '':
+            hosts.setdefault(parsed.hostname.lower(), []).append(branch)
+    _tenant_hosts.clear()
+    _tenant_hosts.update({host: found[0] for host, found in hosts.items() if len(found) == 1})
+
+
+def route_tenant(environ):
+    """Branch key for a request, adjusting SCRIPT_NAME/PATH_INFO for path-prefix routing"""
+    host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+    if host in _tenant_hosts:
+        return _tenant_hosts[host]
+    path = environ.get('PATH_INFO', '')
+    branch = path.lstrip('/').split('/', 1)[0]
+    if branch not in tenants:
+        return None
+    environ['SCRIPT_NAME'] = f"{environ.get('SCRIPT_NAME', '')}/{branch}"
+    environ['PATH_INFO'] = path[len(branch) + 1:]
+    return branch
+
+
+def _json_response(start_response, status, body):
+    data = json.dumps(body).encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(data)))])
+    return [data]
+
+
+def app(environ, start_response):
+    """WSGI entry point dispatching each request to its tenant's Flask app"""
+    branch = route_tenant(environ)
+    if branch is not None:
+        return tenants[branch].app(environ, start_response)
+    if environ.get('PATH_INFO', '') in ('', '/'):
+        return _json_response(start_response, '200 OK', {'tenants': [
+            {'branch': key, 'prefix': f'/{key}', 'public_url': module.public_url}
+            for key, module in tenants.items()
+        ]})
+    return _json_response(start_response, '404 NOT FOUND', {'error': 'Unknown branch'})
+
+
+if not BRANCH_TENANTS:
+    raise RuntimeError("BRANCH_TENANTS must list the branches to serve (e.g. tuc,poc,rex)")
+load_tenants(BRANCH_TENANTS)
+
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+    port = int(os.environ.get('FLASK_PORT', 5000))
+    print(f"Serving branches {', '.join(tenants)} on http://0.0.0.0:{port}")
+    run_simple('0.0.0.0', port, app, threaded=True)
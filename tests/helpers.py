@@ -0,0 +1,29 @@
+"""Shared setup for the branch app tests
+
+The branch app reads its configuration at import time, so it is imported once
+per test run with its log and state database in a throwaway directory, the
+admin dashboard pointed at a closed local port and no background threads.
+"""
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+
+def load_branch():
+    """Import the branch app configured for tests"""
+    if 'app' in sys.modules:
+        return sys.modules['app']
+    data_dir = tempfile.mkdtemp(prefix='branch-test-')
+    atexit.register(shutil.rmtree, data_dir, True)
+    os.environ.update({
+        'LOG_PATH': os.path.join(data_dir, 'app.log'),
+        'MESSAGES_LOG_PATH': os.path.join(data_dir, 'messages.log'),
+        'EMERGENCY_STATE_DB': os.path.join(data_dir, 'emergency_state.db'),
+        'ADMIN_DASHBOARD_URL': 'http://127.0.0.1:9',
+        'DEFER_BACKGROUND_START': '1',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+    return app
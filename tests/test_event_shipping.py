@@ -0,0 +1,64 @@
+"""Shipping log events to the admin dashboard across log archives"""
+import gzip
+import json
+import os
+import unittest
+
+from helpers import load_branch
+
+branch = load_branch()
+
+
+class FakeAdminResponse:
+    status_code = 200
+
+
+class EventShippingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shipped = []
+        self.saved = branch.admin_request
+
+        def admin_request(method, path, data=None, **kwargs):
+            self.shipped.extend(event['data'].get('n') for event in json.loads(gzip.decompress(data))['events']
+                                if event['event'] == 'ship_test')
+            return FakeAdminResponse()
+        branch.admin_request = admin_request
+        self.ship_all()
+        self.shipped.clear()
+
+    def tearDown(self):
+        branch.admin_request = self.saved
+
+    def ship_all(self):
+        for _ in range(20):
+            on_live_log = branch._ship_source()[0] == branch.LOG_PATH
+            if not branch.ship_events() and on_live_log:
+                return
+        self.fail('shipper did not settle on the live log')
+
+    def test_events_logged_before_a_resolve_are_shipped(self):
+        branch.send_debug('ship_test', {'n': 1})
+        response = branch.app.test_client().post('/resolve_errors')
+        self.assertEqual(response.status_code, 302)
+        archives = [entry.path for entry in branch._log_archives()]
+        self.assertTrue(archives)
+        self.assertTrue(all(os.path.dirname(path) == os.path.dirname(branch.LOG_PATH) for path in archives))
+
+        branch.send_debug('ship_test', {'n': 2})
+        self.ship_all()
+        self.assertEqual(self.shipped, [1, 2])
+
+    def test_clear_then_resolve_before_shipping_loses_nothing(self):
+        client = branch.app.test_client()
+        branch.send_debug('ship_test', {'n': 1})
+        self.assertEqual(client.delete('/api/logs').status_code, 200)
+        branch.send_debug('ship_test', {'n': 2})
+        self.assertEqual(client.post('/resolve_errors').status_code, 302)
+        branch.send_debug('ship_test', {'n': 3})
+        self.ship_all()
+        self.assertEqual(self.shipped, [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+"""Query parameter validation for the /api/events stream"""
+import unittest
+
+from helpers import load_branch
+
+branch = load_branch()
+
+
+class EventsApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = branch.app.test_client()
+
+    def test_limit_must_be_a_positive_integer(self):
+        for limit in ('-1', '0', 'ten'):
+            response = self.client.get(f'/api/events?limit={limit}')
+            self.assertEqual(response.status_code, 400, limit)
+            self.assertEqual(response.get_json()['message'], 'limit must be a positive integer')
+
+    def test_valid_limit_streams_events(self):
+        response = self.client.get('/api/events?limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertLessEqual(len(response.get_data(as_text=True).splitlines()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
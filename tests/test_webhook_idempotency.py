@@ -0,0 +1,75 @@
+"""Duplicate /webhook deliveries versus genuine repeat emergencies"""
+import time
+import unittest
+
+from helpers import load_branch
+
+branch = load_branch()
+
+EMERGENCY = {'chosen_phone': '+15551234567', 'customer_name': 'Pat', 'callback_number': '+15557654321'}
+
+
+class WebhookIdempotencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = branch.make_emergency_call, branch.send_to_all
+        self.calls = []
+        branch.make_emergency_call = lambda emergency_id, data: (self.calls.append(emergency_id) or True, 'ok')
+        branch.send_to_all = lambda subject, body: None
+        self.client = branch.app.test_client()
+
+    def tearDown(self):
+        branch.make_emergency_call, branch.send_to_all = self.saved
+        branch.clear_active_emergency()
+        with branch._idempotency_lock:
+            branch._idempotency_cache.clear()
+
+    def post_emergency(self):
+        response = self.client.post('/webhook', json=EMERGENCY)
+        self.assertEqual(response.status_code, 202, response.get_json())
+        return response
+
+    def wait_for_dispatch(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.calls) < count and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(len(self.calls), count)
+
+    def conclude(self, emergency_id):
+        response = self.client.post(f'/conference_status?emergency_id={emergency_id}',
+                                    data={'ConferenceSid': 'CF1', 'StatusCallbackEvent': 'conference-end'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(branch.get_active_emergency().get('id'))
+
+    def test_retry_during_the_emergency_is_replayed(self):
+        first = self.post_emergency()
+        self.wait_for_dispatch(1)
+        retry = self.post_emergency()
+        self.assertEqual(retry.headers.get('Idempotent-Replay'), 'true')
+        self.assertEqual(retry.get_json()['emergency_id'], first.get_json()['emergency_id'])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_repeat_after_conclusion_starts_a_new_emergency(self):
+        first_id = self.post_emergency().get_json()['emergency_id']
+        self.wait_for_dispatch(1)
+        self.conclude(first_id)
+
+        repeat = self.post_emergency()
+        self.assertIsNone(repeat.headers.get('Idempotent-Replay'))
+        self.assertNotEqual(repeat.get_json()['emergency_id'], first_id)
+        self.wait_for_dispatch(2)
+
+    def test_body_hash_is_only_kept_for_the_retry_window(self):
+        first_id = self.post_emergency().get_json()['emergency_id']
+        self.wait_for_dispatch(1)
+        key = next(key for key in branch._idempotency_cache if key.startswith('webhook_listener:'))
+        self.assertEqual(branch._idempotency_ttl(key), branch.IDEMPOTENCY_PAYLOAD_TTL)
+        branch._idempotency_cache[key]['at'] -= branch.IDEMPOTENCY_PAYLOAD_TTL + 1
+        branch.clear_active_emergency()
+
+        repeat = self.post_emergency()
+        self.assertNotEqual(repeat.get_json()['emergency_id'], first_id)
+
+
+if __name__ == '__main__':
+    unittest.main()